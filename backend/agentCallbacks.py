@@ -0,0 +1,42 @@
+import os
+import time
+from langchain_core.callbacks import BaseCallbackHandler
+import metrics
+
+
+class AgentTimer(BaseCallbackHandler):
+    """Times each step of the agent: LLM calls as "agent_llm", Tavily calls as "web_search"."""
+    run_inline = True
+
+    def __init__(self):
+        self.starts = {}
+
+    def _start(self, run_id):
+        self.starts[run_id] = time.perf_counter()
+
+    def _end(self, run_id, stage):
+        start = self.starts.pop(run_id, None)
+        if start is not None:
+            metrics.observe_stage(stage, time.perf_counter() - start)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._end(run_id, "agent_llm")
+        usage = (response.llm_output or {}).get("token_usage")
+        if not usage and response.generations and response.generations[0]:
+            usage = getattr(getattr(response.generations[0][0], "message", None), "usage_metadata", None)
+        metrics.record_usage(os.getenv("DEPLOYMENT_NAME"), usage)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self.starts.pop(run_id, None)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._start(run_id)
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._end(run_id, "web_search")
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self.starts.pop(run_id, None)
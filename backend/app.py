@@ -4,98 +4,264 @@ initClients()
 from config import client
 
 import os
+import time
 import uuid
 from flask_cors import CORS
 from similarCars import callPinecone
-from chromaDBCall import callChromaDB
+from chromaDBCall import callChromaDB, streamChromaDB
 from functionCalling import function_call
-from langchainSearch import callTavilySearch
-from flask import Flask, request, jsonify, send_from_directory
-from audio import empty_audio, request_audio, folder, get_file_name_by_id
+from langchainSearch import callTavilySearch, streamTavilySearch
+from fanOut import callFanOut, streamFanOut
+from chatStream import sse_response, complete, completion_stream, text_stream, image_fields
+from flask import Flask, Response, request, jsonify, send_file, stream_with_context
+from audio import empty_audio
+from ttsPool import request_audio, stream_audio, presynthesize, cancel_presynthesis, pool_metrics, TTSBusy
+import ttsCache
+import imageCache
+import responseCache
+import contextWindow
+import sessionStore
+import metrics
+import subsystems
+from intentRouter import router, route_request
 
 app = Flask(__name__)
 CORS(app)
 modelName = os.getenv("DEPLOYMENT_NAME")
+# Chroma, Pinecone, the search agent, the router centroids and TTS load in the background (subsystems.py).
+subsystems.warm_up()
+
+@app.before_request
+def start_trace():
+    metrics.start_trace()
+
+@app.after_request
+def add_server_timing(response):
+    if metrics.wants_server_timing(request.headers):
+        response.headers["Server-Timing"] = metrics.server_timing()
+        response.headers["Timing-Allow-Origin"] = "*"
+    return response
+
+def session_id(data):
+    """Identifies the conversation, so its new message can cancel stale background work.
+
+    None without a sessionId: per-conversation state (summaries, pre-synthesis)
+    is then not kept, rather than shared by every client behind one address.
+    """
+    return data.get("sessionId") or None
+
+def start_chat(data):
+    """(messages, route, session, new message or None).
+
+    A request with a `message` is answered from its session's history on the
+    server (sessionStore.py); one with a `promptMessageList` carries its own.
+    """
+    session = session_id(data)
+    cancel_presynthesis(session)
+    message = data.get("message")
+    if message is None:
+        prompt_message_list = data.get("promptMessageList", "")
+    else:
+        prompt_message_list = sessionStore.prompt_messages(session, message)
+    return prompt_message_list, route_request(prompt_message_list), session, message
+
+def missing_session(data):
+    return "message" in data and not data.get("sessionId")
 
 @app.route('/api/chat', methods=['POST'])
 def chat():
     try:
+        start = time.perf_counter()
         data = request.get_json()
-        prompt_message_list = data.get("promptMessageList", "")
-        isFunctionCall = data.get("isFunctionCall", False)
-        isDatabaseQuery = data.get("isDatabaseQuery", False)
-        isSimilarCarQuery = data.get("isSimilarCarQuery", False)
-        isLangchainSearch = data.get("isLangchainSearch", False)
-
-        # prompt_message_list[-1]["content"]+=". Câu trả lời thêm nhiều emoticon sinh động"
-
-        if isLangchainSearch:
-            response = callTavilySearch(prompt_message_list)
-            id = uuid.uuid1()
-            return jsonify({"response": { "message":response, "id":id}})
-
-        elif isFunctionCall:
-            function_call_response = function_call(prompt_message_list)
-            # if (function_call_response["response"]):
-            #     request_audio(function_call_response.response.message, function_call_response.response.message.id)
-            return jsonify(function_call_response)
-        
-        elif isDatabaseQuery:
-            response = callChromaDB(prompt_message_list)
-            id = uuid.uuid1()
-            # request_audio(llm_response, id)
-            return jsonify({"response": { "message":response, "id":id}})
-        
-        elif isSimilarCarQuery:
-            response = callPinecone(prompt_message_list)
-            id = uuid.uuid1()
-            # request_audio(llm_response, id)
-            return jsonify({"response": { "message":response, "id":id}})
-
-        # if not message_list:
-        #     return jsonify({'error': 'Message is required'}), 400
-
-        response = client.chat.completions.create(
-            model=modelName, messages=prompt_message_list
+        if missing_session(data):
+            return jsonify({"error": "sessionId is required"}), 400
+        prompt_message_list, route, session, message = start_chat(data)
+        if data.get("stream", False):
+            return stream_reply(prompt_message_list, route, session, message, start)
+        reply = chat_reply(prompt_message_list, route, session)
+        if message is not None:
+            sessionStore.record(session, message, (reply.get("response") or {}).get("message"))
+        router.record(route, time.perf_counter() - start)
+        return jsonify(reply)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+def chat_reply(prompt_message_list, route, session):
+    # prompt_message_list[-1]["content"]+=". Câu trả lời thêm nhiều emoticon sinh động"
+
+    cache_key = responseCache.response_key(prompt_message_list, route)
+    cached = responseCache.lookup(cache_key)
+    if cached is not None:
+        presynthesize(cached["message"], session)
+        if route == "image":
+            return dict(image_fields(cached["images"]), response={"message": cached["message"], "id": uuid.uuid1()})
+        return {"response": {"message": cached["message"], "id": uuid.uuid1()}}
+
+    # Only the newest turns, within the route's token budget, reach the LLM (contextWindow.py).
+    prompt_message_list = contextWindow.fit(prompt_message_list, route, session)
+
+    if route == "search":
+        response = callTavilySearch(prompt_message_list)
+        id = uuid.uuid1()
+        presynthesize(response, session)
+        return {"response": { "message":response, "id":id}}
+
+    elif route == "fanout":
+        response, images = callFanOut(prompt_message_list)
+        id = uuid.uuid1()
+        presynthesize(response, session)
+        return {"images": images, "response": { "message":response, "id":id}}
+
+    elif route == "image":
+        function_call_response = function_call(prompt_message_list)
+        if "error" not in function_call_response:
+            responseCache.store(cache_key, function_call_response["response"]["message"], function_call_response["imageList"])
+        return function_call_response
+
+    elif route == "database":
+        response = callChromaDB(prompt_message_list)
+        id = uuid.uuid1()
+        responseCache.store(cache_key, response)
+        presynthesize(response, session)
+        return {"response": { "message":response, "id":id}}
+
+    elif route == "similar":
+        response = callPinecone(prompt_message_list)
+        id = uuid.uuid1()
+        responseCache.store(cache_key, response)
+        presynthesize(response, session)
+        return {"response": { "message":response, "id":id}}
+
+    response = complete(client, modelName, prompt_message_list)
+
+    assistant_message = response.choices[0].message.content
+    responseCache.store(cache_key, assistant_message)
+    presynthesize(assistant_message, session)
+    return {
+        'response': {
+            "message": assistant_message,
+            "id": response.id
+        },
+    }
+    # use llama model to re write the response , but it is too slow, so comment it out
+    # model_file_path = 'llama-2-7b-chat.Q4_K_M.gguf'
+    # llama_model = LlamaModel(model_file_path)
+    # rs_chatText = llama_model.re_write_response(assistant_message)
+    # return jsonify({
+    #     'response': rs_chatText
+    # })
+
+def stream_chat(prompt_message_list, route, session):
+    cache_key = responseCache.response_key(prompt_message_list, route)
+    cached = responseCache.lookup(cache_key)
+    if cached is not None:
+        return text_stream(cached["message"], id=uuid.uuid1(), images=cached["images"])
+
+    # Only the newest turns, within the route's token budget, reach the LLM (contextWindow.py).
+    prompt_message_list = contextWindow.fit(prompt_message_list, route, session)
+
+    if route == "search":
+        stream = streamTavilySearch(prompt_message_list)
+
+    elif route == "fanout":
+        stream = streamFanOut(prompt_message_list)
+
+    elif route == "image":
+        function_call_response = function_call(prompt_message_list)
+        # On failure function_call still returns a fallback image, which is not cached.
+        if "error" in function_call_response:
+            cache_key = None
+        response = function_call_response.get("response") or {}
+        stream = text_stream(
+            response.get("message", ""),
+            id=response.get("id"),
+            images=function_call_response.get("imageList", function_call_response.get("images")),
         )
 
-        assistant_message = response.choices[0].message.content
-        # request_audio(assistant_message, response.id)
-        return jsonify({
-            'response': {
-                "message": assistant_message,
-                "id": response.id
-            },
-        })
-        # use llama model to re write the response , but it is too slow, so comment it out
-        # model_file_path = 'llama-2-7b-chat.Q4_K_M.gguf'
-        # llama_model = LlamaModel(model_file_path)
-        # rs_chatText = llama_model.re_write_response(assistant_message)
-        # return jsonify({
-        #     'response': rs_chatText
-        # })
+    elif route == "database":
+        stream = streamChromaDB(prompt_message_list)
 
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+    elif route == "similar":
+        stream = text_stream(callPinecone(prompt_message_list), id=uuid.uuid1())
+
+    else:
+        stream = completion_stream(client, modelName, prompt_message_list)
+    return responseCache.recording(stream, cache_key)
+
+def stream_reply(prompt_message_list, route, session, message, start):
+    def on_complete(text):
+        if message is not None:
+            sessionStore.record(session, message, text)
+        router.record(route, time.perf_counter() - start)
+        presynthesize(text, session)
+    return sse_response(lambda: stream_chat(prompt_message_list, route, session), on_complete)
+
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """Same routing as /api/chat, answered as Server-Sent Events."""
+    start = time.perf_counter()
+    data = request.get_json()
+    if missing_session(data):
+        return jsonify({"error": "sessionId is required"}), 400
+    prompt_message_list, route, session, message = start_chat(data)
+    return stream_reply(prompt_message_list, route, session, message, start)
 
 @app.route('/api/getaudio', methods=['POST'])
 def getaudio():
     try:
         data = request.get_json()
-        audio_id = data.get('id', '')
         text = data.get('text', '')
-        return send_from_directory(folder, get_file_name_by_id(audio_id), mimetype="audio/wav")
-
+        # Served from the content-addressed cache; only a miss reaches the TTS pool.
+        return send_file(request_audio(text), mimetype="audio/wav")
+    except TTSBusy as e:
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
-        try:
-            request_audio(text, audio_id)
-            return send_from_directory(folder, get_file_name_by_id(audio_id), mimetype="audio/wav")
-        except Exception as e:
-            return jsonify({'error': str(e)}), 500
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/getaudio/stream', methods=['GET', 'POST'])
+def getaudio_stream():
+    """Chunked WAV of the reply, synthesized and sent sentence by sentence."""
+    data = request.get_json(silent=True) or request.args
+    text = data.get('text', '')
+    if not text.strip():
+        return jsonify({'error': 'text is required'}), 400
+    return Response(
+        stream_with_context(stream_audio(text)),
+        mimetype="audio/wav",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.route('/api/session', methods=['DELETE'])
+def delete_session():
+    """Forget a conversation's history: {"sessionId": ...}."""
+    data = request.get_json(silent=True) or request.args
+    if not data.get("sessionId"):
+        return jsonify({"error": "sessionId is required"}), 400
+    sessionStore.clear(data["sessionId"])
+    return jsonify({"status": "deleted"})
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify({"responses": responseCache.stats(), "tts": ttsCache.stats, "images": imageCache.stats(), "sessions": sessionStore.stats()})
+
+@app.route('/api/router/stats', methods=['GET'])
+def router_stats():
+    return jsonify(router.stats())
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.render(pool_metrics()), mimetype="text/plain; version=0.0.4")
 
 @app.route('/health', methods=['GET'])
+@app.route('/health/live', methods=['GET'])
 def health():
-    return jsonify({"status": "healthy"})
+    """Liveness: the worker answers; plain chat works even while subsystems are still loading."""
+    return jsonify({"status": "healthy", "subsystems": subsystems.readiness()[1]})
+
+@app.route('/health/ready', methods=['GET'])
+def health_ready():
+    ready, statuses = subsystems.readiness()
+    return jsonify({"status": "ready" if ready else "loading", "subsystems": statuses}), 200 if ready else 503
 
 if __name__ == "__main__":
     # If any frontend env value contains 'localhost' (or 127.0.0.1), bind to
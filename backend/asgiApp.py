@@ -0,0 +1,259 @@
+from config import initKey, initClients
+initKey()
+initClients()
+from config import async_client
+
+import os
+import time
+import uuid
+from quart import Quart, Response, request, jsonify, send_file
+from quart_cors import cors
+from similarCars import callPineconeAsync
+from chromaDBCall import callChromaDBAsync, streamChromaDBAsync
+from functionCalling import function_call_async
+from langchainSearch import callTavilySearchAsync, streamTavilySearchAsync
+from fanOut import callFanOutAsync, streamFanOutAsync
+from chatStream import sse_events_async, complete_async, completion_stream_async, text_stream, image_fields
+from audio import empty_audio
+from ttsPool import request_audio, stream_audio, presynthesize, cancel_presynthesis, pool_metrics, TTSBusy
+from upstreams import limit, limited, run_blocking, iterate_blocking
+import ttsCache
+import imageCache
+import responseCache
+import contextWindow
+import sessionStore
+import metrics
+import subsystems
+from intentRouter import router, route_request
+
+# ---- ASGI APP ----
+# The routes of app.py served from one event loop: each request waiting on the
+# LLM, the vector store or TTS costs a coroutine instead of a worker thread, so
+# a single process holds hundreds of concurrent chats. Upstream calls share the
+# pooled clients from config.initClients and are capped per upstream (see
+# upstreams.py). Run with `uvicorn asgiApp:app --host 0.0.0.0 --port 8000`.
+app = cors(Quart(__name__))
+modelName = os.getenv("DEPLOYMENT_NAME")
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+subsystems.warm_up()
+
+@app.before_request
+async def start_trace():
+    metrics.start_trace()
+
+@app.after_request
+async def add_server_timing(response):
+    if metrics.wants_server_timing(request.headers):
+        response.headers["Server-Timing"] = metrics.server_timing()
+        response.headers["Timing-Allow-Origin"] = "*"
+    return response
+
+def session_id(data):
+    """Identifies the conversation, so its new message can cancel stale background work.
+
+    None without a sessionId: per-conversation state (summaries, pre-synthesis)
+    is then not kept, rather than shared by every client behind one address.
+    """
+    return data.get("sessionId") or None
+
+def cached_reply(prompt_message_list, route):
+    """(cache key, cached payload or None); the lookup may embed the question, so it runs off the loop."""
+    cache_key = responseCache.response_key(prompt_message_list, route)
+    return cache_key, responseCache.lookup(cache_key)
+
+async def start_chat(data):
+    """(messages, route, session, new message or None); see app.start_chat."""
+    session = session_id(data)
+    cancel_presynthesis(session)
+    message = data.get("message")
+    if message is None:
+        prompt_message_list = data.get("promptMessageList", "")
+    else:
+        prompt_message_list = await run_blocking("router", sessionStore.prompt_messages, session, message)
+    route = await run_blocking("router", route_request, prompt_message_list)
+    return prompt_message_list, route, session, message
+
+def missing_session(data):
+    return "message" in data and not data.get("sessionId")
+
+@app.route('/api/chat', methods=['POST'])
+async def chat():
+    try:
+        start = time.perf_counter()
+        data = await request.get_json()
+        if missing_session(data):
+            return jsonify({"error": "sessionId is required"}), 400
+        prompt_message_list, route, session, message = await start_chat(data)
+        if data.get("stream", False):
+            return stream_reply(prompt_message_list, route, session, message, start)
+        reply = await chat_reply(prompt_message_list, route, session)
+        if message is not None:
+            await run_blocking("router", sessionStore.record, session, message, (reply.get("response") or {}).get("message"))
+        router.record(route, time.perf_counter() - start)
+        return jsonify(reply)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+async def chat_reply(prompt_message_list, route, session):
+    cache_key, cached = await run_blocking("router", cached_reply, prompt_message_list, route)
+    if cached is not None:
+        presynthesize(cached["message"], session)
+        if route == "image":
+            return dict(image_fields(cached["images"]), response={"message": cached["message"], "id": uuid.uuid1()})
+        return {"response": {"message": cached["message"], "id": uuid.uuid1()}}
+
+    prompt_message_list = contextWindow.fit(prompt_message_list, route, session)
+    if route == "search":
+        response = await callTavilySearchAsync(prompt_message_list)
+        presynthesize(response, session)
+        return {"response": {"message": response, "id": uuid.uuid1()}}
+
+    elif route == "fanout":
+        response, images = await callFanOutAsync(prompt_message_list)
+        presynthesize(response, session)
+        return {"images": images, "response": {"message": response, "id": uuid.uuid1()}}
+
+    elif route == "image":
+        function_call_response = await function_call_async(prompt_message_list)
+        if "error" not in function_call_response:
+            responseCache.store(cache_key, function_call_response["response"]["message"], function_call_response["imageList"])
+        return function_call_response
+
+    elif route == "database":
+        response = await callChromaDBAsync(prompt_message_list)
+        responseCache.store(cache_key, response)
+        presynthesize(response, session)
+        return {"response": {"message": response, "id": uuid.uuid1()}}
+
+    elif route == "similar":
+        response = await callPineconeAsync(prompt_message_list)
+        responseCache.store(cache_key, response)
+        presynthesize(response, session)
+        return {"response": {"message": response, "id": uuid.uuid1()}}
+
+    async with limit("openai"):
+        response = await complete_async(async_client, modelName, prompt_message_list)
+    assistant_message = response.choices[0].message.content
+    responseCache.store(cache_key, assistant_message)
+    presynthesize(assistant_message, session)
+    return {"response": {"message": assistant_message, "id": response.id}}
+
+async def stream_chat(prompt_message_list, route, session):
+    cache_key, cached = await run_blocking("router", cached_reply, prompt_message_list, route)
+    if cached is not None:
+        return text_stream(cached["message"], id=uuid.uuid1(), images=cached["images"])
+
+    prompt_message_list = contextWindow.fit(prompt_message_list, route, session)
+
+    if route == "search":
+        stream = streamTavilySearchAsync(prompt_message_list)
+
+    elif route == "fanout":
+        stream = await streamFanOutAsync(prompt_message_list)
+
+    elif route == "image":
+        function_call_response = await function_call_async(prompt_message_list)
+        # On failure function_call still returns a fallback image, which is not cached.
+        if "error" in function_call_response:
+            cache_key = None
+        response = function_call_response.get("response") or {}
+        stream = text_stream(
+            response.get("message", ""),
+            id=response.get("id"),
+            images=function_call_response.get("imageList", function_call_response.get("images")),
+        )
+
+    elif route == "database":
+        stream = await streamChromaDBAsync(prompt_message_list)
+
+    elif route == "similar":
+        stream = text_stream(await callPineconeAsync(prompt_message_list), id=uuid.uuid1())
+
+    else:
+        stream = limited("openai", completion_stream_async(async_client, modelName, prompt_message_list))
+    return responseCache.recording(stream, cache_key)
+
+def stream_reply(prompt_message_list, route, session, message, start):
+    async def on_complete(text):
+        if message is not None:
+            await run_blocking("router", sessionStore.record, session, message, text)
+        router.record(route, time.perf_counter() - start)
+        presynthesize(text, session)
+
+    response = Response(sse_events_async(lambda: stream_chat(prompt_message_list, route, session), on_complete), mimetype="text/event-stream", headers=SSE_HEADERS)
+    # A long answer may take longer than Quart's default response timeout.
+    response.timeout = None
+    return response
+
+@app.route('/api/chat/stream', methods=['POST'])
+async def chat_stream():
+    """Same routing as /api/chat, answered as Server-Sent Events."""
+    start = time.perf_counter()
+    data = await request.get_json()
+    if missing_session(data):
+        return jsonify({"error": "sessionId is required"}), 400
+    prompt_message_list, route, session, message = await start_chat(data)
+    return stream_reply(prompt_message_list, route, session, message, start)
+
+@app.route('/api/getaudio', methods=['POST'])
+async def getaudio():
+    try:
+        data = await request.get_json()
+        text = data.get('text', '')
+        path = await run_blocking("tts", request_audio, text)
+        return await send_file(path, mimetype="audio/wav")
+    except TTSBusy as e:
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/getaudio/stream', methods=['GET', 'POST'])
+async def getaudio_stream():
+    """Chunked WAV of the reply, synthesized and sent sentence by sentence."""
+    data = await request.get_json(silent=True) or request.args
+    text = data.get('text', '')
+    if not text.strip():
+        return jsonify({'error': 'text is required'}), 400
+    try:
+        # Connecting to the TTS pool may block, so the stream is opened off the loop.
+        audio_stream = await run_blocking("tts", stream_audio, text)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    response = Response(iterate_blocking("tts", audio_stream), mimetype="audio/wav", headers=SSE_HEADERS)
+    response.timeout = None
+    return response
+
+@app.route('/api/session', methods=['DELETE'])
+async def delete_session():
+    """Forget a conversation's history: {"sessionId": ...}."""
+    data = await request.get_json(silent=True) or request.args
+    if not data.get("sessionId"):
+        return jsonify({"error": "sessionId is required"}), 400
+    await run_blocking("router", sessionStore.clear, data["sessionId"])
+    return jsonify({"status": "deleted"})
+
+@app.route('/api/cache/stats', methods=['GET'])
+async def cache_stats():
+    return jsonify({"responses": responseCache.stats(), "tts": ttsCache.stats, "images": imageCache.stats(), "sessions": sessionStore.stats()})
+
+@app.route('/api/router/stats', methods=['GET'])
+async def router_stats():
+    return jsonify(router.stats())
+
+@app.route('/metrics', methods=['GET'])
+async def prometheus_metrics():
+    return Response(metrics.render(await run_blocking("tts", pool_metrics)), mimetype="text/plain; version=0.0.4")
+
+@app.route('/health', methods=['GET'])
+@app.route('/health/live', methods=['GET'])
+async def health():
+    return jsonify({"status": "healthy", "subsystems": subsystems.readiness()[1]})
+
+@app.route('/health/ready', methods=['GET'])
+async def health_ready():
+    ready, statuses = subsystems.readiness()
+    return jsonify({"status": "ready" if ready else "loading", "subsystems": statuses}), 200 if ready else 503
+
+if __name__ == "__main__":
+    empty_audio()
+    app.run(debug=True)
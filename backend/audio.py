@@ -1,8 +1,16 @@
+import re
+import time
+import queue
+import itertools
 import shutil
-import torch
-from scipy.io.wavfile import write
+import struct
+import threading
+from concurrent.futures import CancelledError
+import numpy as np
 import os
-from transformers import VitsModel, AutoTokenizer
+import ttsCache
+import metrics
+from ttsCache import TTS_MODEL_NAME, TTS_SAMPLING_RATE, TTS_OPTIMIZE, OPTIMIZATIONS, parse_optimize
 
 isMac = False
 
@@ -16,8 +24,68 @@ if(isMac is False):
 
 os.makedirs(folder, exist_ok=True)
 
-model = VitsModel.from_pretrained("sonktx/mms-tts-vie-finetuned")
-tokenizer = AutoTokenizer.from_pretrained("sonktx/mms-tts-vie-finetuned")
+# The model is loaded on first use, so processes that only serve cached audio
+# or talk to the TTS pool (ttsPool) never pay for torch or the weights.
+model = None
+tokenizer = None
+_model_lock = threading.Lock()
+
+# ---- CPU INFERENCE OPTIMIZATION ----
+# TTS_OPTIMIZE is a comma-separated list of:
+#   fold - fold the weight norm of the flow's WaveNet layers into plain
+#          weights; otherwise they are recomputed on every forward. Lossless.
+#   int8 - dynamic int8 quantization of the Linear layers (the text encoder's
+#          attention). Lossy: check it with benchmarkTTS.py.
+# "all" enables both; empty keeps the eager float32 model.
+# TTS_TORCH_THREADS sets intra-op threads per process (0 keeps torch's default).
+# TTS_OPTIMIZE and parse_optimize live in ttsCache, whose audio keys include
+# the options: int8 audio is cached apart from float32 audio.
+TTS_TORCH_THREADS = int(os.getenv("TTS_TORCH_THREADS", "0"))
+
+def set_torch_threads(threads):
+  import torch
+  if threads > 0:
+    torch.set_num_threads(threads)
+    try:
+      # Only allowed before the first parallel op; each sentence is one
+      # sequential forward, so inter-op parallelism just adds contention.
+      torch.set_num_interop_threads(1)
+    except RuntimeError:
+      pass
+
+def fold_weight_norm(model):
+  import torch
+  from torch.nn.utils import parametrize
+  for module in model.modules():
+    if parametrize.is_parametrized(module, "weight"):
+      if any(type(p).__name__ == "_WeightNorm" for p in module.parametrizations.weight):
+        parametrize.remove_parametrizations(module, "weight", leave_parametrized=True)
+    elif hasattr(module, "weight_g") and hasattr(module, "weight_v"):
+      torch.nn.utils.remove_weight_norm(module)
+  return model
+
+def optimize_model(model, options):
+  import torch
+  if "fold" in options:
+    model = fold_weight_norm(model)
+  if "int8" in options:
+    model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+  return model
+
+def build_model(optimize=TTS_OPTIMIZE):
+  """A fresh (model, tokenizer) pair with the given TTS_OPTIMIZE options applied."""
+  from transformers import VitsModel, AutoTokenizer
+  tokenizer = AutoTokenizer.from_pretrained(TTS_MODEL_NAME)
+  model = VitsModel.from_pretrained(TTS_MODEL_NAME).eval()
+  return optimize_model(model, parse_optimize(optimize)), tokenizer
+
+def load_model(threads=TTS_TORCH_THREADS):
+  global model, tokenizer
+  with _model_lock:
+    if model is None:
+      set_torch_threads(threads)
+      model, tokenizer = build_model()
+  return model, tokenizer
 
 def empty_audio():
   for filename in os.listdir(folder):
@@ -31,8 +99,10 @@ def empty_audio():
         print(f'Failed to delete {file_path}. Reason: {e}')
 
 def get_audio(text):
+  import torch
+  model, tokenizer = load_model()
   inputs = tokenizer(text, return_tensors="pt")
-  with torch.no_grad():
+  with torch.inference_mode():
       output = model(**inputs).waveform
 
   # Convert waveform to numpy array
@@ -41,15 +111,276 @@ def get_audio(text):
   return waveform
 
 
-def save_audio(waveform, id):
-  file_name = get_file_name_by_id(id)
-  path = os.path.join(folder, file_name)
-  write(path, model.config.sampling_rate| 16000, waveform)
+def save_audio(text, waveform):
+  pcm = to_pcm16(waveform)
+  return ttsCache.store(text, wav_header(get_sampling_rate(), len(pcm)) + pcm)
+
 
+def request_audio(text, id=None, synthesizer=None):
+  """Path of the WAV for `text`, synthesizing it only on a cache miss.
 
-def request_audio(text, id):
-  audio =  get_audio(text)
-  save_audio(audio,id)
+  Audio is cached by content, so `id` is no longer needed to find it.
+  """
+  path = ttsCache.lookup(text)
+  if path is None:
+    path = save_audio(text, synthesize(text, synthesizer))
+  return path
 
 def get_file_name_by_id(id):
   return f"{id}.wav"
+
+
+# ---- STREAMING SYNTHESIS ----
+# Long replies are split into sentences (and over-long sentences into clauses)
+# that are synthesized one after another, so the first audio can be sent as
+# soon as the first sentence is done instead of after the whole reply.
+_MAX_CHUNK_CHARS = 200
+
+def clean_text_for_speech(text):
+  text = re.sub(r"!?\[([^\]]*)\]\([^)]*\)", r"\1", text)  # markdown links/images -> label
+  text = re.sub(r"https?://\S+", " ", text)
+  text = re.sub(r"[*_#`|>~]+", " ", text)
+  return re.sub(r"[ \t]+", " ", text)
+
+def split_sentences(text, max_chars=_MAX_CHUNK_CHARS):
+  chunks = []
+  for sentence in re.split(r"(?<=[.!?…;:])\s+|\n+", clean_text_for_speech(text)):
+    sentence = sentence.strip(" -•\t")
+    if not re.search(r"\w", sentence):
+      continue
+    while len(sentence) > max_chars:
+      cut = sentence.rfind(",", 0, max_chars)
+      if cut <= 0:
+        cut = sentence.rfind(" ", 0, max_chars)
+      if cut <= 0:
+        cut = max_chars
+      chunks.append(sentence[:cut + 1].strip())
+      sentence = sentence[cut + 1:].strip()
+    if sentence:
+      chunks.append(sentence)
+  return chunks
+
+def get_sampling_rate():
+  return TTS_SAMPLING_RATE
+
+def wav_header(sample_rate, data_size=0xFFFFFFFF - 36):
+  # The sizes are unknown while streaming; the maximum value tells players to
+  # read until the connection closes.
+  return struct.pack(
+    "<4sI4s4sIHHIIHH4sI",
+    b"RIFF", min(data_size + 36, 0xFFFFFFFF), b"WAVE",
+    b"fmt ", 16, 1, 1, sample_rate, sample_rate * 2, 2, 16,
+    b"data", data_size,
+  )
+
+def to_pcm16(waveform):
+  return (np.clip(waveform, -1.0, 1.0) * 32767).astype("<i2").tobytes()
+
+def stream_audio(text, submit=None):
+  """Yield a 16-bit PCM WAV stream for `text`, one sentence at a time.
+
+  A cached WAV is sent as is; otherwise the streamed audio is also stored.
+  `submit(sentence)` must return an object whose result() is the waveform;
+  it defaults to this process's batcher.
+  """
+  submit = submit or batcher.submit
+  path = ttsCache.lookup(text)
+  if path is not None:
+    with open(path, "rb") as f:
+      while True:
+        chunk = f.read(64 * 1024)
+        if not chunk:
+          return
+        yield chunk
+
+  yield wav_header(get_sampling_rate())
+  # All sentences are queued at once so they can share batches; they are
+  # still sent in order, each as soon as it is ready.
+  pcm_chunks = []
+  for future in [submit(sentence) for sentence in split_sentences(text)]:
+    pcm = to_pcm16(future.result())
+    pcm_chunks.append(pcm)
+    yield pcm
+  pcm = b"".join(pcm_chunks)
+  ttsCache.store(text, wav_header(get_sampling_rate(), len(pcm)) + pcm)
+
+def synthesize(text, synthesizer=None):
+  """Whole-text waveform, synthesized as batched sentences."""
+  synthesizer = synthesizer or batcher
+  futures = [synthesizer.submit(sentence) for sentence in split_sentences(text)]
+  if not futures:
+    return np.zeros(0, dtype=np.float32)
+  return np.concatenate([future.result() for future in futures])
+
+
+# ---- BATCHED SYNTHESIS ----
+# Sentences from every concurrent request go through one queue. The batcher
+# thread groups them into buckets of similar token length (so little compute
+# is spent on padding), runs one inference-mode forward per bucket, and trims each
+# waveform back to its own length.
+TTS_MAX_BATCH = int(os.getenv("TTS_MAX_BATCH", "8"))
+TTS_BATCH_WAIT_MS = float(os.getenv("TTS_BATCH_WAIT_MS", "10"))
+TTS_MAX_PAD_RATIO = float(os.getenv("TTS_MAX_PAD_RATIO", "1.5"))
+
+def get_audio_batch(texts):
+  model, tokenizer = load_model()
+  return run_batch(model, tokenizer, texts)
+
+def run_batch(model, tokenizer, texts):
+  import torch
+  inputs = tokenizer(texts, return_tensors="pt", padding=True)
+  with torch.inference_mode():
+    output = model(**inputs)
+  lengths = output.sequence_lengths.tolist()
+  waveforms = output.waveform.cpu().numpy()
+  return [waveforms[i, :int(lengths[i])] for i in range(len(texts))]
+
+def bucket_by_length(lengths, max_batch=TTS_MAX_BATCH, max_pad_ratio=TTS_MAX_PAD_RATIO):
+  """Group indices so each group's longest item is at most max_pad_ratio x its shortest."""
+  buckets = []
+  current = []
+  for i in sorted(range(len(lengths)), key=lambda i: lengths[i]):
+    if current and (
+      len(current) >= max_batch
+      or lengths[i] > max(lengths[current[0]], 1) * max_pad_ratio
+    ):
+      buckets.append(current)
+      current = []
+    current.append(i)
+  if current:
+    buckets.append(current)
+  # Oldest request first, so a stream's first sentence is not starved.
+  buckets.sort(key=min)
+  return buckets
+
+# Foreground sentences (someone is waiting to hear them) always go before
+# background ones (speculative pre-synthesis, see ttsPool.TTSService.presynthesize).
+FOREGROUND = 0
+BACKGROUND = 1
+
+class _Job:
+  def __init__(self, text, priority=FOREGROUND):
+    self.text = text
+    self.priority = priority
+    self.taken = False
+    self.done = threading.Event()
+    self.waveform = None
+    self.error = None
+
+  def result(self):
+    self.done.wait()
+    if self.error is not None:
+      raise self.error
+    return self.waveform
+
+class BatchSynthesizer:
+  """Batches submitted sentences; with an `executor` (e.g. the TTS process
+  pool) the forward passes run there, up to `max_inflight` at a time."""
+
+  def __init__(self, executor=None, max_inflight=1):
+    self.jobs = queue.PriorityQueue()
+    self.seq = itertools.count()
+    self.thread = None
+    self.lock = threading.Lock()
+    self.executor = executor
+    self.inflight = threading.BoundedSemaphore(max_inflight)
+
+  def submit(self, text, priority=FOREGROUND):
+    with self.lock:
+      if self.thread is None:
+        self.thread = threading.Thread(target=self._run, name="tts-batcher", daemon=True)
+        self.thread.start()
+    job = _Job(text, priority)
+    self.jobs.put((priority, next(self.seq), job))
+    return job
+
+  def cancel(self, jobs):
+    """Drop background jobs that have not reached the model yet."""
+    with self.lock:
+      for job in jobs:
+        if not job.taken and job.priority != FOREGROUND and not job.done.is_set():
+          job.error = CancelledError()
+          job.done.set()
+
+  def promote(self, job):
+    """Move a queued background job to the front; False if it was cancelled."""
+    with self.lock:
+      if isinstance(job.error, CancelledError):
+        return False
+      if job.priority != FOREGROUND:
+        job.priority = FOREGROUND
+        if not job.taken:
+          # The stale background entry is skipped once this one is taken.
+          self.jobs.put((FOREGROUND, next(self.seq), job))
+      return True
+
+  def _take(self, block=True, timeout=None):
+    """Next runnable job, or None when the queue stays empty."""
+    while True:
+      try:
+        _, _, job = self.jobs.get(block, timeout)
+      except queue.Empty:
+        return None
+      with self.lock:
+        if not job.taken and not job.done.is_set():
+          job.taken = True
+          return job
+
+  def _collect(self):
+    jobs = [self._take()]
+    # A background batch is kept to one bucket so a foreground sentence
+    # arriving meanwhile waits for at most one forward pass.
+    limit = TTS_MAX_BATCH if jobs[0].priority != FOREGROUND else TTS_MAX_BATCH * 4
+    deadline = time.monotonic() + TTS_BATCH_WAIT_MS / 1000
+    while len(jobs) < limit:
+      timeout = deadline - time.monotonic()
+      job = self._take(block=timeout > 0, timeout=timeout if timeout > 0 else None)
+      if job is None:
+        break
+      jobs.append(job)
+    return jobs
+
+  def _run(self):
+    while True:
+      jobs = self._collect()
+      # The MMS tokenizer is character level, so text length is token length.
+      lengths = [len(job.text) for job in jobs]
+      for bucket in bucket_by_length(lengths):
+        batch = [jobs[i] for i in bucket]
+        texts = [job.text for job in batch]
+        if self.executor is None:
+          try:
+            with metrics.span("tts_batch"):
+              waveforms = get_audio_batch(texts)
+            self._finish(batch, waveforms, None)
+          except Exception as e:
+            self._finish(batch, None, e)
+        else:
+          self.inflight.acquire()
+          start = time.perf_counter()
+          try:
+            future = self.executor.submit(get_audio_batch, texts)
+          except Exception as e:
+            # e.g. a broken pool; fail this batch but keep the batcher alive.
+            self.inflight.release()
+            self._finish(batch, None, e)
+            continue
+          future.add_done_callback(lambda future, batch=batch, start=start: self._on_done(batch, future, start))
+
+  def _on_done(self, batch, future, start):
+    self.inflight.release()
+    # Includes the wait for a free pool process.
+    metrics.observe_stage("tts_batch", time.perf_counter() - start)
+    error = future.exception()
+    self._finish(batch, None if error else future.result(), error)
+
+  @staticmethod
+  def _finish(batch, waveforms, error):
+    for i, job in enumerate(batch):
+      if error is None:
+        job.waveform = waveforms[i]
+      else:
+        job.error = error
+      job.done.set()
+
+batcher = BatchSynthesizer()
@@ -0,0 +1,94 @@
+import time
+import argparse
+import numpy as np
+import audio
+
+# ---- TTS BENCHMARK ----
+# Runs the eager float32 model and an optimized one (TTS_OPTIMIZE options) on
+# the same sentences and reports the real-time factor of each (seconds of
+# compute per second of audio) and how close the optimized audio is to the
+# baseline. Exits with status 1 when the similarity is below --min-similarity.
+#
+#   python benchmarkTTS.py --optimize all --threads 4
+
+SAMPLE_REPLY = (
+    "Xin chào! Tôi là AI agent tư vấn bán xe. "
+    "Với ngân sách dưới một tỷ đồng, bạn có thể tham khảo Toyota Vios, Honda City hoặc Mazda 3. "
+    "Nếu gia đình bạn cần bảy chỗ, Mitsubishi Xpander là lựa chọn tiết kiệm nhiên liệu và rộng rãi. "
+    "Hyundai Tucson có gầm cao, hộp số tự động và nhiều tính năng an toàn. "
+    "Bạn có muốn đăng ký lái thử tại showroom gần nhất không?"
+)
+
+
+def spectrogram(waveform, n_fft=1024, hop=256):
+    """Log-magnitude STFT frames of `waveform`."""
+    waveform = np.asarray(waveform, dtype=np.float32)
+    if len(waveform) < n_fft:
+        waveform = np.pad(waveform, (0, n_fft - len(waveform)))
+    frames = np.lib.stride_tricks.sliding_window_view(waveform, n_fft)[::hop]
+    return np.log1p(np.abs(np.fft.rfft(frames * np.hanning(n_fft), axis=-1)))
+
+
+def spectral_similarity(reference, candidate):
+    """Mean per-frame cosine similarity of the two log spectrograms.
+
+    VITS predicts durations, so the candidate is first stretched onto the
+    reference's frames rather than compared sample by sample.
+    """
+    a = spectrogram(reference)
+    b = spectrogram(candidate)
+    b = b[np.linspace(0, len(b) - 1, len(a)).round().astype(int)]
+    dots = (a * b).sum(axis=1)
+    norms = np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1)
+    return float(np.mean(dots / np.maximum(norms, 1e-9)))
+
+
+def synthesize_all(model, tokenizer, sentences, batch_size, seed):
+    """(wall seconds, waveforms) for `sentences`, seeding each batch identically."""
+    import torch
+    waveforms = []
+    start = time.perf_counter()
+    for i in range(0, len(sentences), batch_size):
+        # VITS samples noise; the same seed per batch keeps both models comparable.
+        torch.manual_seed(seed + i)
+        waveforms.extend(audio.run_batch(model, tokenizer, sentences[i:i + batch_size]))
+    return time.perf_counter() - start, waveforms
+
+
+def measure(name, model, tokenizer, sentences, args):
+    synthesize_all(model, tokenizer, sentences[:1], 1, args.seed)  # warm-up
+    seconds = min(
+        synthesize_all(model, tokenizer, sentences, args.batch, args.seed)[0]
+        for _ in range(args.repeats)
+    )
+    _, waveforms = synthesize_all(model, tokenizer, sentences, args.batch, args.seed)
+    audio_seconds = sum(len(w) for w in waveforms) / audio.get_sampling_rate()
+    print(f"{name:<10} RTF {seconds / audio_seconds:.3f} ({audio_seconds:.1f}s of audio in {seconds:.2f}s)")
+    return seconds, waveforms
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare optimized VITS inference against the eager baseline.")
+    parser.add_argument("--optimize", default="all", help="TTS_OPTIMIZE options to test (default: all)")
+    parser.add_argument("--threads", type=int, default=audio.TTS_TORCH_THREADS, help="intra-op threads (0: torch default)")
+    parser.add_argument("--batch", type=int, default=1, help="sentences per forward pass")
+    parser.add_argument("--repeats", type=int, default=3, help="timed runs; the fastest is reported")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--text", default=SAMPLE_REPLY, help="text to synthesize")
+    parser.add_argument("--min-similarity", type=float, default=0.85)
+    args = parser.parse_args(argv)
+
+    audio.set_torch_threads(args.threads)
+    sentences = audio.split_sentences(args.text)
+    baseline_seconds, baseline = measure("eager", *audio.build_model(""), sentences, args)
+    optimized_seconds, optimized = measure(args.optimize or "eager", *audio.build_model(args.optimize), sentences, args)
+
+    similarities = [spectral_similarity(a, b) for a, b in zip(baseline, optimized)]
+    length_ratio = sum(len(w) for w in optimized) / max(sum(len(w) for w in baseline), 1)
+    print(f"speedup    {baseline_seconds / optimized_seconds:.2f}x")
+    print(f"similarity mean {np.mean(similarities):.3f}, min {min(similarities):.3f}, length ratio {length_ratio:.3f}")
+    return 0 if min(similarities) >= args.min_similarity else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
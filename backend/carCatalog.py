@@ -0,0 +1,65 @@
+import numpy as np
+from databaseCars import database_cars
+
+
+class CarCatalog:
+    """The car catalog, loaded once and indexed for every retrieval path.
+
+    Cars are looked up by id through a dict instead of scanning the list, and
+    the fields that filters work on are also kept as compact column arrays in
+    catalog row order.
+    """
+
+    def __init__(self, cars):
+        self.cars = list(cars)
+        self.ids = [car["id"] for car in self.cars]
+        self.by_id = {car["id"]: car for car in self.cars}
+        self.row_by_id = {car_id: row for row, car_id in enumerate(self.ids)}
+
+        # ---- COLUMNS ----
+        self.price_min = np.array([car["price_min"] for car in self.cars], dtype=np.int64)
+        self.price_max = np.array([car["price_max"] for car in self.cars], dtype=np.int64)
+        self.seats = np.array([car["seats"] for car in self.cars], dtype=np.int16)
+        self.segments = [car["segment"] for car in self.cars]
+        self.fuel_types = [car["fuel_type"] for car in self.cars]
+
+    def __len__(self):
+        return len(self.cars)
+
+    def __iter__(self):
+        return iter(self.cars)
+
+    def get(self, car_id):
+        return self.by_id.get(car_id)
+
+    def get_many(self, car_ids):
+        """Cars for `car_ids` in the same order, skipping unknown ids."""
+        by_id = self.by_id
+        return [by_id[car_id] for car_id in car_ids if car_id in by_id]
+
+
+catalog = CarCatalog(database_cars)
+
+
+# ---- RENDERING ----
+def render_car_list(header, cars):
+    """Reply listing each car with its features, built in one pass."""
+    parts = [header]
+    parts.extend(f"- {car['name']}:\n   {car['features']}\n\n" for car in cars)
+    return "".join(parts)
+
+
+def render_car_context(cars):
+    """Context block describing each car for an LLM prompt."""
+    return "\n\n".join(
+        f"Tên: {car['name']}\n"
+        f"Mô tả: {car['features']}\n"
+        f"Hãng: {car['brand']}\n"
+        f"Loại: {car['segment']}\n"
+        f"Số ghế: {car['seats']}\n"
+        f"Nhiên liệu: {car['fuel_type']}\n"
+        f"Hộp số: {car['transmission']}\n"
+        f"Mã lực: {car['engine_power']}\n"
+        f"Hình ảnh: {car['image_url']}"
+        for car in cars
+    )
@@ -0,0 +1,195 @@
+import re
+import bisect
+from collections import defaultdict
+from carCatalog import catalog
+
+# ---- CONSTRAINT PARSING ----
+# Hard constraints ("dưới 1 tỷ, 7 chỗ, xe điện") are pulled out of the user
+# message and resolved against the catalog before any vector search, so top-k
+# slots are not wasted on cars the LLM would have to throw away.
+
+# "1.200 triệu": a dot before three digits separates thousands; "1.5"/"1,5" are decimals.
+_THOUSANDS = r"\d{1,3}(?:\.\d{3})+"
+_MONEY = rf"({_THOUSANDS}(?![\d.,])|\d+(?:[.,]\d+)?)\s*(tỷ|ty|tỉ|ti|triệu|trieu|tr)\b"
+_UNITS = {"tỷ": 1_000_000_000, "ty": 1_000_000_000, "tỉ": 1_000_000_000, "ti": 1_000_000_000,
+          "triệu": 1_000_000, "trieu": 1_000_000, "tr": 1_000_000}
+# "tầm 1 tỷ", "khoảng 800 triệu" or a bare price is read as a band around the figure.
+_AROUND = 0.15
+# How much a budget is widened when nothing in the catalog matches it.
+_RELAX_BUDGET = 0.2
+
+# keyword -> substring that must appear in the catalog segment (lower-cased)
+SEGMENT_KEYWORDS = {
+    r"suv": ["suv"],
+    r"sedan": ["sedan"],
+    r"hatchback": ["hatchback"],
+    r"mpv": ["mpv"],
+    r"crossover|cuv": ["crossover"],
+    r"bán tải|ban tai|pickup|pick-up": ["pickup"],
+    r"gầm cao": ["suv", "crossover", "pickup"],
+}
+# keyword -> catalog fuel_type values
+FUEL_KEYWORDS = {
+    r"hybrid|lai điện|lai dien": ["Hybrid", "Xăng lai điện"],
+    r"(?<!lai )(?:điện|dien)(?!\s*tử)|\bev\b": ["Điện"],
+    r"dầu|diesel": ["Dầu"],
+    r"xăng|xang": ["Xăng"],
+}
+
+
+def _money(amount, unit):
+    if re.fullmatch(_THOUSANDS, amount):
+        amount = amount.replace(".", "")
+    return int(float(amount.replace(",", ".")) * _UNITS[unit])
+
+
+def parse_constraints(text):
+    """Extract budget, seats, segment and fuel type constraints from a message."""
+    text = text.lower()
+    constraints = {}
+
+    prices = [(m, _money(m.group(1), m.group(2))) for m in re.finditer(_MONEY, text)]
+    if len(prices) >= 2 and re.search(r"đến|den|tới|toi|-|~", text[prices[0][0].end():prices[1][0].start()]):
+        constraints["budget_min"] = min(prices[0][1], prices[1][1])
+        constraints["budget_max"] = max(prices[0][1], prices[1][1])
+    elif prices:
+        match, value = prices[0]
+        before = text[max(0, match.start() - 20):match.start()]
+        if re.search(r"\b(?:dưới|duoi|không quá|khong qua|tối đa|toi da|max)\b|<", before):
+            constraints["budget_max"] = value
+        elif re.search(r"\b(?:trên|tren|hơn|hon|ít nhất|it nhat|từ|tu)\b|>", before):
+            constraints["budget_min"] = value
+        else:
+            constraints["budget_min"] = round(value * (1 - _AROUND))
+            constraints["budget_max"] = round(value * (1 + _AROUND))
+
+    # Unaccented "cho" is also "for/give" ("2 cho tôi"), so only "chỗ" counts.
+    seats = {int(m.group(1)) for m in re.finditer(r"(\d+)\s*(chỗ|ghế|ghe)\b", text)}
+    if seats:
+        constraints["seats"] = seats
+
+    segments = set()
+    for pattern, values in SEGMENT_KEYWORDS.items():
+        if re.search(pattern, text):
+            segments.update(values)
+    if segments:
+        constraints["segments"] = segments
+
+    fuels = set()
+    for pattern, values in FUEL_KEYWORDS.items():
+        if re.search(pattern, text):
+            fuels.update(values)
+    if fuels:
+        constraints["fuel_types"] = fuels
+    return constraints
+
+
+# ---- CATALOG INDEXES ----
+class CatalogFilterIndex:
+    """Precomputed indexes over the catalog for resolving parsed constraints.
+
+    Prices are kept as sorted intervals so a budget bound is one bisect; seats,
+    segment and fuel type are bitmaps (Python ints, bit i = catalog row i) so
+    combining constraints is a handful of bitwise ANDs.
+    """
+
+    def __init__(self, catalog=catalog):
+        self.ids = catalog.ids
+        self.all_rows = (1 << len(catalog)) - 1
+
+        min_order = catalog.price_min.argsort(kind="stable")
+        max_order = catalog.price_max.argsort(kind="stable")
+        self.price_min_keys = catalog.price_min[min_order].tolist()
+        self.price_max_keys = catalog.price_max[max_order].tolist()
+        # Prefix bitmaps: rows whose price_min is among the i cheapest, and
+        # suffix bitmaps: rows whose price_max is among the most expensive.
+        self.min_prefix = [0]
+        for row in min_order.tolist():
+            self.min_prefix.append(self.min_prefix[-1] | (1 << row))
+        self.max_suffix = [0] * (len(max_order) + 1)
+        for i in range(len(max_order) - 1, -1, -1):
+            self.max_suffix[i] = self.max_suffix[i + 1] | (1 << int(max_order[i]))
+
+        self.seats = defaultdict(int)
+        self.segments = defaultdict(int)
+        self.fuel_types = defaultdict(int)
+        for row, (seats, segment, fuel_type) in enumerate(
+            zip(catalog.seats.tolist(), catalog.segments, catalog.fuel_types)
+        ):
+            self.seats[seats] |= 1 << row
+            self.segments[segment] |= 1 << row
+            self.fuel_types[fuel_type] |= 1 << row
+
+    def resolve(self, constraints):
+        """Return (bitmap of matching rows, Chroma/Pinecone `where` filter), or (None, None)."""
+        if not constraints:
+            return None, None
+        rows = self.all_rows
+        where = []
+
+        if "budget_max" in constraints:
+            # Affordable: the cheapest version fits the budget.
+            rows &= self.min_prefix[bisect.bisect_right(self.price_min_keys, constraints["budget_max"])]
+            where.append({"price_min": {"$lte": constraints["budget_max"]}})
+        if "budget_min" in constraints:
+            rows &= self.max_suffix[bisect.bisect_left(self.price_max_keys, constraints["budget_min"])]
+            where.append({"price_max": {"$gte": constraints["budget_min"]}})
+
+        if "seats" in constraints:
+            values = [seats for seats in constraints["seats"] if seats in self.seats]
+            rows &= self._union(self.seats, values)
+            where.append({"seats": {"$in": values}})
+        if "segments" in constraints:
+            values = [segment for segment in self.segments
+                      if any(keyword in segment.lower() for keyword in constraints["segments"])]
+            rows &= self._union(self.segments, values)
+            where.append({"segment": {"$in": values}})
+        if "fuel_types" in constraints:
+            values = [fuel for fuel in constraints["fuel_types"] if fuel in self.fuel_types]
+            rows &= self._union(self.fuel_types, values)
+            where.append({"fuel_type": {"$in": values}})
+
+        return rows, where[0] if len(where) == 1 else {"$and": where}
+
+    @staticmethod
+    def _union(bitmaps, values):
+        rows = 0
+        for value in values:
+            rows |= bitmaps[value]
+        return rows
+
+    def row_ids(self, rows):
+        return [car_id for row, car_id in enumerate(self.ids) if rows >> row & 1]
+
+
+filter_index = CatalogFilterIndex(catalog)
+
+
+def relaxations(constraints):
+    """`constraints`, then looser versions of it: without fuel type, without segment, with a wider budget."""
+    yield constraints
+    relaxed = dict(constraints)
+    for key in ("fuel_types", "segments"):
+        if relaxed.pop(key, None) is not None:
+            yield dict(relaxed)
+    if "budget_min" in relaxed or "budget_max" in relaxed:
+        if "budget_min" in relaxed:
+            relaxed["budget_min"] = round(relaxed["budget_min"] * (1 - _RELAX_BUDGET))
+        if "budget_max" in relaxed:
+            relaxed["budget_max"] = round(relaxed["budget_max"] * (1 + _RELAX_BUDGET))
+        yield relaxed
+
+
+def prefilter(text):
+    """Resolve the constraints in `text` to (candidate ids, where filter).
+
+    When the constraints match no car they are relaxed step by step (see
+    relaxations) and the first that matches is used. Returns (None, None) when
+    there is nothing to filter on or even the loosest version matches nothing,
+    in which case the search stays unfiltered rather than returning nothing.
+    """
+    for constraints in relaxations(parse_constraints(text)):
+        rows, where = filter_index.resolve(constraints)
+        if rows:
+            return filter_index.row_ids(rows), where
+    return None, None
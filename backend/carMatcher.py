@@ -0,0 +1,143 @@
+import re
+from collections import namedtuple
+from carCatalog import catalog
+from keywordAutomaton import KeywordAutomaton
+
+# ---- CAR MATCHER ----
+# Finds the cars a message is about without asking the LLM: one Aho-Corasick
+# pass over every catalog car's name and aliases ("toyota vios", "vios",
+# "cx5", "santa fe"), the catalog brands and other common brands. A model year
+# written after a car ("vios 2019", "đời 2019") is attached to it. This gives
+# function_call the get_car_details arguments for most image requests, so the
+# forced tool call is only made when nothing is recognised.
+
+# Aliases replacing the generated ones ("make model" and the model alone) for
+# names those do not describe well.
+CAR_ALIASES = {
+    "Mazda3 Sport 2.0L": ["mazda3", "mazda 3", "mazda3 sport"],
+    "Hyundai Santa Fe 2.2D": ["hyundai santa fe", "santa fe", "santafe"],
+    "VinFast VF e34": ["vinfast vf e34", "vf e34", "vfe34", "e34"],
+    "Toyota Corolla Cross 1.8V": ["toyota corolla cross", "corolla cross", "toyota corolla", "corolla"],
+    "Toyota Yaris Cross 1.5HEV": ["toyota yaris cross", "yaris cross", "toyota yaris", "yaris"],
+    "Peugeot 2008 GT Line": ["peugeot 2008"],
+    "Kia Morning GT-Line": ["kia morning"],
+}
+# Model names too common as words to match on their own.
+GENERIC_MODELS = {"sport", "cross", "line", "morning", "santa", "vf"}
+# Brands outside the catalog, so "ảnh bmw x5" is still a local query.
+OTHER_BRANDS = [
+    "Mercedes-Benz", "Mercedes", "BMW", "Audi", "Lexus", "Porsche", "Volvo", "Land Rover", "Range Rover",
+    "Subaru", "Isuzu", "Chevrolet", "MG", "Volkswagen", "Tesla", "BYD", "Jaguar", "Jeep", "Lamborghini",
+    "Ferrari", "Bentley", "Rolls-Royce", "Maserati", "Genesis", "Skoda", "Renault", "Daewoo",
+]
+# Words after a brand that are not part of the model ("audi a4 và a6", "bmw x5 nhé").
+STOP_WORDS = {
+    "va", "voi", "nhe", "nha", "di", "xe", "anh", "hinh", "mau", "cua", "cho", "toi", "ban", "oto", "o", "to",
+    "nao", "la", "co", "khong", "gia", "doi", "nam", "and", "or", "the", "with", "car", "cars", "photo",
+    "photos", "image", "images", "picture", "pictures", "of", "please",
+}
+# One word after a brand, with the separators before it.
+NEXT_WORD = re.compile(r"[\s,]*([^\s,.!?;:()]+)")
+MODEL_TOKEN = re.compile(r"[a-z0-9][a-z0-9.-]*$")
+YEAR = re.compile(r"(?:19[89]|20[0-4])\d$")
+# A year right after a car or brand: " 2019", " đời 2019", ", model 2019".
+YEAR_AFTER = re.compile(r"[\s,]*(?:(?:đời|doi|năm|nam|model|bản|ban)\s+)?((?:19[89]|20[0-4])\d)\b")
+# A number of images: "3 tấm", "3 bức hình" (with a classifier) or "3 ảnh". A
+# number glued to a word ("cx5 ảnh") or inside a car mention ("ảnh mazda 3
+# hình đẹp") is not a count.
+IMAGE_COUNT = re.compile(
+    r"(?<![\w.-])(\d{1,2})\s*(?:(tấm|tam|bức|buc)\b(?:\s*(?:ảnh|hình|anh|hinh))?"
+    r"|(?:ảnh|hình|anh|hinh|photos?|images?|pictures?)\b)"
+)
+
+Mention = namedtuple("Mention", "start end car brand query year")
+
+
+def _variants(alias):
+    """`alias` as users write it: "cx-5" also as "cx5" and "cx 5", "vf3" also as "vf 3"."""
+    variants = {alias, alias.replace("-", ""), alias.replace("-", " ")}
+    variants |= {re.sub(r"(?<=[a-z])(?=\d)", " ", variant) for variant in list(variants)}
+    return variants
+
+
+def car_aliases(car):
+    name = car["name"].lower()
+    if car["name"] in CAR_ALIASES:
+        aliases = set(CAR_ALIASES[car["name"]])
+    else:
+        tokens = name.split()
+        aliases = {" ".join(tokens[:2])}
+        model = tokens[1] if len(tokens) > 1 else ""
+        if len(model) >= 3 and re.search(r"[a-z]", model) and model not in GENERIC_MODELS:
+            aliases.add(model)
+    return {name} | {variant for alias in aliases for variant in _variants(alias)}
+
+
+class CarMatcher:
+    def __init__(self, cars, other_brands=OTHER_BRANDS):
+        owners = {}
+        for car in cars:
+            for alias in car_aliases(car):
+                owners.setdefault(alias, []).append(car)
+        # An alias shared by several cars says nothing; their longer names still match.
+        keywords = [(alias, ("car", owned[0])) for alias, owned in owners.items() if len(owned) == 1]
+        brands = {car["brand"].lower(): car["brand"] for car in cars}
+        for brand in other_brands:
+            brands.setdefault(brand.lower(), brand)
+        keywords += [(alias, ("brand", brand)) for alias, brand in brands.items()]
+        self.automaton = KeywordAutomaton(keywords)
+
+    def mentions(self, text):
+        """The cars and brands named in `text`, in order, the longest match winning where they overlap."""
+        matches = sorted(self.automaton.find(text), key=lambda match: (match[0], match[0] - match[1]))
+        mentions, seen, end = [], set(), 0
+        for start, stop, _, (kind, value) in matches:
+            if start < end:
+                continue
+            if kind == "car":
+                car, brand, query = value, value["brand"], value["name"]
+            else:
+                model, stop = self._model_after(text, stop)
+                car, brand, query = None, value, " ".join([value] + model)
+            end = stop
+            year = YEAR_AFTER.match(text.lower(), stop)
+            if year:
+                end = year.end()
+                year = year.group(1)
+            if year:
+                query = f"{query} {year}"
+            if query.lower() not in seen:
+                seen.add(query.lower())
+                mentions.append(Mention(start, end, car, brand, query, year))
+        return mentions
+
+    def _model_after(self, text, stop):
+        """("bmw x5", "mercedes c300"): up to two model-like words right after a brand, and where they end."""
+        model, text = [], text.lower()
+        while len(model) < 2:
+            word = NEXT_WORD.match(text, stop)
+            token = word.group(1) if word else ""
+            if not MODEL_TOKEN.match(token) or token in STOP_WORDS or YEAR.match(token):
+                break
+            if model and IMAGE_COUNT.match(text, word.start(1)):
+                # "bmw x5 3 ảnh": the second number is a count, not part of the model.
+                break
+            model.append(token.upper() if len(token) <= 4 else token.capitalize())
+            stop = word.end()
+        return model, stop
+
+
+def image_count(text, mentions=None):
+    """How many images `text` asks for ("cho xem 3 ảnh ...", "2 tấm vios"), 1 by default.
+
+    `mentions` are matcher.mentions(text), when the caller already has them.
+    """
+    if mentions is None:
+        mentions = matcher.mentions(text)
+    for match in IMAGE_COUNT.finditer(text.lower()):
+        if not any(mention.start <= match.start(1) < mention.end for mention in mentions):
+            return int(match.group(1))
+    return 1
+
+
+matcher = CarMatcher(catalog.cars)
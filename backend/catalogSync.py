@@ -0,0 +1,253 @@
+import os
+import json
+import math
+import hashlib
+import argparse
+from types import SimpleNamespace
+from carCatalog import catalog
+from embeddingCache import get_embeddings, batched, VECTOR_WRITE_BATCH_SIZE
+
+# Bump when the embedded text or the stored metadata layout changes, so every
+# car is considered changed once and re-synced.
+CATALOG_SCHEMA_VERSION = "2"
+
+
+def car_text(car):
+    """Text that is embedded for a car."""
+    return f"""name: {car['name']}
+                    brand: {car['brand']}
+                    price_min: {car['price_min']}
+                    price_max: {car['price_max']}
+                    segment: {car['segment']}
+                    seats: {car['seats']}
+                    fuel_type: {car['fuel_type']}
+                    transmission: {car['transmission']}
+                    """
+
+
+def car_hash(car):
+    payload = json.dumps(car, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(f"{CATALOG_SCHEMA_VERSION}:{payload}".encode("utf-8")).hexdigest()
+
+
+def catalog_fingerprint(cars, model=""):
+    """One hash for the whole catalog, for caches that must follow catalog changes."""
+    digest = hashlib.sha256(str(model).encode("utf-8"))
+    for car in cars:
+        digest.update(car_hash(car).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def diff_catalog(stored_hashes, cars):
+    """Compare {id: content_hash} from a vector store with the catalog.
+
+    Returns (changed_cars, removed_ids): cars that are new or whose content
+    changed, and ids that are stored but no longer in the catalog.
+    """
+    catalog_ids = set()
+    changed = []
+    for car in cars:
+        catalog_ids.add(car["id"])
+        if stored_hashes.get(car["id"]) != car_hash(car):
+            changed.append(car)
+    removed = [car_id for car_id in stored_hashes if car_id not in catalog_ids]
+    return changed, removed
+
+
+# ---- CHROMADB ----
+CHROMA_PATH = os.getenv(
+    "CHROMA_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "chroma"),
+)
+
+
+def chroma_metadata(car):
+    return {"name": car["name"],
+            "brand": car["brand"],
+            "image": car["image_url"],
+            "segment": car["segment"],
+            "seats": car["seats"],
+            "transmission": car["transmission"] ,
+            "fuel_type": car["fuel_type"] ,
+            "engine_power": car["engine_power"],
+            "price_min": car["price_min"],
+            "price_max": car["price_max"],
+            "content_hash": car_hash(car)}
+
+
+def pinecone_metadata(car):
+    # Only the fields the structured pre-filter (carFilters) queries on.
+    return {"segment": car["segment"],
+            "seats": car["seats"],
+            "fuel_type": car["fuel_type"],
+            "price_min": car["price_min"],
+            "price_max": car["price_max"],
+            "content_hash": car_hash(car)}
+
+
+def sync_chroma(collection, cars=catalog.cars):
+    """Bring a Chroma collection in line with the catalog, touching only changed cars."""
+    stored = collection.get(include=["metadatas"])
+    stored_hashes = {
+        car_id: (meta or {}).get("content_hash")
+        for car_id, meta in zip(stored["ids"], stored["metadatas"])
+    }
+    changed, removed = diff_catalog(stored_hashes, cars)
+
+    if changed:
+        embeddings = get_embeddings([car_text(car) for car in changed])
+        rows = list(zip(changed, embeddings))
+        for batch in batched(rows, VECTOR_WRITE_BATCH_SIZE):
+            collection.upsert(
+                embeddings=[embedding for _, embedding in batch],
+                documents=[car["features"] for car, _ in batch],
+                ids=[car["id"] for car, _ in batch],
+                metadatas=[chroma_metadata(car) for car, _ in batch],
+            )
+    for batch in batched(removed, VECTOR_WRITE_BATCH_SIZE):
+        collection.delete(ids=batch)
+
+    print(f"Chroma sync: {len(changed)} upserted, {len(removed)} deleted, {len(cars) - len(changed)} unchanged")
+    return changed, removed
+
+
+# ---- PINECONE ----
+PINECONE_INDEX_NAME = os.getenv("PINECONE_INDEX_NAME", "product-similarity-index")
+PINECONE_DIMENSION = 1536  # text-embedding-3-small output size
+
+
+def pinecone_stored_hashes(index):
+    stored = {}
+    for ids in index.list():
+        for batch in batched(list(ids), VECTOR_WRITE_BATCH_SIZE):
+            vectors = index.fetch(ids=batch).vectors
+            for car_id, vector in vectors.items():
+                stored[car_id] = (vector.metadata or {}).get("content_hash")
+    return stored
+
+
+def sync_pinecone(index, cars=catalog.cars, dry_run=False):
+    """Upsert changed cars into a Pinecone index and delete ids that left the catalog."""
+    changed, removed = diff_catalog(pinecone_stored_hashes(index), cars)
+    if not dry_run:
+        if changed:
+            embeddings = get_embeddings([car_text(car) for car in changed])
+            vectors = [
+                {"id": car["id"], "values": embedding, "metadata": pinecone_metadata(car)}
+                for car, embedding in zip(changed, embeddings)
+            ]
+            for batch in batched(vectors, VECTOR_WRITE_BATCH_SIZE):
+                index.upsert(vectors=batch)
+        for batch in batched(removed, VECTOR_WRITE_BATCH_SIZE):
+            index.delete(ids=batch)
+
+    print(f"Pinecone sync{' (dry run)' if dry_run else ''}: {len(changed)} upserted, {len(removed)} deleted, {len(cars) - len(changed)} unchanged")
+    return changed, removed
+
+
+def _matches_filter(metadata, filter):
+    """Evaluate the subset of Pinecone's metadata filter language carFilters emits."""
+    if not filter:
+        return True
+    if "$and" in filter:
+        return all(_matches_filter(metadata, part) for part in filter["$and"])
+    for field, condition in filter.items():
+        value = metadata.get(field)
+        for op, operand in condition.items():
+            if op == "$eq" and value != operand:
+                return False
+            if op == "$in" and value not in operand:
+                return False
+            if op == "$lte" and (value is None or value > operand):
+                return False
+            if op == "$gte" and (value is None or value < operand):
+                return False
+    return True
+
+
+class LocalPineconeIndex:
+    """In-process stand-in for a Pinecone index, used by PINECONE_LOCAL and checkCatalogSync.py."""
+
+    def __init__(self):
+        self.vectors = {}
+
+    def list(self, limit=100):
+        ids = list(self.vectors)
+        for start in range(0, len(ids), limit):
+            yield ids[start:start + limit]
+
+    def fetch(self, ids):
+        return SimpleNamespace(vectors={
+            car_id: SimpleNamespace(id=car_id, **self.vectors[car_id])
+            for car_id in ids if car_id in self.vectors
+        })
+
+    def upsert(self, vectors):
+        for vector in vectors:
+            if isinstance(vector, dict):
+                car_id, values, metadata = vector["id"], vector["values"], vector.get("metadata")
+            else:
+                car_id, values, metadata = (tuple(vector) + (None,))[:3]
+            self.vectors[car_id] = {"values": list(values), "metadata": metadata or {}}
+        return {"upserted_count": len(vectors)}
+
+    def delete(self, ids):
+        for car_id in ids:
+            self.vectors.pop(car_id, None)
+
+    def query(self, vector, top_k=10, include_metadata=False, filter=None):
+        query_norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+        matches = []
+        for car_id, stored in self.vectors.items():
+            if not _matches_filter(stored["metadata"], filter):
+                continue
+            values = stored["values"]
+            norm = math.sqrt(sum(x * x for x in values)) or 1.0
+            score = sum(a * b for a, b in zip(vector, values)) / (norm * query_norm)
+            matches.append(SimpleNamespace(
+                id=car_id, score=score, metadata=stored["metadata"] if include_metadata else None
+            ))
+        matches.sort(key=lambda match: match.score, reverse=True)
+        return SimpleNamespace(matches=matches[:top_k])
+
+    def describe_index_stats(self):
+        return {"dimension": PINECONE_DIMENSION, "total_vector_count": len(self.vectors)}
+
+
+def connect_pinecone(create=False):
+    from pinecone import Pinecone, ServerlessSpec
+
+    pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
+    if create and PINECONE_INDEX_NAME not in [index["name"] for index in pc.list_indexes()]:
+        pc.create_index(
+            name=PINECONE_INDEX_NAME,
+            dimension=PINECONE_DIMENSION,
+            spec=ServerlessSpec(cloud="aws", region="us-east-1"),
+        )
+    # A known host skips the describe_index round-trip when connecting.
+    host = os.getenv("PINECONE_INDEX_HOST")
+    if host:
+        return pc.Index(host=host)
+    return pc.Index(PINECONE_INDEX_NAME)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sync database_cars into the vector stores.")
+    parser.add_argument("target", choices=["pinecone", "chroma", "all"], nargs="?", default="all")
+    parser.add_argument("--dry-run", action="store_true", help="only report what would change (Pinecone)")
+    args = parser.parse_args(argv)
+
+    from config import initKey, initClients
+    initKey()
+    initClients()
+
+    if args.target in ("pinecone", "all"):
+        sync_pinecone(connect_pinecone(create=not args.dry_run), dry_run=args.dry_run)
+    if args.target in ("chroma", "all"):
+        import chromadb
+        chroma_client = chromadb.PersistentClient(path=CHROMA_PATH)
+        sync_chroma(chroma_client.get_or_create_collection(name="database_cars"))
+
+
+if __name__ == "__main__":
+    main()
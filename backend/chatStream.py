@@ -0,0 +1,170 @@
+import os
+import json
+import uuid
+import time
+from flask import Response, stream_with_context
+import metrics
+
+# ---- SERVER-SENT EVENTS ----
+# A streamed reply is a series of `token` events carrying text deltas, then a
+# single `done` event with the message id (and images, for image lookups). A
+# failure after the stream has started is reported as an `error` event.
+#
+# LLM_STREAM_USAGE asks for the token usage chunk at the end of a streamed
+# completion, so streamed replies are counted in the token metrics too.
+LLM_STREAM_USAGE = os.getenv("LLM_STREAM_USAGE", "1").lower() in ("1", "true", "yes")
+
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+class TokenStream:
+    """Wrap an iterator of text deltas; `id` may be filled in while streaming."""
+
+    def __init__(self, chunks, id=None, images=None):
+        self.chunks = chunks
+        self.id = id
+        self.images = images
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def __aiter__(self):
+        # Async chunks for the ASGI app; plain lists (text_stream) are wrapped.
+        if hasattr(self.chunks, "__aiter__"):
+            return self.chunks.__aiter__()
+        return _async_iter(self.chunks)
+
+
+async def _async_iter(items):
+    for item in items:
+        yield item
+
+
+def complete(client, model, messages, stage="llm", **kwargs):
+    """Non-streamed chat completion, timed as `stage`, with its tokens counted."""
+    with metrics.span(stage):
+        response = client.chat.completions.create(model=model, messages=messages, **kwargs)
+    metrics.record_usage(model, getattr(response, "usage", None))
+    return response
+
+
+async def complete_async(client, model, messages, stage="llm", **kwargs):
+    """complete() for an AsyncOpenAI client."""
+    with metrics.span(stage):
+        response = await client.chat.completions.create(model=model, messages=messages, **kwargs)
+    metrics.record_usage(model, getattr(response, "usage", None))
+    return response
+
+
+def _stream_options():
+    return {"stream_options": {"include_usage": True}} if LLM_STREAM_USAGE else {}
+
+
+def _read_chunk(stream, model, chunk):
+    """Text delta of one completion chunk; records the usage chunk that ends the stream."""
+    stream.id = stream.id or chunk.id
+    if getattr(chunk, "usage", None):
+        metrics.record_usage(model, chunk.usage)
+    if chunk.choices and chunk.choices[0].delta.content:
+        return chunk.choices[0].delta.content
+    return None
+
+
+def completion_stream(client, model, messages):
+    """TokenStream over an OpenAI chat completion, carrying the completion id."""
+    stream = TokenStream(None)
+
+    def chunks():
+        start = time.perf_counter()
+        response = client.chat.completions.create(model=model, messages=messages, stream=True, **_stream_options())
+        for chunk in response:
+            delta = _read_chunk(stream, model, chunk)
+            if delta:
+                yield delta
+        metrics.observe_stage("llm", time.perf_counter() - start)
+
+    stream.chunks = chunks()
+    return stream
+
+
+def completion_stream_async(client, model, messages):
+    """completion_stream for an AsyncOpenAI client; iterate it with `async for`."""
+    stream = TokenStream(None)
+
+    async def chunks():
+        start = time.perf_counter()
+        response = await client.chat.completions.create(
+            model=model, messages=messages, stream=True, **_stream_options()
+        )
+        async for chunk in response:
+            delta = _read_chunk(stream, model, chunk)
+            if delta:
+                yield delta
+        metrics.observe_stage("llm", time.perf_counter() - start)
+
+    stream.chunks = chunks()
+    return stream
+
+
+def text_stream(text, id=None, images=None):
+    """TokenStream for a reply that is already complete."""
+    return TokenStream([text] if text else [], id=id, images=images)
+
+
+def image_fields(images):
+    """`images` (one URL or a list) as reply fields: "images" is the first URL, "imageList" every one."""
+    if isinstance(images, list):
+        return {"images": images[0] if images else None, "imageList": images}
+    return {"images": images}
+
+
+def done_event(stream):
+    done = {"id": stream.id or uuid.uuid1()}
+    if stream.images:
+        done.update(image_fields(stream.images))
+    return sse("done", done)
+
+
+def sse_response(make_stream, on_complete=None):
+    """Flask response streaming `make_stream()` as SSE events.
+
+    `on_complete(text)` is called with the full reply before the `done` event.
+    """
+    def events():
+        try:
+            stream = make_stream()
+            parts = []
+            for delta in stream:
+                parts.append(delta)
+                yield sse("token", {"delta": delta})
+            if on_complete is not None:
+                on_complete("".join(parts))
+            yield done_event(stream)
+        except Exception as e:
+            yield sse("error", {"error": str(e)})
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def sse_events_async(make_stream, on_complete=None):
+    """The events of sse_response for the ASGI app.
+
+    `make_stream` and `on_complete` are coroutine functions.
+    """
+    try:
+        stream = await make_stream()
+        parts = []
+        async for delta in stream:
+            parts.append(delta)
+            yield sse("token", {"delta": delta})
+        if on_complete is not None:
+            await on_complete("".join(parts))
+        yield done_event(stream)
+    except Exception as e:
+        yield sse("error", {"error": str(e)})
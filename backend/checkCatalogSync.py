@@ -0,0 +1,77 @@
+import os
+import sys
+import copy
+import tempfile
+from fakeUpstream import FakeUpstream
+
+# ---- CATALOG SYNC CHECK ----
+# Syncs the catalog into a LocalPineconeIndex twice, with one car changed and
+# one removed in between, and checks that the second sync upserts only the
+# changed car and deletes only the removed one. Embeddings come from
+# fakeUpstream.py, so no API key or network is needed.
+#
+#   python checkCatalogSync.py
+
+
+class RecordingIndex:
+    """LocalPineconeIndex that remembers the ids written by each sync."""
+
+    def __init__(self, index):
+        self.index = index
+        self.upserted = []
+        self.deleted = []
+
+    def __getattr__(self, name):
+        return getattr(self.index, name)
+
+    def upsert(self, vectors):
+        self.upserted += [vector["id"] for vector in vectors]
+        return self.index.upsert(vectors=vectors)
+
+    def delete(self, ids):
+        self.deleted += list(ids)
+        return self.index.delete(ids=ids)
+
+
+def main():
+    upstream = FakeUpstream(latency=0, embedding_latency=0)
+    base_url = upstream.start()
+    os.environ.update(
+        OPENAI_API_KEY="fake",
+        OPENAI_ENDPOINT=base_url,
+        EMBEDDING_CACHE_PATH=os.path.join(tempfile.mkdtemp(), "embeddings.sqlite3"),
+    )
+    from config import initKey, initClients
+    initKey()
+    initClients()
+    from carCatalog import catalog
+    from catalogSync import LocalPineconeIndex, sync_pinecone, car_hash
+
+    cars = copy.deepcopy(catalog.cars)
+    index = RecordingIndex(LocalPineconeIndex())
+    sync_pinecone(index, cars)
+    assert sorted(index.upserted) == sorted(car["id"] for car in cars), "first sync must upsert every car"
+    assert index.deleted == []
+
+    changed, removed = cars[0], cars[-1]
+    changed["price_max"] += 10_000_000
+    cars = cars[:-1]
+    index.upserted, index.deleted = [], []
+    sync_pinecone(index, cars)
+    assert index.upserted == [changed["id"]], f"expected only {changed['id']} upserted, got {index.upserted}"
+    assert index.deleted == [removed["id"]], f"expected only {removed['id']} deleted, got {index.deleted}"
+    stored = index.fetch(ids=[changed["id"], removed["id"]]).vectors
+    assert stored[changed["id"]].metadata["content_hash"] == car_hash(changed)
+    assert removed["id"] not in stored
+
+    index.upserted, index.deleted = [], []
+    sync_pinecone(index, cars)
+    assert index.upserted == [] and index.deleted == [], "an unchanged catalog must not be re-synced"
+
+    upstream.stop()
+    print("catalog sync check passed")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,15 @@
 import os
-import chromadb
-from config import client, embedding_client
-from databaseCars import database_cars
+import subsystems
+from config import client, async_client
+from carCatalog import catalog, render_car_context
+from embeddingCache import get_embedding, get_embedding_async
+from catalogSync import sync_chroma, CHROMA_PATH
+from vectorIndex import use_numpy_backend, get_vector_index
+from carFilters import prefilter
+from chatStream import complete, complete_async, completion_stream, completion_stream_async
+from metrics import span
+from contextWindow import is_summary
+from upstreams import limit, limited, run_blocking
 
 OPENAI_EMBEDDING_API_KEY = os.getenv("OPENAI_EMBEDDING_API_KEY")
 OPENAI_EMBEDDING_ENDPOINT = os.getenv("OPENAI_EMBEDDING_ENDPOINT")
@@ -11,83 +19,101 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_ENDPOINT = os.getenv("OPENAI_ENDPOINT")
 DEPLOYMENT_NAME = os.getenv("DEPLOYMENT_NAME")
 
-# ---- GET EMBEDDING ----
-def get_embedding(text):
-    response = embedding_client.embeddings.create(input=text, model=OPENAI_EMBEDDING_MODEL)
-    return response.data[0].embedding
-
 # ---- CALL LLM ----
-def ask_llm(context, user_input):
+def build_llm_messages(context, user_input):
+    """The catalog prompt: earlier turns (and their summary) as messages, the last request with the cars."""
     system_prompt = """Bạn là một chuyên gia sale trong lĩnh vực mua bán xe hơi.
         Nếu như câu hỏi là những thứ ngoài lĩnh vực này thì hãy trả lời là:
         Xin lỗi bạn đây là câu hỏi nằm ngoài lĩnh vực của tôi. Xin hãy đặt lại câu hỏi."""
     user_prompt = (
-        f"Yêu cầu người dùng: {user_input}\n\n"
+        f"Yêu cầu người dùng: {user_input[-1]['content']}\n\n"
         f"Xe đề xuất:\n{context}\n\n"
         "Dựa vào yêu cầu bên trên và thông tin xe đã cho, hãy đề xuất chiếc xe phù hợp nhất với người dùng."
     )
-    messages = [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": user_prompt},
-    ]
-    response = client.chat.completions.create(model=DEPLOYMENT_NAME, messages=messages)
+    # The client's own system prompt is replaced by the one above.
+    history = [m for m in user_input[:-1] if m.get("role") != "system" or is_summary(m)]
+    return [{"role": "system", "content": system_prompt}] + history + [{"role": "user", "content": user_prompt}]
+
+
+def ask_llm(context, user_input):
+    messages = build_llm_messages(context, user_input)
+    response = complete(client, DEPLOYMENT_NAME, messages)
     return response.choices[0].message.content
 
 
 # ---- CHROMADB ----
-chroma_client = chromadb.Client()
-collection = chroma_client.create_collection(name="database_cars")
-
-# ---- ADD CAR TO CHROMADB ----
-for car in database_cars:
-    var_embedding = f"""name: {car['name']} 
-                    brand: {car['brand']}
-                    price_min: {car['price_min']}
-                    price_max: {car['price_max']}
-                    segment: {car['segment']}
-                    seats: {car['seats']}
-                    fuel_type: {car['fuel_type']}
-                    transmission: {car['transmission']}
-                    """
-    embedding = get_embedding(var_embedding)
-    collection.add(
-        embeddings=[embedding],
-        documents=[car["features"]],
-        ids=[car["id"]],
-        metadatas=[{"name": car["name"], 
-                    "brand": car["brand"], 
-                    "image": car["image_url"], 
-                    "segment": car["segment"], 
-                    "seats": car["seats"], 
-                    "transmission": car["transmission"] , 
-                    "fuel_type": car["fuel_type"] ,
-                    "engine_power": car["engine_power"] }],
-    )
+# The collection lives on disk, so a restart only re-syncs cars that changed.
+# It is opened on first use or by the startup warm-up (subsystems.py).
+# With VECTOR_BACKEND=numpy queries go to the in-process index instead.
+def open_collection():
+    import chromadb
+    chroma_client = chromadb.PersistentClient(path=CHROMA_PATH)
+    collection = chroma_client.get_or_create_collection(name="database_cars")
 
+    # ---- SYNC CARS TO CHROMADB ----
+    sync_chroma(collection, catalog.cars)
+    return collection
 
-def build_context(results, n_context=3):
-    docs = results["documents"][0]
-    metas = results["metadatas"][0]
-    context_str = ""
-    for doc, meta in zip(docs, metas):
-        context_str += (
-            f"Tên: {meta['name']}\n"
-            f"Mô tả: {doc}\n"
-            f"Hãng: {meta['brand']}\n"
-            f"Loại: {meta['segment']}\n"
-            f"Số ghế: {meta['seats']}\n"
-            f"Nhiên liệu: {meta['fuel_type']}\n"
-            f"Hộp số: {meta['transmission']}\n"
-            f"Mã lực: {meta['engine_power']}\n"
-            f"Hình ảnh: {meta['image']}\n\n"
+chroma = subsystems.register("chroma", open_collection, enabled=not use_numpy_backend())
+
+def query_cars(query_embedding, n_results=3, candidate_ids=None, where=None):
+    """Ids of the closest cars from whichever vector backend is configured.
+
+    `candidate_ids` / `where` restrict the search to the cars matching the
+    user's hard constraints (see carFilters.prefilter).
+    """
+    with span("vector_query"):
+        if use_numpy_backend():
+            index = get_vector_index()
+            mask = None if candidate_ids is None else index.id_mask(candidate_ids)
+            return [car_id for car_id, _ in index.query(query_embedding, n_results, mask=mask)]
+        results = chroma.get().query(
+            query_embeddings=[query_embedding], n_results=n_results, where=where, include=["distances"]
         )
-    return context_str.strip()
+        return results["ids"][0]
 
 
-def callChromaDB(user_input):
+def build_context(car_ids, n_context=3):
+    return render_car_context(catalog.get_many(car_ids[:n_context]))
+
+
+def retrieve_context(user_input):
     userInput = user_input[-1]["content"]
     query_embedding = get_embedding(userInput)
-    results = collection.query(query_embeddings=[query_embedding], n_results=3)
-    context = build_context(results)
+    candidate_ids, where = prefilter(userInput)
+    car_ids = query_cars(query_embedding, n_results=3, candidate_ids=candidate_ids, where=where)
+    return build_context(car_ids)
+
+
+def callChromaDB(user_input):
+    context = retrieve_context(user_input)
     llm_output = ask_llm(context, user_input)
-    return llm_output
\ No newline at end of file
+    return llm_output
+
+
+def streamChromaDB(user_input):
+    """Like callChromaDB, but streams the LLM answer as it is generated."""
+    context = retrieve_context(user_input)
+    return completion_stream(client, DEPLOYMENT_NAME, build_llm_messages(context, user_input))
+
+
+# ---- ASYNC (asgiApp) ----
+async def retrieve_context_async(user_input):
+    userInput = user_input[-1]["content"]
+    async with limit("embedding"):
+        query_embedding = await get_embedding_async(userInput)
+    candidate_ids, where = prefilter(userInput)
+    car_ids = await run_blocking("vector", query_cars, query_embedding, 3, candidate_ids, where)
+    return build_context(car_ids)
+
+
+async def callChromaDBAsync(user_input):
+    context = await retrieve_context_async(user_input)
+    async with limit("openai"):
+        response = await complete_async(async_client, DEPLOYMENT_NAME, build_llm_messages(context, user_input))
+    return response.choices[0].message.content
+
+
+async def streamChromaDBAsync(user_input):
+    context = await retrieve_context_async(user_input)
+    return limited("openai", completion_stream_async(async_client, DEPLOYMENT_NAME, build_llm_messages(context, user_input)))
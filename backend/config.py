@@ -1,30 +1,63 @@
 import os
-from openai import OpenAI
+import httpx
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
+
+# ---- UPSTREAM CONNECTION POOLS ----
+# Every OpenAI client shares one keep-alive pool (one for sync, one for async
+# callers), so concurrent requests reuse warm connections instead of each
+# opening its own.
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "200"))
+OPENAI_MAX_KEEPALIVE = int(os.getenv("OPENAI_MAX_KEEPALIVE", "50"))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
 
 def initKey():
-    os.environ["OPENAI_ENDPOINT"] = "https://aiportalapi.stu-platform.live/jpe"
-    os.environ["OPENAI_API_KEY"] = ""
-    os.environ["DEPLOYMENT_NAME"] = "GPT-4o-mini"
+    # Values already in the environment win, e.g. loadTest.py pointing the app at fakeUpstream.py.
+    os.environ.setdefault("OPENAI_ENDPOINT", "https://aiportalapi.stu-platform.live/jpe")
+    os.environ.setdefault("OPENAI_API_KEY", "")
+    os.environ.setdefault("DEPLOYMENT_NAME", "GPT-4o-mini")
 
-    os.environ["OPENAI_EMBEDDING_ENDPOINT"] = "https://aiportalapi.stu-platform.live/jpe"
-    os.environ["OPENAI_EMBEDDING_API_KEY"] = ""
-    os.environ["OPENAI_EMBEDDING_MODEL"] = "text-embedding-3-small"
+    os.environ.setdefault("OPENAI_EMBEDDING_ENDPOINT", "https://aiportalapi.stu-platform.live/jpe")
+    os.environ.setdefault("OPENAI_EMBEDDING_API_KEY", "")
+    os.environ.setdefault("OPENAI_EMBEDDING_MODEL", "text-embedding-3-small")
 
-    os.environ["PINECONE_API_KEY"] = ""
-    os.environ["TAVILY_API_KEY"] = ""
+    os.environ.setdefault("PINECONE_API_KEY", "")
+    os.environ.setdefault("TAVILY_API_KEY", "")
 
 client = None
 embedding_client = None
+async_client = None
+async_embedding_client = None
 def initClients():
+    limits = httpx.Limits(max_connections=OPENAI_MAX_CONNECTIONS, max_keepalive_connections=OPENAI_MAX_KEEPALIVE)
+    http_client = DefaultHttpxClient(limits=limits, timeout=OPENAI_TIMEOUT)
+    async_http_client = DefaultAsyncHttpxClient(limits=limits, timeout=OPENAI_TIMEOUT)
+
     global client
     client = OpenAI(
         base_url=os.getenv("OPENAI_ENDPOINT"),
         api_key=os.getenv("OPENAI_API_KEY"),
+        http_client=http_client,
     )
 
     global embedding_client
     embedding_client = OpenAI(
         base_url=os.getenv("OPENAI_ENDPOINT"),
         api_key=os.getenv("OPENAI_EMBEDDING_API_KEY"),
+        http_client=http_client,
+    )
+
+    # Used by the ASGI app (asgiApp.py).
+    global async_client
+    async_client = AsyncOpenAI(
+        base_url=os.getenv("OPENAI_ENDPOINT"),
+        api_key=os.getenv("OPENAI_API_KEY"),
+        http_client=async_http_client,
+    )
+
+    global async_embedding_client
+    async_embedding_client = AsyncOpenAI(
+        base_url=os.getenv("OPENAI_ENDPOINT"),
+        api_key=os.getenv("OPENAI_EMBEDDING_API_KEY"),
+        http_client=async_http_client,
     )
     print("Clients initialized successfully")
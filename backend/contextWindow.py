@@ -0,0 +1,202 @@
+import os
+import re
+import hashlib
+import importlib.util
+import threading
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+import config
+from ttlCache import TTLCache
+from chatStream import complete
+from embeddingCache import estimate_tokens
+import metrics
+import subsystems
+
+# ---- CONTEXT WINDOW CONFIG ----
+# Every request's conversation is fitted to a token budget for its route before
+# it reaches the LLM, so prompt size (and latency) stays flat however long the
+# chat gets. Repeated system prompts are merged into one; the newest turns are
+# kept as they are, and older turns that no longer fit are replaced by a
+# running summary of the conversation.
+#
+# Summaries are cached per session and extended incrementally in the
+# background: a request never waits for one, it uses the latest summary (and
+# only trims) while the next one is written. Only requests with an explicit
+# sessionId are summarized, and a cached summary is only used for the turns it
+# actually covers. With CONTEXT_SUMMARY=0 old turns are only trimmed.
+#
+# Tokens are counted with tiktoken (CONTEXT_ENCODING) when it is installed and
+# loaded, else estimated from the UTF-8 length.
+CONTEXT_BUDGETS = {
+    "chat": int(os.getenv("CONTEXT_BUDGET_CHAT", "4000")),
+    "database": int(os.getenv("CONTEXT_BUDGET_DATABASE", "1500")),
+    "search": int(os.getenv("CONTEXT_BUDGET_SEARCH", "2500")),
+    "fanout": int(os.getenv("CONTEXT_BUDGET_FANOUT", "2500")),
+    "image": int(os.getenv("CONTEXT_BUDGET_IMAGE", "1000")),
+    "similar": int(os.getenv("CONTEXT_BUDGET_SIMILAR", "1000")),
+}
+# Routes whose pipeline uses its own system prompt instead of the client's
+# (chromaDBCall.build_llm_messages, functionCalling.function_call) or none at
+# all (similarCars.callPinecone): the client's is dropped, so their budget goes
+# to the conversation. The other budgets include the client's system prompt
+# (about 1000 tokens) and the CONTEXT_KEEP_TURNS newest turns.
+SYSTEM_REPLACED_ROUTES = {"database", "image", "similar"}
+CONTEXT_KEEP_TURNS = int(os.getenv("CONTEXT_KEEP_TURNS", "2"))
+CONTEXT_SUMMARY = os.getenv("CONTEXT_SUMMARY", "1").lower() in ("1", "true", "yes")
+CONTEXT_SUMMARY_TOKENS = int(os.getenv("CONTEXT_SUMMARY_TOKENS", "200"))
+CONTEXT_SUMMARY_TTL_SECONDS = int(os.getenv("CONTEXT_SUMMARY_TTL_SECONDS", "3600"))
+CONTEXT_ENCODING = os.getenv("CONTEXT_ENCODING", "o200k_base")
+DEPLOYMENT_NAME = os.getenv("DEPLOYMENT_NAME")
+# Covered turns remembered per summary; only its newest ones are matched against a request.
+SUMMARY_COVERED_DIGESTS = 64
+# Per-message overhead of the chat format (role and separators).
+MESSAGE_TOKENS = 4
+
+SUMMARY_HEADER = "Tóm tắt các lượt trò chuyện trước:"
+SUMMARY_PROMPT = (
+    "Tóm tắt ngắn gọn cuộc trò chuyện sau giữa khách hàng và chuyên gia tư vấn xe hơi. "
+    "Giữ lại nhu cầu, ngân sách, các mẫu xe đã nhắc đến và những gì đã được trả lời."
+)
+
+# session -> (digests of the turns the summary covers, oldest first, summary)
+summaries = TTLCache(10000, CONTEXT_SUMMARY_TTL_SECONDS)
+_pending = set()
+_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="context-summary")
+
+
+# ---- TOKENS ----
+def _load_encoding():
+    import tiktoken
+    return tiktoken.get_encoding(CONTEXT_ENCODING)
+
+# Optional: until it loads (or without tiktoken) counts are estimated.
+tokenizer = subsystems.register(
+    "tokenizer", _load_encoding, enabled=importlib.util.find_spec("tiktoken") is not None, required=False
+)
+
+
+@lru_cache(maxsize=8192)
+def _exact_tokens(text):
+    return len(tokenizer.peek().encode(text, disallowed_special=()))
+
+
+def count_tokens(text):
+    text = str(text or "")
+    if tokenizer.peek() is None:
+        return estimate_tokens(text)
+    return _exact_tokens(text)
+
+
+def message_tokens(messages):
+    return sum(count_tokens(m.get("content")) + MESSAGE_TOKENS for m in messages)
+
+
+# ---- FITTING ----
+def _normalize(text):
+    return re.sub(r"\s+", " ", str(text or "")).strip()
+
+
+def _digest(message):
+    return hashlib.sha1(f"{message.get('role')}|{_normalize(message.get('content'))}".encode("utf-8")).hexdigest()
+
+
+def merge_system(messages):
+    """One system message from every distinct system prompt in `messages`, or None."""
+    prompts = {}
+    for message in messages:
+        content = str(message.get("content") or "").strip()
+        if message.get("role") == "system" and content:
+            prompts.setdefault(_normalize(content), content)
+    return {"role": "system", "content": "\n\n".join(prompts.values())} if prompts else None
+
+
+def is_summary(message):
+    return message.get("role") == "system" and str(message.get("content", "")).startswith(SUMMARY_HEADER)
+
+
+def fit(messages, route, session=None):
+    """`messages` within the token budget of `route`: one system prompt, a summary of old turns, the newest turns.
+
+    Routes in SYSTEM_REPLACED_ROUTES get no system prompt besides the summary.
+    """
+    if not messages:
+        return messages
+    budget = CONTEXT_BUDGETS.get(route, CONTEXT_BUDGETS["chat"])
+    system = merge_system(messages) if route not in SYSTEM_REPLACED_ROUTES else None
+    turns = [m for m in messages if m.get("role") != "system"]
+    head = [system] if system else []
+    if message_tokens(head + turns) <= budget:
+        return head + turns
+
+    # Room for the summary is kept as soon as something has to go.
+    available = budget - message_tokens(head) - (CONTEXT_SUMMARY_TOKENS if CONTEXT_SUMMARY and session else 0)
+    cut = len(turns)
+    for turn in reversed(turns):
+        cost = message_tokens([turn])
+        if len(turns) - cut >= CONTEXT_KEEP_TURNS and cost > available:
+            break
+        available -= cost
+        cut -= 1
+    dropped, kept = turns[:cut], turns[cut:]
+    summary = summarize(session, dropped) if CONTEXT_SUMMARY and session and dropped else None
+    if summary:
+        head.append({"role": "system", "content": f"{SUMMARY_HEADER}\n{summary}"})
+    return head + kept
+
+
+# ---- SUMMARIES ----
+def _covered(covered, digests):
+    """How many of `digests` (the dropped turns, oldest first) a summary covering `covered` includes.
+
+    The summary's newest turns must be the first dropped turns (older ones may
+    have left the window since); otherwise it belongs to another conversation
+    and None is returned.
+    """
+    if not covered:
+        return 0
+    for n in range(min(len(covered), len(digests)), 0, -1):
+        if tuple(covered[-n:]) == tuple(digests[:n]):
+            return n
+    return None
+
+
+def summarize(session, dropped):
+    """The latest summary of `dropped` for `session`; turns it does not cover yet are summarized in the background."""
+    digests = [_digest(turn) for turn in dropped]
+    covered, summary = summaries.get(session) or ((), "")
+    n = _covered(covered, digests)
+    if n is None:
+        # Not a continuation of this conversation: start over.
+        covered, summary, n = (), "", 0
+    new = list(zip(digests[n:], dropped[n:]))
+    metrics.cache_event("context_summary", not new)
+    if new:
+        with _lock:
+            start = session not in _pending
+            _pending.add(session)
+        if start:
+            _executor.submit(_extend_summary, session, tuple(covered), summary, new)
+    return summary
+
+
+def _extend_summary(session, covered, summary, new):
+    try:
+        transcript = "\n".join(f"{turn.get('role')}: {_normalize(turn.get('content'))}" for _, turn in new)
+        if summary:
+            transcript = f"{SUMMARY_HEADER}\n{summary}\n\n{transcript}"
+        response = complete(
+            config.client,
+            DEPLOYMENT_NAME,
+            [{"role": "system", "content": SUMMARY_PROMPT}, {"role": "user", "content": transcript}],
+            stage="summary",
+            max_tokens=CONTEXT_SUMMARY_TOKENS,
+        )
+        summary = (response.choices[0].message.content or "").strip()
+        covered += tuple(digest for digest, _ in new)
+        summaries.put(session, (covered[-SUMMARY_COVERED_DIGESTS:], summary))
+    except Exception as e:
+        print(f"Conversation summary failed: {e}")
+    finally:
+        with _lock:
+            _pending.discard(session)
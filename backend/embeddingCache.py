@@ -0,0 +1,183 @@
+import os
+import re
+import sqlite3
+import asyncio
+import hashlib
+import threading
+from array import array
+import config
+import metrics
+
+# ---- EMBEDDING CACHE CONFIG ----
+# On-disk store shared by every module (and every gunicorn worker) that needs
+# embeddings. Entries are keyed by (model, sha256 of the normalized text), so a
+# warm restart re-uses every vector it has already paid for.
+EMBEDDING_CACHE_PATH = os.getenv(
+    "EMBEDDING_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "embeddings.sqlite3"),
+)
+# Misses are packed into as few embeddings.create calls as these limits allow.
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "256"))
+EMBEDDING_BATCH_TOKENS = int(os.getenv("EMBEDDING_BATCH_TOKENS", "100000"))
+# Rows per collection.add / index.upsert when writing to a vector store.
+VECTOR_WRITE_BATCH_SIZE = int(os.getenv("VECTOR_WRITE_BATCH_SIZE", "100"))
+
+_local = threading.local()
+
+
+def normalize_text(text):
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def text_hash(text):
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+def embedding_model():
+    return os.getenv("OPENAI_EMBEDDING_MODEL")
+
+
+def estimate_tokens(text):
+    # Cheap upper bound: BPE tokenizers rarely go below ~3 bytes per token for
+    # Vietnamese text, so this never underestimates a request by much.
+    return len(text.encode("utf-8")) // 3 + 1
+
+
+def batched(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def token_batches(texts, max_items=None, max_tokens=None):
+    """Split texts into consecutive batches bounded by item count and token budget."""
+    max_items = max_items or EMBEDDING_BATCH_SIZE
+    max_tokens = max_tokens or EMBEDDING_BATCH_TOKENS
+    batch, batch_tokens = [], 0
+    for text in texts:
+        tokens = estimate_tokens(text)
+        if batch and (len(batch) >= max_items or batch_tokens + tokens > max_tokens):
+            yield batch
+            batch, batch_tokens = [], 0
+        batch.append(text)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+
+def _connection():
+    # One connection per thread; WAL lets many workers read while one writes.
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        os.makedirs(os.path.dirname(EMBEDDING_CACHE_PATH), exist_ok=True)
+        conn = sqlite3.connect(EMBEDDING_CACHE_PATH, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            )"""
+        )
+        conn.commit()
+        _local.conn = conn
+    return conn
+
+
+def _lookup(model, hashes):
+    found = {}
+    conn = _connection()
+    unique = list(dict.fromkeys(hashes))
+    # Stay well under SQLite's bound-parameter limit.
+    for start in range(0, len(unique), 500):
+        chunk = unique[start:start + 500]
+        rows = conn.execute(
+            f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({','.join('?' * len(chunk))})",
+            [model, *chunk],
+        ).fetchall()
+        for key, blob in rows:
+            vector = array("f")
+            vector.frombytes(blob)
+            found[key] = vector.tolist()
+    return found
+
+
+def _store(model, items):
+    conn = _connection()
+    with conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)",
+            [(model, key, array("f", vector).tobytes()) for key, vector in items],
+        )
+
+
+def _embed_remote(texts, model):
+    vectors = []
+    for batch in token_batches(texts):
+        with metrics.span("embedding"):
+            response = config.embedding_client.embeddings.create(input=batch, model=model)
+        metrics.record_usage(model, getattr(response, "usage", None))
+        # The API tags every vector with the position of its input.
+        for item in sorted(response.data, key=lambda item: item.index):
+            vectors.append(item.embedding)
+    return vectors
+
+
+async def _embed_remote_async(texts, model):
+    vectors = []
+    for batch in token_batches(texts):
+        with metrics.span("embedding"):
+            response = await config.async_embedding_client.embeddings.create(input=batch, model=model)
+        metrics.record_usage(model, getattr(response, "usage", None))
+        for item in sorted(response.data, key=lambda item: item.index):
+            vectors.append(item.embedding)
+    return vectors
+
+
+def _missing(model, texts):
+    """(hashes, found vectors by hash, {hash: text} still to embed)."""
+    hashes = [text_hash(text) for text in texts]
+    found = _lookup(model, hashes)
+    missing = {}
+    for key, text in zip(hashes, texts):
+        if key not in found and key not in missing:
+            missing[key] = text
+    metrics.cache_event("embedding", True, len(hashes) - len(missing))
+    metrics.cache_event("embedding", False, len(missing))
+    return hashes, found, missing
+
+
+def get_embeddings(texts):
+    """Return one embedding per text, only calling the API for unseen texts."""
+    model = embedding_model()
+    hashes, found, missing = _missing(model, texts)
+    if missing:
+        vectors = _embed_remote(list(missing.values()), model)
+        fresh = list(zip(missing.keys(), vectors))
+        _store(model, fresh)
+        found.update(fresh)
+    return [found[key] for key in hashes]
+
+
+def get_embedding(text):
+    return get_embeddings([text])[0]
+
+
+async def get_embeddings_async(texts):
+    """get_embeddings for the ASGI app; misses go through the async client.
+
+    The SQLite reads and writes run in a thread, off the event loop.
+    """
+    model = embedding_model()
+    hashes, found, missing = await asyncio.to_thread(_missing, model, texts)
+    if missing:
+        vectors = await _embed_remote_async(list(missing.values()), model)
+        fresh = list(zip(missing.keys(), vectors))
+        await asyncio.to_thread(_store, model, fresh)
+        found.update(fresh)
+    return [found[key] for key in hashes]
+
+
+async def get_embedding_async(text):
+    return (await get_embeddings_async([text]))[0]
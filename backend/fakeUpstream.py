@@ -0,0 +1,277 @@
+import sys
+import json
+import time
+import array
+import base64
+import random
+import hashlib
+import argparse
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ---- FAKE UPSTREAMS ----
+# One local HTTP server standing in for every network dependency of the
+# backend, with configurable latency, so load tests measure our own code
+# rather than the providers:
+#   POST .../chat/completions  OpenAI and Azure OpenAI chat, streamed or not,
+#                              including tool calls
+#   POST .../embeddings        deterministic bag-of-words vectors
+#   POST /query                Pinecone index query (PINECONE_INDEX_HOST)
+#   POST /search               Tavily search (TAVILY_API_BASE_URL)
+#   GET  /images?q=&count=     image lookup (IMAGE_SEARCH_URL)
+#   GET  /stats                requests served per upstream
+#
+#   python fakeUpstream.py --port 8100 --latency-ms 400 --token-delay-ms 15
+
+REPLY_WORDS = (
+    "Dựa trên nhu cầu của bạn, tôi gợi ý một vài mẫu xe phù hợp với ngân sách, số chỗ ngồi "
+    "và mức tiêu hao nhiên liệu. Bạn có thể tham khảo thêm chi phí lăn bánh, bảo hiểm và lịch "
+    "bảo dưỡng trước khi quyết định. 🚗✨"
+).split()
+
+
+def fake_embedding(text, dimensions):
+    """Deterministic bag-of-words vector: texts sharing words get similar vectors."""
+    vector = [0.0] * dimensions
+    for word in str(text).lower().split():
+        vector[int(hashlib.md5(word.encode("utf-8")).hexdigest(), 16) % dimensions] += 1.0
+    return vector
+
+
+class FakeUpstream:
+    def __init__(self, latency=0.4, embedding_latency=0.05, vector_latency=0.02, search_latency=0.8,
+                 image_latency=0.3, token_delay=0.015, reply_words=60, dimensions=1536, jitter=0.1, seed=0):
+        self.latency = latency
+        self.embedding_latency = embedding_latency
+        self.vector_latency = vector_latency
+        self.search_latency = search_latency
+        self.image_latency = image_latency
+        self.token_delay = token_delay
+        self.reply_words = reply_words
+        self.dimensions = dimensions
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.server = None
+
+    def wait(self, seconds, upstream):
+        with self.lock:
+            self.counts[upstream] = self.counts.get(upstream, 0) + 1
+            factor = 1 + self.random.uniform(-self.jitter, self.jitter)
+        time.sleep(max(seconds * factor, 0))
+
+    def reply(self):
+        words = [REPLY_WORDS[i % len(REPLY_WORDS)] for i in range(self.reply_words)]
+        return " ".join(words)
+
+    def tool_call(self, body):
+        """A tool call when the request forces one, or when an agent has not called its tool yet."""
+        tools = body.get("tools") or []
+        if not tools:
+            return None
+        choice = body.get("tool_choice")
+        forced = isinstance(choice, dict)
+        answered = any(m.get("role") == "tool" for m in body.get("messages", []))
+        if not forced and answered:
+            return None
+        name = choice["function"]["name"] if forced else tools[0]["function"]["name"]
+        query = next((m.get("content") for m in reversed(body["messages"]) if m.get("role") == "user"), "")
+        return {
+            "id": f"call_{self.random.randrange(1 << 30)}",
+            "type": "function",
+            "function": {"name": name, "arguments": json.dumps({"query": query}, ensure_ascii=False)},
+        }
+
+    def start(self, host="127.0.0.1", port=0):
+        """Serve on a background thread; returns the base URL."""
+        self.server = ThreadingHTTPServer((host, port), _handler(self))
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return f"http://{host}:{self.server.server_address[1]}"
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts)
+
+
+def _handler(upstream):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, payload, status=200):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def send_chunk(self, data):
+            self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        def read_json(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            return json.loads(self.rfile.read(length) or b"{}")
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == "/images":
+                params = parse_qs(url.query)
+                query = params.get("q", [""])[0]
+                count = int(params.get("count", ["1"])[0])
+                upstream.wait(upstream.image_latency, "images")
+                slug = hashlib.md5(query.encode("utf-8")).hexdigest()[:12]
+                images = [f"https://images.example.com/{slug}-{i}.jpg" for i in range(count)]
+                return self.send_json({"image": images[0], "images": images})
+            if url.path == "/stats":
+                return self.send_json(upstream.stats())
+            self.send_json({"error": f"unknown path {url.path}"}, 404)
+
+        def do_POST(self):
+            path = urlparse(self.path).path
+            body = self.read_json()
+            if path.endswith("/chat/completions"):
+                return self.chat(body)
+            if path.endswith("/embeddings"):
+                return self.embeddings(body)
+            if path == "/query":
+                return self.query(body)
+            if path == "/search":
+                upstream.wait(upstream.search_latency, "search")
+                query = body.get("query", "")
+                return self.send_json({
+                    "query": query,
+                    "results": [{
+                        "title": f"Kết quả cho {query}",
+                        "url": "https://news.example.com/1",
+                        "content": "Giá xe và chương trình khuyến mãi mới nhất trong tháng.",
+                        "score": 0.9,
+                    }],
+                    "response_time": upstream.search_latency,
+                })
+            self.send_json({"error": f"unknown path {path}"}, 404)
+
+        def chat(self, body):
+            upstream.wait(upstream.latency, "chat")
+            completion_id = f"chatcmpl-{upstream.random.randrange(1 << 30)}"
+            created = int(time.time())
+            model = body.get("model", "fake")
+            tool_call = upstream.tool_call(body)
+            text = "" if tool_call else upstream.reply()
+            usage = {
+                "prompt_tokens": sum(len(str(m.get("content") or "").split()) for m in body.get("messages", [])),
+                "completion_tokens": len(text.split()),
+            }
+            usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+            if not body.get("stream"):
+                time.sleep(upstream.token_delay * len(text.split()))
+                message = {"role": "assistant", "content": text or None}
+                if tool_call:
+                    message["tool_calls"] = [tool_call]
+                return self.send_json({
+                    "id": completion_id,
+                    "object": "chat.completion",
+                    "created": created,
+                    "model": model,
+                    "choices": [{"index": 0, "message": message,
+                                 "finish_reason": "tool_calls" if tool_call else "stop"}],
+                    "usage": usage,
+                })
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+            def event(delta, finish_reason=None):
+                chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                         "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+                self.send_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+            if tool_call:
+                event({"role": "assistant", "tool_calls": [dict(tool_call, index=0)]})
+                event({}, "tool_calls")
+            else:
+                for i, word in enumerate(text.split()):
+                    time.sleep(upstream.token_delay)
+                    event({"role": "assistant", "content": word + " "} if i == 0 else {"content": word + " "})
+                event({}, "stop")
+            if (body.get("stream_options") or {}).get("include_usage"):
+                chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                         "choices": [], "usage": usage}
+                self.send_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.send_chunk(b"data: [DONE]\n\n")
+            self.send_chunk(b"")
+
+        def embeddings(self, body):
+            upstream.wait(upstream.embedding_latency, "embeddings")
+            texts = body.get("input", [])
+            texts = [texts] if isinstance(texts, str) else texts
+            dimensions = body.get("dimensions") or upstream.dimensions
+            data = []
+            for i, text in enumerate(texts):
+                vector = fake_embedding(text, dimensions)
+                if body.get("encoding_format") == "base64":
+                    vector = base64.b64encode(array.array("f", vector).tobytes()).decode()
+                data.append({"object": "embedding", "index": i, "embedding": vector})
+            self.send_json({"object": "list", "data": data, "model": body.get("model", "fake"),
+                            "usage": {"prompt_tokens": 0, "total_tokens": 0}})
+
+        def query(self, body):
+            upstream.wait(upstream.vector_latency, "vector")
+            from carCatalog import catalog
+            ids = list(catalog.ids)
+            seed = hashlib.md5(json.dumps(body.get("vector", [])[:64]).encode()).hexdigest()
+            random.Random(seed).shuffle(ids)
+            top_k = body.get("topK", 5)
+            self.send_json({
+                "matches": [{"id": car_id, "score": round(1 - i * 0.05, 4), "values": []}
+                            for i, car_id in enumerate(ids[:top_k])],
+                "namespace": body.get("namespace", ""),
+                "usage": {"readUnits": 1},
+            })
+
+    return Handler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve fake OpenAI, Pinecone, Tavily and image-search endpoints.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency-ms", type=float, default=400, help="chat completion time to first token")
+    parser.add_argument("--embedding-latency-ms", type=float, default=50)
+    parser.add_argument("--vector-latency-ms", type=float, default=20)
+    parser.add_argument("--search-latency-ms", type=float, default=800)
+    parser.add_argument("--image-latency-ms", type=float, default=300)
+    parser.add_argument("--token-delay-ms", type=float, default=15, help="delay between streamed words")
+    parser.add_argument("--reply-words", type=int, default=60)
+    parser.add_argument("--jitter", type=float, default=0.1, help="relative latency jitter")
+    args = parser.parse_args(argv)
+
+    upstream = FakeUpstream(
+        latency=args.latency_ms / 1000, embedding_latency=args.embedding_latency_ms / 1000,
+        vector_latency=args.vector_latency_ms / 1000, search_latency=args.search_latency_ms / 1000,
+        image_latency=args.image_latency_ms / 1000, token_delay=args.token_delay_ms / 1000,
+        reply_words=args.reply_words, jitter=args.jitter,
+    )
+    print(f"Fake upstreams on {upstream.start(args.host, args.port)}", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        upstream.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,171 @@
+import os
+import time
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from config import client, async_client
+from chromaDBCall import retrieve_context, retrieve_context_async
+from functionCalling import get_car_image, local_images
+from langchainSearch import search_tool, search_tool_async
+from intentRouter import router
+from chatStream import complete, complete_async, completion_stream, completion_stream_async
+from upstreams import limit, limited, run_blocking
+import metrics
+
+# ---- FAN-OUT CONFIG ----
+# A request that needs several retrieval sources (e.g. "tư vấn xe SUV và tìm
+# ảnh") queries them all at once, each with its own timeout, and answers with
+# a single LLM call over whatever came back in time. Its latency is the slowest
+# source plus one completion, instead of the sum of the separate pipelines.
+FANOUT_WORKERS = int(os.getenv("FANOUT_WORKERS", "16"))
+FANOUT_TIMEOUTS = {
+    "catalog": float(os.getenv("FANOUT_CATALOG_TIMEOUT", "5")),
+    "images": float(os.getenv("FANOUT_IMAGES_TIMEOUT", "4")),
+    "web": float(os.getenv("FANOUT_WEB_TIMEOUT", "8")),
+}
+DEPLOYMENT_NAME = os.getenv("DEPLOYMENT_NAME")
+
+_executor = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix="fanout")
+
+
+# ---- SOURCES ----
+def catalog_source(messages, text):
+    return retrieve_context(messages)
+
+
+def image_source(messages, text):
+    images = local_images(text)
+    if images:
+        return images[0]
+    # The routing keywords ("tìm ảnh", "tư vấn", ...) are not part of what to look for.
+    return get_car_image(f"{router.strip_keywords(text)} ô tô")
+
+
+def web_source(messages, text):
+    with metrics.span("web_search"):
+        return format_web_results(search_tool().invoke({"query": text}))
+
+
+def format_web_results(results):
+    if isinstance(results, dict):
+        return "\n".join(
+            f"- {r.get('title', '')}: {r.get('content', '')} ({r.get('url', '')})"
+            for r in results.get("results", [])
+        )
+    return str(results)
+
+
+SOURCES = {"catalog": catalog_source, "images": image_source, "web": web_source}
+
+
+def gather(messages, sources):
+    """Run `sources` concurrently; {name: result} for those that finished in time.
+
+    A source that fails or times out is left out; the answer is built from the rest.
+    """
+    text = messages[-1]["content"]
+    start = time.monotonic()
+    # Each source runs in the request's context, so its spans land in the request's trace.
+    futures = {
+        name: _executor.submit(contextvars.copy_context().run, SOURCES[name], messages, text) for name in sources
+    }
+    results = {}
+    for name, future in futures.items():
+        try:
+            results[name] = future.result(timeout=max(start + FANOUT_TIMEOUTS[name] - time.monotonic(), 0))
+        except TimeoutError:
+            future.cancel()
+            print(f"Fan-out source {name} timed out after {FANOUT_TIMEOUTS[name]}s")
+        except Exception as e:
+            print(f"Fan-out source {name} failed: {e}")
+    metrics.observe_stage("fanout_gather", time.monotonic() - start)
+    return results
+
+
+def build_fanout_messages(messages, results):
+    """The conversation with the gathered results added just before the last user message."""
+    sections = []
+    if results.get("catalog"):
+        sections.append(f"Xe đề xuất từ danh mục:\n{results['catalog']}")
+    if results.get("web"):
+        sections.append(f"Thông tin tìm được trên internet:\n{results['web']}")
+    if results.get("images"):
+        sections.append(f"Hình ảnh xe đã được hiển thị cho người dùng: {results['images']}")
+    if not sections:
+        return messages
+    context = {
+        "role": "system",
+        "content": "Dựa vào thông tin dưới đây, trả lời đầy đủ yêu cầu cuối cùng của người dùng trong một câu trả lời.\n\n"
+        + "\n\n".join(sections),
+    }
+    return messages[:-1] + [context] + messages[-1:]
+
+
+def callFanOut(messages):
+    """(reply, image url or None) for a request that needs several sources."""
+    results = gather(messages, router.sources(messages[-1]["content"]))
+    response = complete(client, DEPLOYMENT_NAME, build_fanout_messages(messages, results))
+    return response.choices[0].message.content, results.get("images")
+
+
+def streamFanOut(messages):
+    """Like callFanOut, but streams the answer; the image goes out with the `done` event."""
+    results = gather(messages, router.sources(messages[-1]["content"]))
+    stream = completion_stream(client, DEPLOYMENT_NAME, build_fanout_messages(messages, results))
+    stream.images = results.get("images")
+    return stream
+
+
+# ---- ASYNC (asgiApp) ----
+async def catalog_source_async(messages, text):
+    return await retrieve_context_async(messages)
+
+
+async def image_source_async(messages, text):
+    return await run_blocking("duckduckgo", image_source, messages, text)
+
+
+async def web_source_async(messages, text):
+    tool = await search_tool_async()
+    async with limit("tavily"):
+        with metrics.span("web_search"):
+            results = await tool.ainvoke({"query": text})
+    return format_web_results(results)
+
+
+ASYNC_SOURCES = {"catalog": catalog_source_async, "images": image_source_async, "web": web_source_async}
+
+
+async def gather_async(messages, sources):
+    """gather() on the event loop: same timeouts, same handling of failed sources."""
+    text = messages[-1]["content"]
+    start = time.monotonic()
+    names = list(sources)
+    outcomes = await asyncio.gather(
+        *(asyncio.wait_for(ASYNC_SOURCES[name](messages, text), FANOUT_TIMEOUTS[name]) for name in names),
+        return_exceptions=True,
+    )
+    results = {}
+    for name, outcome in zip(names, outcomes):
+        if isinstance(outcome, asyncio.TimeoutError):
+            print(f"Fan-out source {name} timed out after {FANOUT_TIMEOUTS[name]}s")
+        elif isinstance(outcome, Exception):
+            print(f"Fan-out source {name} failed: {outcome}")
+        else:
+            results[name] = outcome
+    metrics.observe_stage("fanout_gather", time.monotonic() - start)
+    return results
+
+
+async def callFanOutAsync(messages):
+    results = await gather_async(messages, router.sources(messages[-1]["content"]))
+    async with limit("openai"):
+        response = await complete_async(async_client, DEPLOYMENT_NAME, build_fanout_messages(messages, results))
+    return response.choices[0].message.content, results.get("images")
+
+
+async def streamFanOutAsync(messages):
+    results = await gather_async(messages, router.sources(messages[-1]["content"]))
+    stream = limited("openai", completion_stream_async(async_client, DEPLOYMENT_NAME, build_fanout_messages(messages, results)))
+    stream.images = results.get("images")
+    return stream
@@ -1,68 +1,217 @@
 import os
 import json
-from llama_cpp import Llama
-from duckduckgo_search import DDGS
-from config import client
+import uuid
+import requests
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from config import client, async_client
+from upstreams import limit, run_blocking
+from chatStream import complete, complete_async, image_fields
+from metrics import span
+from carMatcher import matcher, image_count
+from contextWindow import is_summary
+import imageCache
 modelName = os.getenv("DEPLOYMENT_NAME")
 
-def function_call(messages):
-    function_definition = [
-        {
-            "type": "function",
-            "function": {
-                "name": "get_car_details",
-                "description": "Retrieve image url(s) for a specific car model. Call with {'query': 'make model year', 'imageCount': 1}.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "query": {
-                            "type": "string",
-                            "description": "Search query (car make/model) to find a real image",
-                        },
-                        "imageCount": {
-                            "type": "integer",
-                            "description": "Number of images to return",
-                            "default": 1,
-                        },
+# IMAGE_SEARCH_URL replaces DuckDuckGo with a JSON endpoint answering
+# GET ?q=<query>&count=<n> with {"images": [url, ...]} or {"image": url}
+# (fakeUpstream.py serves one for load tests).
+IMAGE_SEARCH_URL = os.getenv("IMAGE_SEARCH_URL", "")
+FALLBACK_IMAGE = "https://giaxeotovinfast.net/wp-content/uploads/2023/01/312207264_637940821322100_2347147708676423923_n.jpg"
+
+function_definition = [
+    {
+        "type": "function",
+        "function": {
+            "name": "get_car_details",
+            "description": "Retrieve image url(s) for a specific car model. Call with {'query': 'make model year', 'imageCount': 1}.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "query": {
+                        "type": "string",
+                        "description": "Search query (car make/model) to find a real image",
                     },
-                    "required": ["query"],
-                },
-                "result": {
-                    "type": "object",
-                    "properties": {
-                        "images": {"type": "array", "items": {"type": "string"}}
+                    "imageCount": {
+                        "type": "integer",
+                        "description": "Number of images to return",
+                        "default": 1,
                     },
                 },
+                "required": ["query"],
             },
-        }
+            "result": {
+                "type": "object",
+                "properties": {
+                    "images": {"type": "array", "items": {"type": "string"}}
+                },
+            },
+        },
+    }
+]
+
+# The forced tool call only extracts the cars to look up, so it gets this short
+# prompt instead of the client's (contextWindow.SYSTEM_REPLACED_ROUTES).
+TOOL_SYSTEM_PROMPT = (
+    "Bạn tìm hình ảnh xe hơi cho khách hàng. Gọi get_car_details với mẫu xe (hãng, tên, đời xe) "
+    "và số lượng ảnh người dùng muốn xem."
+)
+
+
+def tool_messages(messages):
+    return [{"role": "system", "content": TOOL_SYSTEM_PROMPT}] + [
+        m for m in messages if m.get("role") != "system" or is_summary(m)
     ]
-    response = client.chat.completions.create(
-        model=modelName,
-        messages=messages,
+
+# ---- IMAGE LOOKUP ----
+# The cars to look up are read from the message by carMatcher, without the
+# LLM; the forced get_car_details tool call is only made when it recognises
+# nothing. Catalog cars ("cho xem ảnh Toyota Vios") are answered from their
+# image_url without any search. Other queries go through the image cache
+# (imageCache.py), the misses searched concurrently with one HTTP or
+# DuckDuckGo session per thread.
+IMAGE_SEARCH_WORKERS = int(os.getenv("IMAGE_SEARCH_WORKERS", "8"))
+# Upper bound on imageCount, whatever the LLM asks for.
+IMAGE_COUNT_MAX = int(os.getenv("IMAGE_COUNT_MAX", "6"))
+
+_image_executor = ThreadPoolExecutor(max_workers=IMAGE_SEARCH_WORKERS, thread_name_prefix="image-search")
+_sessions = threading.local()
+
+
+def image_response(images, id):
+    return dict(image_fields(images), response={"message": "", "id": id})
+
+
+def last_user_text(messages):
+    return next((str(m.get("content", "")) for m in reversed(messages) if m.get("role") == "user"), "")
+
+
+def _image_count(count):
+    return min(max(int(count or 1), 1), IMAGE_COUNT_MAX)
+
+
+def tool_queries(response):
+    """(query, imageCount) for every get_car_details call the LLM made."""
+    queries = []
+    for tool_call in response.choices[0].message.tool_calls:
+        arguments = json.loads(tool_call.function.arguments)
+        queries.append((arguments.get("query"), _image_count(arguments.get("imageCount"))))
+    return queries
+
+
+def local_images(text):
+    """Images for the cars named in `text`, found without the LLM; None when no car is recognised."""
+    mentions = matcher.mentions(text)
+    if not mentions:
+        return None
+    count = _image_count(image_count(text, mentions))
+    images, queries = [], []
+    for mention in mentions:
+        # The catalog has one current picture per car; a year or several pictures need a search.
+        if mention.car and mention.car.get("image_url") and not mention.year and count == 1:
+            images.append(mention.car["image_url"])
+        else:
+            queries.append((mention.query, count))
+    return images + [url for url in search_images(queries) if url not in images]
+
+
+def search_images(queries):
+    """Image URLs for every (query, count), looked up concurrently, without duplicates."""
+    futures = [_image_executor.submit(get_car_images, query, count) for query, count in queries if query]
+    images = []
+    for future in futures:
+        images.extend(url for url in future.result() if url not in images)
+    return images
+
+
+def function_call(messages):
+    try:
+        images = local_images(last_user_text(messages))
+        if images is not None:
+            return image_response(images, uuid.uuid1())
+    except Exception as e:
+        return {"error": str(e), 
+                "response": "",
+                "images": FALLBACK_IMAGE}
+    response = complete(
+        client,
+        modelName,
+        tool_messages(messages),
         # Add the function definition
         tools=function_definition,
         # Specify the function to be called for the response
         tool_choice={'type': 'function', 'function': {'name': 'get_car_details'}}
     )
-    # return response.choices[0].message.tool_calls[0].function.arguments
+    try:
+        return image_response(search_images(tool_queries(response)), response.id)
+    except Exception as e:
+        return {"error": str(e), 
+                "response": "",
+                "images": FALLBACK_IMAGE}
 
-    queryImageObjectResponse = response.choices[0].message.tool_calls[0].function.arguments
-    queryImageObject = json.loads(queryImageObjectResponse)
+async def function_call_async(messages):
+    """function_call for the ASGI app."""
+    try:
+        images = await run_blocking("duckduckgo", local_images, last_user_text(messages))
+        if images is not None:
+            return image_response(images, uuid.uuid1())
+    except Exception as e:
+        return {"error": str(e), 
+                "response": "",
+                "images": FALLBACK_IMAGE}
+    async with limit("openai"):
+        response = await complete_async(
+            async_client,
+            modelName,
+            tool_messages(messages),
+            tools=function_definition,
+            tool_choice={'type': 'function', 'function': {'name': 'get_car_details'}}
+        )
     try:
-        images = get_car_image(queryImageObject.get('query'))
-        return {"images": images, "response": {"message": "", "id": response.id}, }
+        images = await run_blocking("duckduckgo", search_images, tool_queries(response))
+        return image_response(images, response.id)
     except Exception as e:
         return {"error": str(e), 
                 "response": "",
-                "images": "https://giaxeotovinfast.net/wp-content/uploads/2023/01/312207264_637940821322100_2347147708676423923_n.jpg"}
+                "images": FALLBACK_IMAGE}
+
+def _http_session():
+    session = getattr(_sessions, "http", None)
+    if session is None:
+        session = _sessions.http = requests.Session()
+    return session
+
+def _ddgs():
+    ddgs = getattr(_sessions, "ddgs", None)
+    if ddgs is None:
+        from duckduckgo_search import DDGS
+        ddgs = _sessions.ddgs = DDGS()
+    return ddgs
+
+def _search_images(query, count):
+    if IMAGE_SEARCH_URL:
+        response = _http_session().get(IMAGE_SEARCH_URL, params={"q": query, "count": count}, timeout=10)
+        response.raise_for_status()
+        data = response.json()
+        if "images" in data:
+            return data["images"]
+        return [data["image"]] if data.get("image") else []
+    return [r["image"] for r in _ddgs().images(query, max_results=count)]  # The direct image URLs
+
+def get_car_images(query, count=1):
+    """Up to `count` image URLs for the given search text, from the image cache or DuckDuckGo."""
+    images = imageCache.lookup(query, count)
+    if images is not None:
+        return images
+    with span("image_search"):
+        images = _search_images(query, count)[:count]
+    imageCache.store(query, images)
+    return images
 
 def get_car_image(query):
-    """Get the first image URL for the given search text using DuckDuckGo."""
-    with DDGS() as ddgs:
-        results = ddgs.images(query, max_results=1)
-        for r in results:
-            return r["image"]  # The direct image URL
-    return None
+    """Get the first image URL for the given search text."""
+    images = get_car_images(query, 1)
+    return images[0] if images else None
 
 
 # function   re_write_response use llama model to re write the response
@@ -77,6 +226,7 @@ class LlamaModel:
         if not os.path.exists(model_path):
             raise FileNotFoundError(f"Model file not found at: {model_path}")
         try:
+            from llama_cpp import Llama
             self.llm = Llama(model_path=model_path, n_ctx=n_ctx)
             print(f"LLaMA model loaded successfully from {model_path}")
         except Exception as e:
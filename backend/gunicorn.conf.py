@@ -0,0 +1,26 @@
+import os
+import sys
+import subprocess
+
+# Gunicorn picks this file up from the working directory.
+#
+# Unless TTS_POOL_ADDRESS points at a TTS pool that is already running, the
+# master starts one (ttsPoolServer.py) before forking, and every web worker inherits
+# its address. The VITS model then lives only in the pool's processes.
+
+def on_starting(server):
+    if os.getenv("TTS_POOL_ADDRESS"):
+        return
+    address = os.getenv("TTS_POOL_DEFAULT_ADDRESS", "127.0.0.1:50055")
+    os.environ["TTS_POOL_ADDRESS"] = address
+    server.tts_pool = subprocess.Popen(
+        [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "ttsPoolServer.py"), address],
+        env=os.environ.copy(),
+    )
+    server.log.info(f"Started TTS pool (pid {server.tts_pool.pid}) on {address}")
+
+def on_exit(server):
+    tts_pool = getattr(server, "tts_pool", None)
+    if tts_pool is not None:
+        tts_pool.terminate()
+        tts_pool.wait(timeout=10)
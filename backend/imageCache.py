@@ -0,0 +1,44 @@
+import os
+import re
+from ttlCache import SqliteTTLStore
+import metrics
+
+# ---- IMAGE CACHE CONFIG ----
+# Image search results are cached by normalized query, so "Toyota  Vios!" and
+# "toyota vios" share an entry, in SQLite: a restart or another gunicorn worker
+# re-uses every lookup already paid for. Entries expire after
+# IMAGE_CACHE_TTL_SECONDS; past IMAGE_CACHE_MAX_ENTRIES the least recently used
+# are dropped. Catalog cars never reach this cache, they are answered from
+# their own image_url (see functionCalling.local_images).
+IMAGE_CACHE_ENABLED = os.getenv("IMAGE_CACHE_ENABLED", "1").lower() in ("1", "true", "yes")
+IMAGE_CACHE_PATH = os.getenv(
+    "IMAGE_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "images.sqlite3"),
+)
+IMAGE_CACHE_TTL_SECONDS = int(os.getenv("IMAGE_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+IMAGE_CACHE_MAX_ENTRIES = int(os.getenv("IMAGE_CACHE_MAX_ENTRIES", "4096"))
+
+images = SqliteTTLStore(IMAGE_CACHE_PATH, "images", IMAGE_CACHE_MAX_ENTRIES, IMAGE_CACHE_TTL_SECONDS)
+
+
+def normalize_query(query):
+    return " ".join(re.findall(r"\w+(?:[.-]\w+)*", str(query).lower()))
+
+
+def lookup(query, count=1):
+    """The first `count` cached image URLs for `query`, or None when fewer are cached."""
+    if not IMAGE_CACHE_ENABLED:
+        return None
+    urls = images.get(normalize_query(query))
+    hit = urls is not None and len(urls) >= count
+    metrics.cache_event("image", hit)
+    return urls[:count] if hit else None
+
+
+def store(query, urls):
+    if IMAGE_CACHE_ENABLED and urls:
+        images.put(normalize_query(query), list(urls))
+
+
+def stats():
+    return images.stats()
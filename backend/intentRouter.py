@@ -0,0 +1,260 @@
+import os
+import time
+import threading
+import numpy as np
+import config
+from carCatalog import catalog
+from carFilters import parse_constraints
+from embeddingCache import get_embeddings, get_embedding
+from keywordAutomaton import KeywordAutomaton
+from chatStream import complete
+import metrics
+import subsystems
+
+# ---- INTENT ROUTER CONFIG ----
+# Each /api/chat request is routed on the server from its last user message:
+#   1. keywords, found in one pass by an Aho-Corasick automaton, plus the hard
+#      constraints carFilters can parse (a budget or seat count means the
+#      catalog can answer); a single matching route is taken as is;
+#   2. otherwise an embedding-centroid classifier (centroids built from example
+#      questions generated from the catalog) is blended with the keyword hits;
+#   3. only when no route reaches ROUTER_MIN_CONFIDENCE is the LLM asked.
+# The centroids are built by the startup warm-up (subsystems.py); until they
+# are ready, requests are routed by keywords and the LLM instead of waiting.
+# Among routes scoring within ROUTER_MARGIN of the best, the cheapest wins.
+# A request whose keywords ask for more than one retrieval source (catalog,
+# images, web) goes to the "fanout" route, which queries them concurrently
+# (see fanOut.py).
+ROUTER_MIN_CONFIDENCE = float(os.getenv("ROUTER_MIN_CONFIDENCE", "0.45"))
+ROUTER_MARGIN = float(os.getenv("ROUTER_MARGIN", "0.05"))
+ROUTER_KEYWORD_WEIGHT = float(os.getenv("ROUTER_KEYWORD_WEIGHT", "0.6"))
+ROUTER_TEMPERATURE = float(os.getenv("ROUTER_TEMPERATURE", "0.02"))
+ROUTER_LLM_FALLBACK = os.getenv("ROUTER_LLM_FALLBACK", "1").lower() in ("1", "true", "yes")
+DEPLOYMENT_NAME = os.getenv("DEPLOYMENT_NAME")
+
+# Relative cost of each pipeline: "similar" is a local vector lookup, "chat"
+# one LLM call, "database" and "image" add retrieval or a tool call to it, and
+# "search" runs an agent with web search.
+ROUTE_COSTS = {"similar": 1, "chat": 2, "database": 3, "image": 3, "search": 5}
+ROUTES = list(ROUTE_COSTS)
+DEFAULT_ROUTE = "chat"
+FANOUT_ROUTE = "fanout"
+ROUTE_SOURCES = {"database": "catalog", "similar": "catalog", "image": "images", "search": "web"}
+
+ROUTE_KEYWORDS = {
+    # No bare "ảnh": it also starts "ảnh hưởng" (to affect).
+    "image": ["tìm ảnh", "tìm hình", "hình ảnh", "xem ảnh", "xem hình", "ảnh xe", "ảnh của", "tấm ảnh",
+              "image", "photo", "picture", "tim anh", "tim hinh", "hinh anh", "xem anh", "xem hinh"],
+    "database": ["tư vấn", "đề xuất", "nên mua", "nên chọn", "tu van", "de xuat", "nen mua", "nen chon"],
+    "similar": ["gợi ý", "tương tự", "giống", "recommend", "similar", "goi y", "tuong tu"],
+    "search": ["tìm kiếm", "tin tức", "mới nhất", "khuyến mãi", "search", "tim kiem", "tin tuc", "khuyen mai"],
+    "chat": ["so sánh", "thủ tục", "bảo hiểm", "bảo dưỡng", "trả góp", "xin chào", "cảm ơn",
+             "so sanh", "thu tuc", "bao hiem", "bao duong", "tra gop"],
+}
+
+GENERAL_EXAMPLES = [
+    "xin chào", "cảm ơn bạn", "thủ tục đăng ký xe ô tô cần những gì",
+    "bảo hiểm vật chất xe là gì", "cách bảo dưỡng lốp xe", "mua xe trả góp cần chuẩn bị gì",
+    "so sánh xe sedan và SUV", "phí trước bạ ô tô là bao nhiêu", "xe hybrid hoạt động thế nào",
+    "kinh nghiệm lái xe đường dài", "nên bảo dưỡng xe bao lâu một lần", "bằng lái B2 lái được xe gì",
+]
+
+LLM_PROMPT = (
+    "Phân loại yêu cầu của người dùng về xe hơi vào đúng một nhãn và chỉ trả lời nhãn đó:\n"
+    "image: muốn xem ảnh xe\n"
+    "database: muốn được tư vấn chọn xe trong danh mục\n"
+    "similar: muốn danh sách xe phù hợp hoặc tương tự\n"
+    "search: cần thông tin mới trên internet (giá, tin tức, khuyến mãi)\n"
+    "chat: câu hỏi hoặc trò chuyện chung"
+)
+
+
+def route_examples(cars):
+    """Example questions for each route, generated from the catalog."""
+    examples = {route: [] for route in ROUTES}
+    for car in cars:
+        price = car["price_max"] // 1_000_000
+        examples["similar"] += [
+            f"gợi ý xe tương tự {car['name']}",
+            f"có xe nào giống {car['name']} không",
+            f"gợi ý vài xe {car['segment']} {car['seats']} chỗ",
+        ]
+        examples["database"] += [
+            f"tư vấn giúp tôi xe {car['segment']} {car['seats']} chỗ tầm {price} triệu",
+            f"tôi nên mua xe {car['fuel_type']} nào, số {car['transmission']}",
+            f"đề xuất xe {car['brand']} phù hợp gia đình",
+        ]
+        examples["image"] += [f"cho tôi xem ảnh {car['name']}", f"hình ảnh nội thất {car['name']}"]
+        examples["search"] += [f"giá lăn bánh {car['name']} tháng này", f"tin tức mới nhất về {car['brand']}"]
+    examples["chat"] = list(GENERAL_EXAMPLES)
+    return {route: list(dict.fromkeys(texts)) for route, texts in examples.items()}
+
+
+def _unit(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class RouteDecision:
+    def __init__(self, route, method, confidence, scores=None):
+        self.route = route
+        self.method = method
+        self.confidence = confidence
+        self.scores = scores or {}
+
+
+class IntentRouter:
+    def __init__(self, cars):
+        self.cars = cars
+        self.automaton = KeywordAutomaton(
+            [(keyword, route) for route, keywords in ROUTE_KEYWORDS.items() for keyword in keywords]
+        )
+        self.centroids = subsystems.register("router", self._build_centroids)
+        self.lock = threading.Lock()
+        self.route_stats = {
+            route: {"requests": 0, "total_ms": 0.0, "max_ms": 0.0} for route in ROUTES + [FANOUT_ROUTE]
+        }
+        self.decisions = {"keyword": 0, "centroid": 0, "llm": 0, "default": 0}
+        self.classify_ms = 0.0
+
+    def _build_centroids(self):
+        # The example embeddings come from the on-disk embedding cache after the first run.
+        examples = route_examples(self.cars)
+        texts = [text for route in ROUTES for text in examples[route]]
+        vectors = _unit(get_embeddings(texts))
+        centroids, start = [], 0
+        for route in ROUTES:
+            count = len(examples[route])
+            centroids.append(vectors[start:start + count].mean(axis=0))
+            start += count
+        return _unit(centroids)
+
+    def centroid_probabilities(self, text, centroids=None):
+        if centroids is None:
+            centroids = self.centroids.get()
+        sims = centroids @ _unit(get_embedding(text))
+        weights = np.exp((sims - sims.max()) / ROUTER_TEMPERATURE)
+        return dict(zip(ROUTES, (weights / weights.sum()).tolist()))
+
+    def _ask_llm(self, text):
+        response = complete(
+            config.client,
+            DEPLOYMENT_NAME,
+            [{"role": "system", "content": LLM_PROMPT}, {"role": "user", "content": text}],
+            stage="route_llm",
+            max_tokens=3,
+            temperature=0,
+        )
+        label = (response.choices[0].message.content or "").strip().lower()
+        return next((route for route in ROUTES if label.startswith(route)), None)
+
+    def _fallback(self, text, scores):
+        if ROUTER_LLM_FALLBACK:
+            try:
+                route = self._ask_llm(text)
+                if route is not None:
+                    return RouteDecision(route, "llm", 1.0, scores)
+            except Exception as e:
+                print(f"Intent router LLM fallback failed: {e}")
+        return RouteDecision(DEFAULT_ROUTE, "default", 0.0, scores)
+
+    def keyword_hits(self, text):
+        """{route: keyword count}; parsed catalog constraints count for both catalog routes."""
+        hits = self.automaton.labels(text)
+        if parse_constraints(text):
+            for route in ("similar", "database"):
+                hits[route] = hits.get(route, 0) + 1
+        return hits
+
+    def sources(self, text):
+        """Retrieval sources ("catalog", "images", "web") the keywords of `text` ask for."""
+        return {ROUTE_SOURCES[route] for route in self.keyword_hits(text) if route in ROUTE_SOURCES}
+
+    def strip_keywords(self, text):
+        """`text` without its routing keywords, e.g. to use the rest as a search query."""
+        keep = [True] * len(text)
+        for start, end, _, _ in self.automaton.find(text):
+            keep[start:end] = [False] * (end - start)
+        return " ".join("".join(char for char, kept in zip(text, keep) if kept).split())
+
+    def classify(self, text):
+        hits = self.keyword_hits(text)
+        if len({ROUTE_SOURCES[route] for route in hits if route in ROUTE_SOURCES}) > 1:
+            return RouteDecision(FANOUT_ROUTE, "keyword", 1.0, {route: 1.0 for route in hits})
+        if len(hits) == 1:
+            return RouteDecision(next(iter(hits)), "keyword", 1.0, {route: 1.0 for route in hits})
+
+        scores = {route: 0.0 for route in ROUTES}
+        keyword_weight = ROUTER_KEYWORD_WEIGHT
+        probabilities = None
+        centroids = self.centroids.peek()
+        if centroids is not None:
+            try:
+                probabilities = self.centroid_probabilities(text, centroids)
+            except Exception as e:
+                print(f"Intent router embedding failed: {e}")
+        if probabilities is None:
+            keyword_weight = 1.0
+            if not hits:
+                return self._fallback(text, scores)
+        else:
+            for route, probability in probabilities.items():
+                scores[route] += (1 - keyword_weight if hits else 1.0) * probability
+        most_hits = max(hits.values(), default=1)
+        for route, count in hits.items():
+            scores[route] += keyword_weight * count / most_hits
+
+        best = max(scores.values())
+        if best < ROUTER_MIN_CONFIDENCE:
+            return self._fallback(text, scores)
+        candidates = [route for route in ROUTES if scores[route] >= best - ROUTER_MARGIN]
+        method = "keyword" if probabilities is None else "centroid"
+        return RouteDecision(min(candidates, key=ROUTE_COSTS.get), method, best, scores)
+
+    def route(self, text):
+        start = time.perf_counter()
+        decision = self.classify(text)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        metrics.observe_stage("route", elapsed_ms / 1000)
+        with self.lock:
+            self.decisions[decision.method] += 1
+            self.classify_ms += elapsed_ms
+        return decision
+
+    def record(self, route, seconds):
+        """Add one answered request to the latency counters of `route`."""
+        elapsed_ms = seconds * 1000
+        metrics.observe_request(route, seconds)
+        with self.lock:
+            stats = self.route_stats[route]
+            stats["requests"] += 1
+            stats["total_ms"] += elapsed_ms
+            stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+
+    def stats(self):
+        with self.lock:
+            routes = {
+                route: {
+                    "requests": s["requests"],
+                    "avg_ms": round(s["total_ms"] / s["requests"], 1) if s["requests"] else 0.0,
+                    "max_ms": round(s["max_ms"], 1),
+                }
+                for route, s in self.route_stats.items()
+            }
+            decisions = dict(self.decisions)
+            classified = sum(decisions.values())
+            classify_ms = round(self.classify_ms / classified, 2) if classified else 0.0
+        return {"routes": routes, "decisions": decisions, "avg_classify_ms": classify_ms}
+
+
+router = IntentRouter(catalog.cars)
+
+
+def route_request(messages):
+    """Route for answering `messages`, from the last user message."""
+    text = next((m.get("content", "") for m in reversed(messages or []) if m.get("role") == "user"), "")
+    if not str(text).strip():
+        return DEFAULT_ROUTE
+    return router.route(str(text)).route
@@ -0,0 +1,72 @@
+from collections import deque
+
+
+class KeywordAutomaton:
+    """Aho-Corasick matcher for a fixed set of keywords, each tagged with a label.
+
+    All keywords are found in one pass over the text, however many there are,
+    instead of one substring scan per keyword. Matching is case-insensitive;
+    with `whole_words` a match must not be part of a longer word, so "hon"
+    does not match inside "honda".
+    """
+
+    def __init__(self, keywords, whole_words=True):
+        """`keywords` maps keyword -> label (or an iterable of (keyword, label) pairs)."""
+        self.whole_words = whole_words
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        pairs = keywords.items() if isinstance(keywords, dict) else keywords
+        for keyword, label in pairs:
+            self._add(keyword.lower(), label)
+        self._build()
+
+    def _add(self, keyword, label):
+        state = 0
+        for char in keyword:
+            next_state = self.goto[state].get(char)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][char] = next_state
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            state = next_state
+        self.output[state].append((keyword, label))
+
+    def _build(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                if self.fail[next_state] == next_state:
+                    self.fail[next_state] = 0
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+
+    def find(self, text):
+        """Yield (start, end, keyword, label) for every keyword occurrence in `text`."""
+        text = text.lower()
+        state = 0
+        for end, char in enumerate(text, 1):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for keyword, label in self.output[state]:
+                start = end - len(keyword)
+                if self.whole_words and (
+                    (start > 0 and text[start - 1].isalnum()) or (end < len(text) and text[end].isalnum())
+                ):
+                    continue
+                yield start, end, keyword, label
+
+    def labels(self, text):
+        """{label: number of matched keywords} for `text`."""
+        counts = {}
+        for _, _, _, label in self.find(text):
+            counts[label] = counts.get(label, 0) + 1
+        return counts
@@ -1,27 +1,93 @@
 import os
-from langchain_tavily import TavilySearch
-from langchain_openai import AzureChatOpenAI
-from langgraph.prebuilt import create_react_agent
-
-tavily_search_tool = TavilySearch(
-    max_results=1,
-    topic="general",
-)
-
-llm = AzureChatOpenAI(
-    azure_deployment=os.getenv("DEPLOYMENT_NAME"),
-    azure_endpoint=os.getenv("OPENAI_ENDPOINT"), # or your deployment
-    api_version="2024-07-01-preview", # or your api version
-    api_key=os.getenv("OPENAI_API_KEY"),
-)
-
-# Setup Langchain agent with both tools
-tools = [tavily_search_tool]
-agent = create_react_agent(
-    model=llm,
-    tools=tools,
-)
+from types import SimpleNamespace
+from chatStream import TokenStream
+from upstreams import limit
+import metrics
+import subsystems
+
+# TAVILY_API_BASE_URL points the tool at another Tavily-compatible server (fakeUpstream.py in load tests).
+tavily_options = {"api_base_url": os.getenv("TAVILY_API_BASE_URL")} if os.getenv("TAVILY_API_BASE_URL") else {}
+
+
+def build_agent():
+    """The Tavily tool and the LangGraph agent using it; LangChain is only imported here."""
+    from langchain_tavily import TavilySearch
+    from langchain_openai import AzureChatOpenAI
+    from langgraph.prebuilt import create_react_agent
+
+    tavily_search_tool = TavilySearch(
+        max_results=1,
+        topic="general",
+        **tavily_options,
+    )
+
+    llm = AzureChatOpenAI(
+        azure_deployment=os.getenv("DEPLOYMENT_NAME"),
+        azure_endpoint=os.getenv("OPENAI_ENDPOINT"), # or your deployment
+        api_version="2024-07-01-preview", # or your api version
+        api_key=os.getenv("OPENAI_API_KEY"),
+    )
+
+    # Setup Langchain agent with both tools
+    tools = [tavily_search_tool]
+    agent = create_react_agent(
+        model=llm,
+        tools=tools,
+    )
+    return SimpleNamespace(tool=tavily_search_tool, agent=agent)
+
+
+search = subsystems.register("search", build_agent)
+
+
+def search_tool():
+    return search.get().tool
+
+
+async def search_tool_async():
+    return (await search.get_async()).tool
+
+def agent_config():
+    from agentCallbacks import AgentTimer
+    return {"callbacks": [AgentTimer()]}
 
 def callTavilySearch(prompt_message_list):
-    response = agent.invoke({"messages": prompt_message_list})
-    return response["messages"][-1].content
\ No newline at end of file
+    with metrics.span("search_agent"):
+        response = search.get().agent.invoke({"messages": prompt_message_list}, config=agent_config())
+    return response["messages"][-1].content
+
+def _is_answer_chunk(chunk, metadata):
+    return (
+        getattr(chunk, "type", None) == "AIMessageChunk"
+        and metadata.get("langgraph_node") == "agent"
+        and isinstance(chunk.content, str)
+        and chunk.content
+    )
+
+def streamTavilySearch(prompt_message_list):
+    """Stream the agent's final answer; tool calls and tool output are not forwarded."""
+    def chunks():
+        for chunk, metadata in search.get().agent.stream(
+            {"messages": prompt_message_list}, config=agent_config(), stream_mode="messages"
+        ):
+            if _is_answer_chunk(chunk, metadata):
+                yield chunk.content
+    return TokenStream(chunks())
+
+async def callTavilySearchAsync(prompt_message_list):
+    async with limit("tavily"):
+        with metrics.span("search_agent"):
+            response = await (await search.get_async()).agent.ainvoke({"messages": prompt_message_list}, config=agent_config())
+    return response["messages"][-1].content
+
+def streamTavilySearchAsync(prompt_message_list):
+    """streamTavilySearch for the ASGI app."""
+    async def chunks():
+        agent = (await search.get_async()).agent
+        async with limit("tavily"):
+            async for chunk, metadata in agent.astream(
+                {"messages": prompt_message_list}, config=agent_config(), stream_mode="messages"
+            ):
+                if _is_answer_chunk(chunk, metadata):
+                    yield chunk.content
+    return TokenStream(chunks())
@@ -0,0 +1,363 @@
+import os
+import sys
+import json
+import math
+import time
+import uuid
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from carCatalog import catalog
+from fakeUpstream import FakeUpstream
+
+# ---- LOAD TEST ----
+# Starts the backend (Flask dev server, gunicorn or the ASGI app) against
+# fakeUpstream.py, replays a mix of realistic conversations at a fixed
+# concurrency, and reports throughput, cold start and p50/p95/p99 latency per
+# scenario (the scenarios map onto the routes). Caches and the session store
+# start empty on every run. Use --json to keep the numbers for comparing runs.
+#
+# The "session" scenario sends {"sessionId", "message"} like the frontend: each
+# virtual user (worker thread) holds a fresh sessionId for SESSION_TURNS turns,
+# so the server-side history, its summaries and the session store are loaded.
+#
+#   python loadTest.py --server gunicorn --workers 4 --concurrency 32 --requests 500
+#   python loadTest.py --server asgi --mix "quick=1,image=1" --stream 1
+#   python loadTest.py --url http://localhost:5000     # an already running backend
+
+SYSTEM_PROMPT = (
+    "Bạn là một chuyên gia sale trong lĩnh vực mua bán xe hơi tại thị trường Việt Nam. "
+    "Nhiệm vụ của bạn là hỗ trợ, tư vấn và giải đáp các thắc mắc liên quan trực tiếp đến việc mua bán, "
+    "lựa chọn, sử dụng, đánh giá, tài chính, bảo hiểm, thủ tục pháp lý, dịch vụ hậu mãi và các vấn đề "
+    "kỹ thuật của xe hơi tại Việt Nam. Câu trả lời thêm nhiều emoticon sinh động"
+)
+# The quick action buttons of the frontend.
+QUICK_ACTIONS = [
+    "Tôi muốn mua xe dưới 1 tỷ",
+    "Tôi cần xe 7 chỗ",
+    "Tôi cần xe 5 chỗ, gầm cao",
+    "Tôi muốn xe SUV",
+    "Tôi cần xe tiết kiệm nhiên liệu",
+]
+GENERAL_QUESTIONS = [
+    "Thủ tục đăng ký xe ô tô cần những gì?",
+    "Mua xe trả góp cần chuẩn bị gì?",
+    "Bảo hiểm vật chất xe là gì?",
+    "Nên bảo dưỡng xe bao lâu một lần?",
+]
+FOLLOW_UPS = [
+    "Xe nào trong số đó tiết kiệm nhiên liệu nhất?",
+    "So sánh giúp tôi các xe vừa gợi ý",
+    "Chi phí lăn bánh khoảng bao nhiêu?",
+]
+SESSION_TURNS = 4
+MIXES = {
+    "realistic": {
+        "quick": 5, "chat": 2, "long": 2, "session": 3, "image": 2, "similar": 1, "search": 1, "fanout": 1,
+    },
+    "quick": {"quick": 1},
+    "cold": {"chat": 1, "image": 1, "similar": 1},
+}
+SERVERS = {
+    "flask": lambda port, workers: [sys.executable, "-m", "flask", "--app", "app", "run", "--port", str(port)],
+    "gunicorn": lambda port, workers: [
+        "gunicorn", "--bind", f"127.0.0.1:{port}", "--workers", str(workers), "--timeout", "120", "app:app",
+    ],
+    "asgi": lambda port, workers: [
+        "uvicorn", "asgiApp:app", "--port", str(port), "--workers", str(workers), "--log-level", "warning",
+    ],
+}
+
+
+def user(text):
+    return {"role": "user", "content": text}
+
+
+def conversation(*turns):
+    return [{"role": "system", "content": SYSTEM_PROMPT}] + list(turns)
+
+
+def make_request(scenario, rng):
+    """JSON body for one request of `scenario` (a "session" body gets its sessionId when sent)."""
+    if scenario == "session":
+        return {"message": rng.choice(QUICK_ACTIONS + GENERAL_QUESTIONS + FOLLOW_UPS)}
+    return {"promptMessageList": make_messages(scenario, rng)}
+
+
+def make_messages(scenario, rng):
+    """Message list for one request of `scenario`."""
+    car = rng.choice(catalog.cars)
+    if scenario == "quick":
+        return conversation(user(rng.choice(QUICK_ACTIONS)))
+    if scenario == "chat":
+        return conversation(user(rng.choice(GENERAL_QUESTIONS)))
+    if scenario == "image":
+        return conversation(user(f"Cho tôi xem ảnh {car['name']}"))
+    if scenario == "similar":
+        return conversation(user(f"Gợi ý xe tương tự {car['name']}"))
+    if scenario == "search":
+        return conversation(user(f"Tin tức mới nhất về giá xe {car['brand']}"))
+    if scenario == "fanout":
+        return conversation(user(f"Tư vấn xe {car['segment']} {car['seats']} chỗ và tìm ảnh {car['name']}"))
+    if scenario == "long":
+        # The frontend sends the last 10 messages.
+        history = []
+        for question in rng.sample(QUICK_ACTIONS + GENERAL_QUESTIONS, 5):
+            history += [user(question), {"role": "assistant", "content": f"{question}? " + "Tôi gợi ý " * 40}]
+        return conversation(*history[-9:], user(f"So sánh giúp tôi {car['name']} với các xe trên"))
+    raise ValueError(f"Unknown scenario: {scenario}")
+
+
+def parse_mix(value):
+    """A MIXES name or "scenario=weight,..."."""
+    if value in MIXES:
+        return MIXES[value]
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        make_request(name.strip(), random.Random(0))
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of `values` (0 when empty)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(math.ceil(p / 100 * len(ordered)), 1) - 1]
+
+
+def send(session, base_url, scenario, body, stream, timeout):
+    """(status, seconds, seconds to the first token or None, error)."""
+    start = time.perf_counter()
+    first = None
+    try:
+        if not stream:
+            response = session.post(f"{base_url}/api/chat", json=body, timeout=timeout)
+            response.json()
+            error = None if response.ok else response.text[:200]
+            return response.status_code, time.perf_counter() - start, None, error
+        response = session.post(
+            f"{base_url}/api/chat/stream", json=body, stream=True, timeout=timeout
+        )
+        error = None if response.ok else response.text[:200]
+        event = None
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+                if first is None and event in ("token", "done"):
+                    first = time.perf_counter() - start
+            elif line.startswith("data: ") and event == "error":
+                error = line[len("data: "):][:200]
+        return response.status_code, time.perf_counter() - start, first, error
+    except Exception as e:
+        return 0, time.perf_counter() - start, first, str(e)[:200]
+
+
+def wait_healthy(base_url, process, timeout):
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Backend exited with status {process.returncode} before becoming healthy")
+        try:
+            if requests.get(f"{base_url}/health", timeout=1).ok:
+                return time.perf_counter() - start
+        except requests.RequestException:
+            pass
+        time.sleep(0.05)
+    raise RuntimeError(f"Backend not healthy after {timeout}s")
+
+
+def start_backend(args, upstream_url, workdir):
+    env = dict(os.environ)
+    env.update({
+        "OPENAI_ENDPOINT": upstream_url,
+        "OPENAI_EMBEDDING_ENDPOINT": upstream_url,
+        "OPENAI_API_KEY": "fake",
+        "OPENAI_EMBEDDING_API_KEY": "fake",
+        "PINECONE_API_KEY": "fake",
+        "PINECONE_INDEX_HOST": upstream_url,
+        "TAVILY_API_KEY": "fake",
+        "TAVILY_API_BASE_URL": upstream_url,
+        "IMAGE_SEARCH_URL": f"{upstream_url}/images",
+        "EMBEDDING_CACHE_PATH": os.path.join(workdir, "embeddings.sqlite"),
+        "CHROMA_PATH": os.path.join(workdir, "chroma"),
+        "VECTOR_INDEX_DIR": os.path.join(workdir, "vectors"),
+        "TTS_CACHE_DIR": os.path.join(workdir, "tts"),
+        "IMAGE_CACHE_PATH": os.path.join(workdir, "images.sqlite"),
+        "SESSION_DB_PATH": os.path.join(workdir, "sessions.sqlite"),
+        "TTS_PRESYNTHESIZE": "0",
+    })
+    for item in args.env:
+        name, _, value = item.partition("=")
+        env[name] = value
+    return subprocess.Popen(
+        SERVERS[args.server](args.port, args.workers),
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        stdout=None if args.verbose else subprocess.DEVNULL,
+        stderr=None if args.verbose else subprocess.DEVNULL,
+    )
+
+
+def run(args, base_url):
+    rng = random.Random(args.seed)
+    mix = parse_mix(args.mix)
+    scenarios = rng.choices(list(mix), weights=list(mix.values()), k=args.requests)
+    plan = [(scenario, make_request(scenario, rng), rng.random() < args.stream) for scenario in scenarios]
+
+    users = threading.local()
+
+    def worker(item):
+        if not hasattr(users, "session"):
+            users.session = requests.Session()
+            users.turns = SESSION_TURNS
+        scenario, body, stream = item
+        if scenario == "session":
+            if users.turns >= SESSION_TURNS:
+                users.session_id, users.turns = f"load-{uuid.uuid4().hex}", 0
+            users.turns += 1
+            body = dict(body, sessionId=users.session_id)
+        return (scenario, stream) + send(users.session, base_url, scenario, body, stream, args.timeout)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(worker, plan))
+    return results, time.perf_counter() - start
+
+
+def summarize(results, elapsed):
+    rows = {}
+    for scenario, stream, status, seconds, first, error in results:
+        for name in (scenario, "all"):
+            row = rows.setdefault(name, {"latencies": [], "first_token": [], "errors": 0, "error": None})
+            if error or status != 200:
+                row["errors"] += 1
+                row["error"] = row["error"] or f"{status}: {error}"
+                continue
+            row["latencies"].append(seconds)
+            if first is not None:
+                row["first_token"].append(first)
+    summary = {}
+    for name, row in rows.items():
+        latencies = row["latencies"]
+        summary[name] = {
+            "requests": len(latencies) + row["errors"],
+            "errors": row["errors"],
+            "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+            "first_token_p50_ms": round(percentile(row["first_token"], 50) * 1000, 1),
+            "first_error": row["error"],
+        }
+    summary["all"]["throughput_rps"] = round(len(rows["all"]["latencies"]) / elapsed, 2) if elapsed else 0.0
+    return summary
+
+
+def print_report(report):
+    print(f"cold start: healthy after {report['cold_start']['healthy_s']:.2f}s, "
+          f"first reply {report['cold_start']['first_reply_s']:.2f}s")
+    print(f"{report['requests']} requests at concurrency {report['concurrency']} in {report['elapsed_s']:.1f}s: "
+          f"{report['scenarios']['all']['throughput_rps']} req/s")
+    print(f"{'scenario':<10}{'requests':>9}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'ttft p50':>10}")
+    for name, row in sorted(report["scenarios"].items(), key=lambda item: item[0] == "all"):
+        print(f"{name:<10}{row['requests']:>9}{row['errors']:>8}{row['p50_ms']:>10}{row['p95_ms']:>10}"
+              f"{row['p99_ms']:>10}{row['first_token_p50_ms']:>10}")
+    for name, row in report["scenarios"].items():
+        if row["first_error"] and name != "all":
+            print(f"{name} error: {row['first_error']}")
+    for name in ("upstream_calls", "router", "cache"):
+        if report.get(name):
+            print(f"{name}: {json.dumps(report[name], ensure_ascii=False)}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the chat backend against fake upstreams.")
+    parser.add_argument("--server", choices=list(SERVERS), default="gunicorn")
+    parser.add_argument("--workers", type=int, default=4, help="gunicorn/uvicorn worker processes")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--url", help="test this running backend instead of starting one")
+    parser.add_argument("--mix", default="realistic", help=f"{', '.join(MIXES)} or scenario=weight,...")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--stream", type=float, default=0.5, help="fraction of requests sent to /api/chat/stream")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--startup-timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency-ms", type=float, default=400, help="fake chat completion time to first token")
+    parser.add_argument("--embedding-latency-ms", type=float, default=50)
+    parser.add_argument("--search-latency-ms", type=float, default=800)
+    parser.add_argument("--image-latency-ms", type=float, default=300)
+    parser.add_argument("--token-delay-ms", type=float, default=15)
+    parser.add_argument("--reply-words", type=int, default=60)
+    parser.add_argument("--env", action="append", default=[], help="NAME=VALUE for the backend, repeatable")
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--verbose", action="store_true", help="show the backend's output")
+    args = parser.parse_args(argv)
+
+    upstream = None
+    process = None
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    try:
+        if args.url:
+            base_url = args.url.rstrip("/")
+            healthy_s = wait_healthy(base_url, None, args.startup_timeout)
+        else:
+            upstream = FakeUpstream(
+                latency=args.latency_ms / 1000, embedding_latency=args.embedding_latency_ms / 1000,
+                search_latency=args.search_latency_ms / 1000, image_latency=args.image_latency_ms / 1000,
+                token_delay=args.token_delay_ms / 1000, reply_words=args.reply_words, seed=args.seed,
+            )
+            upstream_url = upstream.start()
+            base_url = f"http://127.0.0.1:{args.port}"
+            process = start_backend(args, upstream_url, workdir)
+            healthy_s = wait_healthy(base_url, process, args.startup_timeout)
+
+        # The first reply pays for lazy initialisation (router centroids, vector index, clients).
+        status, first_reply_s, _, error = send(
+            requests.Session(), base_url, "chat", {"promptMessageList": conversation(user(QUICK_ACTIONS[0]))}, False, args.timeout
+        )
+        if error:
+            print(f"First request failed ({status}): {error}")
+
+        results, elapsed = run(args, base_url)
+        report = {
+            "server": args.url or args.server,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "elapsed_s": round(elapsed, 3),
+            "cold_start": {"healthy_s": round(healthy_s, 3), "first_reply_s": round(first_reply_s, 3)},
+            "scenarios": summarize(results, elapsed),
+            "upstream_calls": upstream.stats() if upstream else None,
+        }
+        for name, path in (("router", "/api/router/stats"), ("cache", "/api/cache/stats")):
+            try:
+                report[name] = requests.get(f"{base_url}{path}", timeout=5).json()
+            except (requests.RequestException, ValueError):
+                report[name] = None
+
+        print_report(report)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+        return 1 if report["scenarios"]["all"]["errors"] else 0
+    finally:
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if upstream is not None:
+            upstream.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
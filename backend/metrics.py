@@ -0,0 +1,167 @@
+import os
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# ---- METRICS CONFIG ----
+# Per-stage timings (embedding, vector query, LLM, web search, image search,
+# TTS, ...), LLM token counts and cache hit/miss counters, exported on
+# /metrics in the Prometheus text format. Numbers are kept per process; every
+# series carries a `pid` label so the gunicorn workers behind one port can be
+# summed. Processes without an HTTP endpoint (the TTS pool) hand a snapshot()
+# to the web process, which renders it next to its own.
+#
+# Every request also collects its own spans. With SERVER_TIMING=1 (or when
+# the client sends `X-Server-Timing: 1`) they are returned in a Server-Timing
+# header, which browser dev tools show next to the request. A streamed reply
+# only reports the stages that finished before its first byte.
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0").lower() in ("1", "true", "yes")
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+REQUEST_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0, 60.0)
+PREFIX = "car_agent"
+
+_lock = threading.Lock()
+_trace = contextvars.ContextVar("metrics_trace", default=None)
+
+
+class Counter:
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+
+    def inc(self, labels, amount=1):
+        with _lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def lines(self, others=()):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for pid, values in [(os.getpid(), self.values)] + list(others):
+            for labels, value in sorted(values.items()):
+                yield f"{self.name}{_labels(self.labels, labels, pid)} {value}"
+
+
+class Histogram:
+    def __init__(self, name, help, labels, buckets):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}
+
+    def observe(self, labels, value):
+        with _lock:
+            # Bucket counts are cumulative; values above the last bound only count towards +Inf.
+            counts, total, count = self.values.get(labels, ([0] * len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.values[labels] = (counts, total + value, count + 1)
+
+    def lines(self, others=()):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for pid, values in [(os.getpid(), self.values)] + list(others):
+            for labels, (counts, total, count) in sorted(values.items()):
+                for bound, bucket in zip(self.buckets, counts):
+                    yield f"{self.name}_bucket{_labels(self.labels + ('le',), labels + (repr(bound),), pid)} {bucket}"
+                yield f"{self.name}_bucket{_labels(self.labels + ('le',), labels + ('+Inf',), pid)} {count}"
+                yield f"{self.name}_sum{_labels(self.labels, labels, pid)} {round(total, 6)}"
+                yield f"{self.name}_count{_labels(self.labels, labels, pid)} {count}"
+
+
+def _labels(names, values, pid):
+    pairs = [("pid", str(pid))] + list(zip(names, values))
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+stage_seconds = Histogram(
+    f"{PREFIX}_stage_seconds", "Time spent in one stage of answering a request.", ("stage",), STAGE_BUCKETS
+)
+request_seconds = Histogram(
+    f"{PREFIX}_request_seconds", "Time to answer a chat request, by route.", ("route",), REQUEST_BUCKETS
+)
+llm_tokens = Counter(f"{PREFIX}_llm_tokens_total", "LLM tokens used.", ("model", "kind"))
+cache_requests = Counter(f"{PREFIX}_cache_requests_total", "Cache lookups by result.", ("cache", "result"))
+FAMILIES = [stage_seconds, request_seconds, llm_tokens, cache_requests]
+
+
+# ---- RECORDING ----
+def start_trace():
+    """Start collecting the spans of the current request."""
+    _trace.set([])
+
+
+def observe_stage(stage, seconds):
+    stage_seconds.observe((stage,), seconds)
+    trace = _trace.get()
+    if trace is not None:
+        trace.append((stage, seconds))
+
+
+@contextmanager
+def span(stage):
+    """Time the enclosed block as `stage`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+
+def observe_request(route, seconds):
+    request_seconds.observe((route,), seconds)
+
+
+def record_usage(model, usage):
+    """Count the tokens of an LLM response's `usage` (an object or a dict, OpenAI or LangChain names)."""
+    if usage is None:
+        return
+    get = usage.get if isinstance(usage, dict) else lambda name: getattr(usage, name, None)
+    prompt = get("prompt_tokens") or get("input_tokens") or 0
+    completion = get("completion_tokens") or get("output_tokens") or 0
+    if prompt:
+        llm_tokens.inc((model or "unknown", "prompt"), prompt)
+    if completion:
+        llm_tokens.inc((model or "unknown", "completion"), completion)
+
+
+def cache_event(cache, hit, count=1):
+    if count:
+        cache_requests.inc((cache, "hit" if hit else "miss"), count)
+
+
+# ---- EXPORT ----
+def wants_server_timing(headers):
+    return SERVER_TIMING or headers.get("X-Server-Timing", "").lower() in ("1", "true", "yes")
+
+
+def server_timing():
+    """Server-Timing header value for the current request's spans, summed per stage."""
+    totals = {}
+    for stage, seconds in _trace.get() or []:
+        totals[stage] = totals.get(stage, 0.0) + seconds
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in totals.items())
+
+
+def snapshot():
+    """This process's metrics as plain data, for render() in another process."""
+    with _lock:
+        return {"pid": os.getpid(), "families": {family.name: dict(family.values) for family in FAMILIES}}
+
+
+def render(snapshots=()):
+    """All metrics in the Prometheus text exposition format, with those of `snapshots` from other processes."""
+    with _lock:
+        lines = [
+            line
+            for family in FAMILIES
+            for line in family.lines(
+                [(other["pid"], other["families"].get(family.name, {})) for other in snapshots]
+            )
+        ]
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,178 @@
+import os
+import re
+import json
+import hashlib
+import threading
+import numpy as np
+from ttlCache import TTLCache
+from carCatalog import catalog
+from carFilters import parse_constraints
+from catalogSync import catalog_fingerprint
+from embeddingCache import get_embedding, embedding_model
+import metrics
+
+# ---- RESPONSE CACHE CONFIG ----
+# Replies are cached by the normalized tail of the conversation (the system
+# prompt plus the last RESPONSE_CACHE_TAIL messages) and the route that
+# answered it, so common openers such as the quick actions are only sent to the
+# LLM once per TTL. Every key includes the catalog fingerprint, so a catalog
+# change never serves answers about the old catalog.
+#
+# The optional semantic tier (RESPONSE_CACHE_SEMANTIC=1) also answers a
+# question whose embedding is within RESPONSE_CACHE_SIMILARITY of a cached one
+# with the same earlier messages, the same parsed constraints and the same
+# numbers, so "xe dưới 1 tỷ" never matches "xe dưới 2 tỷ".
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "1").lower() in ("1", "true", "yes")
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1024"))
+RESPONSE_CACHE_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "3600"))
+RESPONSE_CACHE_TAIL = int(os.getenv("RESPONSE_CACHE_TAIL", "3"))
+RESPONSE_CACHE_SEMANTIC = os.getenv("RESPONSE_CACHE_SEMANTIC", "0").lower() in ("1", "true", "yes")
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.95"))
+RESPONSE_CACHE_SEMANTIC_PER_CONTEXT = int(os.getenv("RESPONSE_CACHE_SEMANTIC_PER_CONTEXT", "64"))
+# Web search answers go stale, so routes that may use it are never cached.
+UNCACHED_ROUTES = {"search", "fanout"}
+
+responses = TTLCache(RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL_SECONDS)
+# context key -> [(unit embedding of the last user message, exact key), ...]
+semantic = TTLCache(RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL_SECONDS)
+counters = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "stores": 0}
+_lock = threading.Lock()
+_fingerprint = None
+
+
+def catalog_version():
+    # The catalog is loaded once per process, so the fingerprint never changes
+    # under a running cache; a new catalog means a restart and new keys.
+    global _fingerprint
+    if _fingerprint is None:
+        _fingerprint = catalog_fingerprint(catalog.cars, embedding_model())
+    return _fingerprint
+
+
+def normalize_message(text):
+    text = re.sub(r"\s+", " ", str(text)).strip().lower()
+    return re.sub(r"[\s.!?…]+$", "", text)
+
+
+def _digest(payload):
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class CacheKey:
+    def __init__(self, context, exact, query):
+        self.context = context
+        self.exact = exact
+        self.query = query
+        self.vector = None
+
+
+def response_key(messages, route):
+    """CacheKey for answering `messages` on `route`, or None when it must not be cached."""
+    if not RESPONSE_CACHE_ENABLED or route in UNCACHED_ROUTES or not messages:
+        return None
+    last = messages[-1]
+    if last.get("role") != "user" or not str(last.get("content", "")).strip():
+        return None
+    system = [normalize_message(m.get("content", "")) for m in messages if m.get("role") == "system"]
+    tail = [
+        (m.get("role"), normalize_message(m.get("content", "")))
+        for m in messages if m.get("role") != "system"
+    ][-RESPONSE_CACHE_TAIL:]
+    query = tail[-1][1]
+    constraints = {name: sorted(value) if isinstance(value, set) else value
+                   for name, value in parse_constraints(query).items()}
+    context = _digest({
+        "catalog": catalog_version(),
+        "route": route,
+        "system": system,
+        "history": tail[:-1],
+        "constraints": constraints,
+        "numbers": re.findall(r"\d+(?:[.,]\d+)?", query),
+    })
+    return CacheKey(context, _digest([context, query]), query)
+
+
+def _unit_embedding(text):
+    vector = np.asarray(get_embedding(text), dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def _count(name):
+    with _lock:
+        counters[name] += 1
+    if name != "stores":
+        metrics.cache_event("response", name != "misses")
+
+
+def lookup(key):
+    """Cached {"message", "images"} for `key`, or None."""
+    if key is None:
+        return None
+    payload = responses.get(key.exact)
+    if payload is not None:
+        _count("exact_hits")
+        return payload
+    if RESPONSE_CACHE_SEMANTIC:
+        candidates = semantic.get(key.context)
+        try:
+            key.vector = _unit_embedding(key.query)
+        except Exception as e:
+            print(f"Response cache embedding failed: {e}")
+        if candidates and key.vector is not None:
+            scores = np.stack([vector for vector, _ in candidates]) @ key.vector
+            best = int(np.argmax(scores))
+            if scores[best] >= RESPONSE_CACHE_SIMILARITY:
+                payload = responses.get(candidates[best][1])
+                if payload is not None:
+                    _count("semantic_hits")
+                    return payload
+    _count("misses")
+    return None
+
+
+def store(key, message, images=None):
+    if key is None or not message and not images:
+        return
+    responses.put(key.exact, {"message": message, "images": images})
+    _count("stores")
+    if RESPONSE_CACHE_SEMANTIC and key.vector is not None:
+        with _lock:
+            candidates = [c for c in semantic.get(key.context) or [] if c[1] != key.exact]
+            candidates.append((key.vector, key.exact))
+            semantic.put(key.context, candidates[-RESPONSE_CACHE_SEMANTIC_PER_CONTEXT:])
+
+
+def recording(stream, key):
+    """Pass `stream` (a chatStream.TokenStream) through, caching the reply once it completes."""
+    if key is None:
+        return stream
+    chunks = stream.chunks
+
+    def record():
+        parts = []
+        for delta in chunks:
+            parts.append(delta)
+            yield delta
+        store(key, "".join(parts), stream.images)
+
+    async def record_async():
+        parts = []
+        async for delta in chunks:
+            parts.append(delta)
+            yield delta
+        store(key, "".join(parts), stream.images)
+
+    stream.chunks = record_async() if hasattr(chunks, "__aiter__") else record()
+    return stream
+
+
+def stats():
+    with _lock:
+        stats = dict(counters)
+    lookups = stats["exact_hits"] + stats["semantic_hits"] + stats["misses"]
+    stats["hit_rate"] = round((stats["exact_hits"] + stats["semantic_hits"]) / lookups, 4) if lookups else 0.0
+    stats["size"] = len(responses)
+    stats["evictions"] = responses.stats()["evictions"]
+    stats["semantic"] = RESPONSE_CACHE_SEMANTIC
+    return stats
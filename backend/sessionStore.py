@@ -0,0 +1,83 @@
+import os
+from ttlCache import TTLCache, SqliteTTLStore
+
+# ---- SESSION STORE CONFIG ----
+# Conversations are kept on the server, keyed by the client's sessionId, so a
+# chat request only carries the new message: {"sessionId": ..., "message": ...}.
+# The server adds the system prompt and the session's history (its last
+# SESSION_MAX_MESSAGES messages; contextWindow then fits them to the route's
+# budget), and records the exchange once the reply is complete. Exchanges the
+# assistant refused are not kept.
+#
+# SESSION_BACKEND=sqlite (default) keeps sessions in SESSION_DB_PATH, shared by
+# every gunicorn worker and kept across restarts; "memory" keeps them in the
+# process, for a single worker or the ASGI app. A session idle for
+# SESSION_TTL_SECONDS expires; past SESSION_MAX_SESSIONS the least recently
+# used are dropped.
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "sqlite").lower()
+SESSION_DB_PATH = os.getenv(
+    "SESSION_DB_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "sessions.sqlite3"),
+)
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", str(24 * 3600)))
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "10000"))
+SESSION_MAX_MESSAGES = int(os.getenv("SESSION_MAX_MESSAGES", "20"))
+
+SYSTEM_PROMPT = """Bạn là một chuyên gia sale trong lĩnh vực mua bán xe hơi tại thị trường Việt Nam.
+Nhiệm vụ của bạn là hỗ trợ, tư vấn và giải đáp các thắc mắc liên quan trực tiếp đến việc mua bán, lựa chọn, sử dụng, đánh giá, tài chính, bảo hiểm, thủ tục pháp lý, dịch vụ hậu mãi và các vấn đề kỹ thuật của xe hơi tại Việt Nam.
+Bạn cũng có thể hỗ trợ cung cấp thông tin liên hệ công khai (như số điện thoại, địa chỉ, website...) của các đại lý, showroom, trung tâm dịch vụ xe ô tô tại Việt Nam nếu người dùng yêu cầu, miễn đó là thông tin hợp lệ, công khai và không vi phạm quyền riêng tư.
+Bạn cũng có thể hỗ trợ người dùng tìm kiếm, giới thiệu và cung cấp hình ảnh minh họa (nếu có) về các mẫu xe hơi, các bộ phận, phụ kiện, hoặc các dịch vụ liên quan đến xe ô tô tại thị trường Việt Nam.
+Nếu người dùng đưa ra bất kỳ câu hỏi, yêu cầu hoặc thông tin nào không hoàn toàn nằm trong phạm vi lĩnh vực mua bán xe hơi và các vấn đề liên quan trực tiếp đến xe hơi, bạn phải trả lời: "Xin lỗi bạn đây là câu hỏi nằm ngoài lĩnh vực của tôi. Xin hãy đặt lại câu hỏi."
+Nếu người dùng đặt câu hỏi hoặc câu nói quá chung chung, không rõ ràng nhưng có thể liên quan đến ô tô hoặc lĩnh vực kinh doanh xe hơi (ví dụ: chỉ nói về "bánh xe", "hợp đồng", "giấy tờ", v.v...), bạn hãy trả lời bằng cách:
+-Gợi ý cho người dùng về các chủ đề xoay quanh lĩnh vực ô tô và kinh doanh xe hơi liên quan đến từ khóa họ vừa đề cập.
+-Đặt câu hỏi ngược lại để người dùng làm rõ hơn ý của họ hoặc mong muốn nhận được thông tin gì về chủ đề đó trong lĩnh vực mua bán xe ô tô.
+Ví dụ: Nếu người dùng chỉ nói "bánh xe", bạn có thể trả lời: "Bạn muốn hỏi về việc lựa chọn bánh xe phù hợp cho xe ô tô, cách bảo dưỡng bánh xe, hay chi phí thay bánh xe khi mua bán? Xin hãy nói rõ hơn để tôi hỗ trợ bạn tốt nhất."
+Nếu người dùng chỉ nói "hợp đồng", bạn có thể trả lời: "Bạn đang quan tâm đến hợp đồng mua bán xe ô tô, hợp đồng bảo hiểm, hay thủ tục pháp lý khi ký hợp đồng xe hơi? Bạn có thể nói rõ hơn để tôi tư vấn chi tiết hơn cho bạn."
+Luôn giữ vai trò là chuyên gia sale xe ô tô, chỉ tập trung vào các nội dung liên quan trực tiếp đến lĩnh vực này.
+Nếu câu hỏi có cả nội dung ngoài lĩnh vực ô tô, vẫn trả lời từ chối như trên. Câu trả lời thêm nhiều emoticon sinh động"""
+# Added to the current question (not to the history) when it asks for a comparison.
+COMPARE_HINT = (
+    " trả lời dưới dạng bảng ví dụ như sau | Header 1 | Header 2 | Header 3 | | :------- | :------: | -------: |"
+    " | Row 1 Col 1 | Row 1 Col 2 | Row 1 Col 3 | | Row 2 Col 1 | Row 2 Col 2 | Row 2 Col 3 |"
+)
+REFUSAL_MARKERS = ("xin lỗi", "đặt lại câu hỏi", "ngoài phạm vi")
+
+if SESSION_BACKEND == "memory":
+    sessions = TTLCache(SESSION_MAX_SESSIONS, SESSION_TTL_SECONDS)
+else:
+    sessions = SqliteTTLStore(SESSION_DB_PATH, "sessions", SESSION_MAX_SESSIONS, SESSION_TTL_SECONDS)
+
+
+def history(session):
+    """The session's stored messages, oldest first."""
+    return sessions.get(session) or []
+
+
+def prompt_messages(session, message):
+    """The conversation to answer `message` with: system prompt, the session's history, the new message."""
+    if "so sánh" in message.lower():
+        message += COMPARE_HINT
+    return [{"role": "system", "content": SYSTEM_PROMPT}] + history(session) + [{"role": "user", "content": message}]
+
+
+def is_refusal(reply):
+    reply = str(reply or "").lower()
+    return any(marker in reply for marker in REFUSAL_MARKERS)
+
+
+def record(session, message, reply):
+    """Append the exchange to the session (unless it was refused), keeping its last SESSION_MAX_MESSAGES."""
+    if is_refusal(reply):
+        return
+    exchange = [{"role": "user", "content": message}, {"role": "assistant", "content": str(reply or "")}]
+    # One atomic read-modify-write, so concurrent replies of a session (even
+    # from different gunicorn workers) do not overwrite each other's exchange.
+    sessions.update(session, lambda messages: ((messages or []) + exchange)[-SESSION_MAX_MESSAGES:])
+
+
+def clear(session):
+    sessions.pop(session)
+
+
+def stats():
+    return dict(sessions.stats(), backend=SESSION_BACKEND)
@@ -1,51 +1,56 @@
 import os
-from config import embedding_client
-from databaseCars import database_cars
-from pinecone import Pinecone, ServerlessSpec
+from types import SimpleNamespace
+from carCatalog import catalog, render_car_list
+from embeddingCache import get_embedding, get_embedding_async
+from catalogSync import connect_pinecone, sync_pinecone, LocalPineconeIndex
+from vectorIndex import use_numpy_backend, get_vector_index
+from carFilters import prefilter
+import subsystems
+from upstreams import limit, run_blocking
+from metrics import span
 
-# Step 1:
-pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
+# The index is kept in sync out of band (`python catalogSync.py pinecone`), so
+# importing this module makes no network calls. PINECONE_LOCAL=1 swaps in an
+# in-process index filled from the catalog, for development without Pinecone.
+PINECONE_LOCAL = os.getenv("PINECONE_LOCAL", "").lower() in ("1", "true", "yes")
 
-# Step 2: Create or connect to an index
-index_name = "product-similarity-index"
-if index_name not in [index["name"] for index in pc.list_indexes()]:
-    pc.create_index(
-        name=index_name,
-        dimension=1536,
-        spec=ServerlessSpec(cloud="aws", region="us-east-1"),
-    ) # dimension matches text-embedding-3-small output size
-index = pc.Index(index_name)
+def open_index():
+    if PINECONE_LOCAL:
+        local_index = LocalPineconeIndex()
+        sync_pinecone(local_index, catalog.cars)
+        return local_index
+    return connect_pinecone()
 
-# Step 3: Upsert sample product vectors into the index
-def get_embedding(text):
-    response = embedding_client.embeddings.create(
-        input=text, model=os.getenv("OPENAI_EMBEDDING_MODEL")
-    )
-    return response.data[0].embedding
-vectors = []
-for car in database_cars:
-    var_embedding = f"""name: {car['name']} 
-                    brand: {car['brand']}
-                    price_min: {car['price_min']}
-                    price_max: {car['price_max']}
-                    segment: {car['segment']}
-                    seats: {car['seats']}
-                    fuel_type: {car['fuel_type']}
-                    transmission: {car['transmission']}
-                    """
-    embedding = get_embedding(var_embedding)
-    vectors.append((car["id"], embedding))
-index.upsert(vectors)
+pinecone = subsystems.register("pinecone", open_index, enabled=not use_numpy_backend())
+
+def get_index():
+    return pinecone.get()
+
+def query_similar(query_embedding, top_k, candidate_ids=None, where=None):
+    """Pinecone-shaped query results from whichever vector backend is configured."""
+    with span("vector_query"):
+        if use_numpy_backend():
+            index = get_vector_index()
+            mask = None if candidate_ids is None else index.id_mask(candidate_ids)
+            hits = index.query(query_embedding, top_k, mask=mask)
+            return SimpleNamespace(matches=[SimpleNamespace(id=car_id, score=score) for car_id, score in hits])
+        return get_index().query(vector=query_embedding, top_k=top_k, include_metadata=False, filter=where)
 
 def callPinecone(user_input):
     prompt = user_input[-1]["content"]
     query_embedding = get_embedding(prompt)
     top_k = 5
-    results = index.query(vector=query_embedding, top_k=top_k, include_metadata=False)
-    response = "Top 5 xe phù hợp với yêu cầu của bạn là\n\n"
-    for match in results.matches:
-        product_id = match.id
-        score = match.score
-        car = next(car for car in database_cars if car["id"] == product_id)
-        response += f"- {car['name']}:\n   {car['features']}\n\n"
-    return response
\ No newline at end of file
+    candidate_ids, where = prefilter(prompt)
+    results = query_similar(query_embedding, top_k, candidate_ids, where)
+    cars = catalog.get_many(match.id for match in results.matches)
+    return render_car_list("Top 5 xe phù hợp với yêu cầu của bạn là\n\n", cars)
+
+async def callPineconeAsync(user_input):
+    prompt = user_input[-1]["content"]
+    async with limit("embedding"):
+        query_embedding = await get_embedding_async(prompt)
+    top_k = 5
+    candidate_ids, where = prefilter(prompt)
+    results = await run_blocking("vector", query_similar, query_embedding, top_k, candidate_ids, where)
+    cars = catalog.get_many(match.id for match in results.matches)
+    return render_car_list("Top 5 xe phù hợp với yêu cầu của bạn là\n\n", cars)
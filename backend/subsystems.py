@@ -0,0 +1,131 @@
+import os
+import time
+import asyncio
+import threading
+import multiprocessing
+
+# ---- SUBSYSTEMS ----
+# Heavy backends (Chroma, the LangGraph search agent, Pinecone, the numpy
+# vector index, the router's centroids, the TTS pool) are registered here
+# and built on first use, so importing the app only costs what plain chat
+# needs. At startup warm_up() builds them in background threads; /health/ready
+# reports the state of each one.
+#
+# SUBSYSTEM_WARMUP: "1" warms every registered subsystem (default), "0" none,
+# or a comma-separated list of names. A subsystem whose build failed is
+# retried by the next get(), or by peek() after SUBSYSTEM_RETRY_SECONDS.
+SUBSYSTEM_WARMUP = os.getenv("SUBSYSTEM_WARMUP", "1")
+SUBSYSTEM_RETRY_SECONDS = float(os.getenv("SUBSYSTEM_RETRY_SECONDS", "30"))
+
+IDLE, LOADING, READY, FAILED = "idle", "loading", "ready", "failed"
+
+
+class Subsystem:
+    def __init__(self, name, factory, enabled=True, required=True):
+        self.name = name
+        self.factory = factory
+        self.enabled = enabled
+        self.required = required
+        self.state = IDLE
+        self.value = None
+        self.error = None
+        self.seconds = None
+        self.failed_at = 0.0
+        self.lock = threading.Lock()
+
+    def get(self):
+        """The built subsystem, building it now (or waiting for the warm-up) if needed.
+
+        A failed build is retried on the next call.
+        """
+        if self.state == READY:
+            return self.value
+        with self.lock:
+            if self.state != READY:
+                self.state = LOADING
+                start = time.perf_counter()
+                try:
+                    self.value = self.factory()
+                except Exception as e:
+                    self.state, self.error = FAILED, str(e)
+                    self.failed_at = time.monotonic()
+                    print(f"Subsystem {self.name} failed to initialize: {e}")
+                    raise
+                finally:
+                    self.seconds = time.perf_counter() - start
+                self.state, self.error = READY, None
+        return self.value
+
+    async def get_async(self):
+        """get() for the ASGI app: a build still in progress is waited for off the event loop."""
+        if self.state == READY:
+            return self.value
+        return await asyncio.to_thread(self.get)
+
+    def peek(self):
+        """The subsystem if it is ready, else None without waiting; an idle or failed one starts warming."""
+        if self.state == READY:
+            return self.value
+        if not self.enabled:
+            return None
+        if self.state == IDLE or (
+            self.state == FAILED and time.monotonic() - self.failed_at > SUBSYSTEM_RETRY_SECONDS
+        ):
+            self.warm()
+        return None
+
+    def warm(self):
+        if self.state in (IDLE, FAILED):
+            self.state = LOADING
+        threading.Thread(target=self._warm, name=f"warm-{self.name}", daemon=True).start()
+
+    def _warm(self):
+        try:
+            self.get()
+        except Exception:
+            pass
+
+    def status(self):
+        status = {"state": self.state if self.enabled else "disabled"}
+        if self.seconds is not None:
+            status["seconds"] = round(self.seconds, 3)
+        if self.error:
+            status["error"] = self.error
+        if not self.required:
+            status["required"] = False
+        return status
+
+
+registry = {}
+
+
+def register(name, factory, enabled=True, required=True):
+    """Register a lazily built subsystem.
+
+    `enabled=False` for one the current configuration never uses; one that is
+    not `required` has a fallback, so it does not hold back readiness.
+    """
+    subsystem = registry[name] = Subsystem(name, factory, enabled, required)
+    return subsystem
+
+
+def warm_up(names=None):
+    """Start building the subsystems selected by SUBSYSTEM_WARMUP in background threads."""
+    if multiprocessing.parent_process() is not None:
+        # A spawned TTS worker re-importing the app module.
+        return
+    if names is None:
+        if SUBSYSTEM_WARMUP.lower() in ("0", "false", "no", ""):
+            return
+        names = registry if SUBSYSTEM_WARMUP.lower() in ("1", "true", "yes") else SUBSYSTEM_WARMUP.split(",")
+    for name in names:
+        subsystem = registry.get(name.strip())
+        if subsystem is not None and subsystem.enabled and subsystem.state == IDLE:
+            subsystem.warm()
+
+
+def readiness():
+    """(every enabled, required subsystem is ready, {name: status})."""
+    statuses = {name: subsystem.status() for name, subsystem in registry.items()}
+    ready = all(subsystem.state == READY for subsystem in registry.values() if subsystem.enabled and subsystem.required)
+    return ready, statuses
@@ -0,0 +1,197 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Thread-safe in-memory LRU cache whose entries also expire after `ttl` seconds.
+
+    Once `max_entries` is reached the least recently used entry is dropped.
+    `stats()` reports hits, misses, evictions and the hit rate.
+    """
+
+    def __init__(self, max_entries=1024, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (expires_at, value)
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self.lock:
+            item = self.entries.get(key)
+            if item is not None and item[0] <= now:
+                del self.entries[key]
+                self.counters["expirations"] += 1
+                item = None
+            if item is None:
+                self.counters["misses"] += 1
+                return default
+            self.entries.move_to_end(key)
+            self.counters["hits"] += 1
+            return item[1]
+
+    def put(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self.lock:
+            self.entries[key] = (expires_at, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.counters["evictions"] += 1
+
+    def pop(self, key, default=None):
+        with self.lock:
+            item = self.entries.pop(key, None)
+        return default if item is None else item[1]
+
+    def update(self, key, update, ttl=None):
+        """Replace the value of `key` with `update(current value or None)` atomically; returns it."""
+        now = time.monotonic()
+        with self.lock:
+            item = self.entries.get(key)
+            value = update(item[1] if item is not None and item[0] > now else None)
+            self.entries[key] = (now + (self.ttl if ttl is None else ttl), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.counters["evictions"] += 1
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters, size=len(self.entries), max_entries=self.max_entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        return stats
+
+
+class SqliteTTLStore:
+    """TTLCache persisted in SQLite, so entries survive restarts and are shared by every worker.
+
+    Values are stored as JSON. Reads refresh an entry's last access; once
+    `max_entries` is exceeded the least recently used rows are deleted.
+    """
+
+    def __init__(self, path, table, max_entries=4096, ttl=3600):
+        self.path = path
+        self.table = table
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+    def _connection(self):
+        # One connection per thread; WAL lets many workers read while one writes.
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                f"""CREATE TABLE IF NOT EXISTS {self.table} (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )"""
+            )
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_last_access ON {self.table} (last_access)")
+            self.local.conn = conn
+        return conn
+
+    def _count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+    def __len__(self):
+        return self._connection().execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def get(self, key, default=None):
+        conn = self._connection()
+        now = time.time()
+        row = conn.execute(f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        if row is not None and row[1] <= now:
+            conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            self._count("expirations")
+            row = None
+        if row is None:
+            self._count("misses")
+            return default
+        conn.execute(f"UPDATE {self.table} SET last_access = ? WHERE key = ?", (now, key))
+        self._count("hits")
+        return json.loads(row[0])
+
+    def put(self, key, value, ttl=None):
+        now = time.time()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        conn = self._connection()
+        conn.execute(
+            f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at, last_access) VALUES (?, ?, ?, ?)",
+            (key, json.dumps(value, ensure_ascii=False), expires_at, now),
+        )
+        self._evict()
+
+    def update(self, key, update, ttl=None):
+        """Replace the value of `key` with `update(current value or None)` atomically; returns it.
+
+        The read and the write share one IMMEDIATE transaction, so concurrent
+        updates from other threads or processes are serialized, not lost.
+        """
+        now = time.time()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            value = update(json.loads(row[0]) if row is not None and row[1] > now else None)
+            conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), expires_at, now),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self._evict()
+        return value
+
+    def _evict(self):
+        conn = self._connection()
+        excess = len(self) - self.max_entries
+        if excess > 0:
+            evicted = conn.execute(
+                f"DELETE FROM {self.table} WHERE key IN "
+                f"(SELECT key FROM {self.table} ORDER BY last_access LIMIT ?)",
+                (excess,),
+            ).rowcount
+            self._count("evictions", evicted)
+
+    def pop(self, key, default=None):
+        conn = self._connection()
+        row = conn.execute(f"SELECT value FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+        return default if row is None else json.loads(row[0])
+
+    def clear(self):
+        self._connection().execute(f"DELETE FROM {self.table}")
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters, max_entries=self.max_entries)
+        stats["size"] = len(self)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        return stats
@@ -0,0 +1,141 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+import metrics
+
+# ---- TTS CACHE CONFIG ----
+# Synthesized audio is stored by hash(text, model, sampling rate, TTS_OPTIMIZE
+# options), so the same sentence (greetings, refusals, quick-action replies) is
+# only ever synthesized once, whichever reply id it belongs to, and audio of the
+# int8 model is never served for the float32 one (or the other way round). The index is SQLite so several
+# gunicorn workers can share the same directory safely.
+TTS_MODEL_NAME = os.getenv("TTS_MODEL_NAME", "sonktx/mms-tts-vie-finetuned")
+TTS_SAMPLING_RATE = int(os.getenv("TTS_SAMPLING_RATE", "16000"))
+# The model optimizations of audio.py (see its CPU INFERENCE OPTIMIZATION).
+TTS_OPTIMIZE = os.getenv("TTS_OPTIMIZE", "")
+OPTIMIZATIONS = ("fold", "int8")
+TTS_CACHE_DIR = os.getenv(
+    "TTS_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "tts"),
+)
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+# Entries not played for this long are dropped; frequently played ones never expire.
+TTS_CACHE_TTL_SECONDS = int(os.getenv("TTS_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+
+_local = threading.local()
+stats = {"hits": 0, "misses": 0}
+
+
+def parse_optimize(value):
+    options = {option.strip().lower() for option in value.split(",") if option.strip()}
+    if "all" in options:
+        return set(OPTIMIZATIONS)
+    unknown = options - set(OPTIMIZATIONS)
+    if unknown:
+        raise ValueError(f"Unknown TTS_OPTIMIZE option(s): {', '.join(sorted(unknown))}")
+    return options
+
+
+_optimize_tag = ",".join(sorted(parse_optimize(TTS_OPTIMIZE)))
+
+
+def audio_key(text):
+    normalized = re.sub(r"\s+", " ", text).strip()
+    payload = f"{TTS_MODEL_NAME}|{TTS_SAMPLING_RATE}|{_optimize_tag}|{normalized}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def path_for_key(key):
+    return os.path.join(TTS_CACHE_DIR, f"{key}.wav")
+
+
+def _connection():
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        os.makedirs(TTS_CACHE_DIR, exist_ok=True)
+        conn = sqlite3.connect(os.path.join(TTS_CACHE_DIR, "index.sqlite3"), timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS audio (
+                key TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )"""
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS audio_last_access ON audio (last_access)")
+        _local.conn = conn
+    return conn
+
+
+def lookup(text, record=True):
+    """Path of the cached WAV for `text`, or None.
+
+    `record=False` for a re-check after the caller's own lookup was counted.
+    """
+    key = audio_key(text)
+    path = path_for_key(key)
+    conn = _connection()
+    row = conn.execute("SELECT last_access FROM audio WHERE key = ?", (key,)).fetchone()
+    now = time.time()
+    if row is None or now - row[0] > TTS_CACHE_TTL_SECONDS or not os.path.exists(path):
+        if record:
+            stats["misses"] += 1
+            metrics.cache_event("tts", False)
+        return None
+    if record:
+        stats["hits"] += 1
+        metrics.cache_event("tts", True)
+    conn.execute("UPDATE audio SET last_access = ? WHERE key = ?", (now, key))
+    return path
+
+
+def store(text, wav_bytes):
+    """Atomically add a WAV for `text` and evict old entries past the size cap."""
+    key = audio_key(text)
+    path = path_for_key(key)
+    os.makedirs(TTS_CACHE_DIR, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(wav_bytes)
+    os.replace(tmp_path, path)
+    conn = _connection()
+    conn.execute(
+        "INSERT OR REPLACE INTO audio (key, size, last_access) VALUES (?, ?, ?)",
+        (key, len(wav_bytes), time.time()),
+    )
+    evict()
+    return path
+
+
+def evict():
+    """Drop idle entries past the TTL, then least recently played ones past the size cap."""
+    conn = _connection()
+    cutoff = time.time() - TTS_CACHE_TTL_SECONDS
+    # BEGIN IMMEDIATE serializes eviction across workers.
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        victims = [key for (key,) in conn.execute("SELECT key FROM audio WHERE last_access < ?", (cutoff,))]
+        total = conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM audio WHERE last_access >= ?", (cutoff,)
+        ).fetchone()[0]
+        if total > TTS_CACHE_MAX_BYTES:
+            for key, size in conn.execute(
+                "SELECT key, size FROM audio WHERE last_access >= ? ORDER BY last_access", (cutoff,)
+            ).fetchall():
+                victims.append(key)
+                total -= size
+                if total <= TTS_CACHE_MAX_BYTES:
+                    break
+        conn.executemany("DELETE FROM audio WHERE key = ?", [(key,) for key in victims])
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    for key in victims:
+        try:
+            os.remove(path_for_key(key))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,333 @@
+import os
+import time
+import threading
+import multiprocessing
+import numpy as np
+from concurrent.futures import CancelledError, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing.managers import BaseManager
+import audio
+import ttsCache
+import subsystems
+import metrics
+from metrics import span
+
+# ---- TTS POOL CONFIG ----
+# TTS runs in one service process that owns a pool of TTS_WORKERS model
+# processes. Web workers only hold a proxy to it (TTS_POOL_ADDRESS), so the
+# model is loaded once per pool worker instead of once per gunicorn worker.
+# Without TTS_POOL_ADDRESS the service runs inside the current process, which
+# still keeps the model out of the request threads.
+TTS_WORKERS = int(os.getenv("TTS_WORKERS", "1"))
+TTS_QUEUE_SIZE = int(os.getenv("TTS_QUEUE_SIZE", "32"))
+TTS_JOB_TIMEOUT = float(os.getenv("TTS_JOB_TIMEOUT", "120"))
+TTS_POOL_ADDRESS = os.getenv("TTS_POOL_ADDRESS", "")
+TTS_POOL_AUTHKEY = os.getenv("TTS_POOL_AUTHKEY", "car-agent-tts").encode()
+TTS_CONNECT_TIMEOUT = float(os.getenv("TTS_CONNECT_TIMEOUT", "30"))
+# After failing to reach the pool, calls fail at once for this long instead of
+# each waiting TTS_CONNECT_TIMEOUT again.
+TTS_RECONNECT_SECONDS = float(os.getenv("TTS_RECONNECT_SECONDS", "30"))
+TTS_STREAM_THREADS = int(os.getenv("TTS_STREAM_THREADS", "8"))
+# Replies are synthesized in the background as soon as they are produced, at
+# lower priority than audio someone is waiting for, so most play clicks are
+# cache hits. At most TTS_SPECULATIVE_MAX replies are pre-synthesized at once.
+TTS_PRESYNTHESIZE = os.getenv("TTS_PRESYNTHESIZE", "1").lower() in ("1", "true", "yes")
+TTS_SPECULATIVE_MAX = int(os.getenv("TTS_SPECULATIVE_MAX", "16"))
+# Pre-synthesis calls waiting to be sent to the pool; past this many (the pool
+# is slow or unreachable) new ones are dropped instead of queued.
+TTS_PRESYNTH_QUEUE_MAX = int(os.getenv("TTS_PRESYNTH_QUEUE_MAX", "64"))
+
+
+def worker_threads(workers):
+    """Intra-op threads per pool worker: TTS_TORCH_THREADS, or the cores split evenly."""
+    if audio.TTS_TORCH_THREADS > 0:
+        return audio.TTS_TORCH_THREADS
+    return max(1, (os.cpu_count() or 1) // workers)
+
+
+class TTSBusy(Exception):
+    """The TTS job queue is full; the caller should retry later."""
+
+
+class TTSService:
+    def __init__(self, workers=TTS_WORKERS, queue_size=TTS_QUEUE_SIZE):
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=audio.load_model,
+            initargs=(worker_threads(workers),),
+        )
+        self.synthesizer = audio.BatchSynthesizer(executor=self.executor, max_inflight=workers)
+        self.slots = threading.BoundedSemaphore(queue_size)
+        self.pending = {}
+        self.lock = threading.Lock()
+        # Pre-synthesis state: background jobs by sentence key, the jobs of each
+        # session's latest reply, and the number of replies in flight.
+        self.speculative = {}
+        self.sessions = {}
+        self.speculating = 0
+        self.background = ThreadPoolExecutor(max_workers=2, thread_name_prefix="tts-presynth")
+
+    def warm(self, workers=TTS_WORKERS):
+        """Start the worker processes and wait until each has loaded the model."""
+        return len(set(self.executor.map(_worker_pid, range(workers))))
+
+    def _coalesced(self, key, work):
+        """Run `work` once per key; concurrent callers with the same key wait on the same future."""
+        with self.lock:
+            future = self.pending.get(key)
+            owner = future is None
+            if owner:
+                if not self.slots.acquire(blocking=False):
+                    raise TTSBusy("TTS queue is full")
+                future = Future()
+                self.pending[key] = future
+        if owner:
+            try:
+                future.set_result(work())
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                with self.lock:
+                    self.pending.pop(key, None)
+                self.slots.release()
+        return future.result(timeout=TTS_JOB_TIMEOUT)
+
+    def submit(self, sentence):
+        """Queue one sentence for synthesis, taking over its background job if there is one."""
+        with self.lock:
+            job = self.speculative.get(ttsCache.audio_key(sentence))
+        if job is not None and self.synthesizer.promote(job):
+            return job
+        return self.synthesizer.submit(sentence)
+
+    def synthesize(self, text):
+        """Path of the WAV for `text`, synthesizing it. The caller has already missed the cache."""
+        return self._coalesced(("text", ttsCache.audio_key(text)), lambda: self._synthesize_to_cache(text))
+
+    def _synthesize_to_cache(self, text):
+        # A job for the same text may have finished since the caller's lookup.
+        path = ttsCache.lookup(text, record=False)
+        if path is None:
+            path = audio.save_audio(text, audio.synthesize(text, self))
+        return path
+
+    def metrics(self):
+        """The service process's metrics (batch timings), for the web process's /metrics."""
+        return metrics.snapshot()
+
+    def synthesize_sentence(self, sentence):
+        """Waveform for one sentence, batched with every other pending sentence."""
+        return self._coalesced(
+            ("sentence", ttsCache.audio_key(sentence)),
+            lambda: self.submit(sentence).result(),
+        )
+
+    def presynthesize(self, text, session=None):
+        """Synthesize `text` into the cache in the background.
+
+        Starting another reply for the same session (or cancel(session)) drops
+        the parts of this one that have not reached the model yet.
+        """
+        self.cancel(session)
+        if os.path.exists(ttsCache.path_for_key(ttsCache.audio_key(text))):
+            return False
+        sentences = audio.split_sentences(text)
+        if not sentences:
+            return False
+        with self.lock:
+            if self.speculating >= TTS_SPECULATIVE_MAX:
+                return False
+            self.speculating += 1
+            jobs = []
+            for sentence in sentences:
+                key = ttsCache.audio_key(sentence)
+                job = self.synthesizer.submit(sentence, priority=audio.BACKGROUND)
+                self.speculative[key] = job
+                jobs.append((key, job))
+            if session is not None:
+                self.sessions[session] = jobs
+        self.background.submit(self._store_speculation, text, session, jobs)
+        return True
+
+    def cancel(self, session):
+        """Cancel the pending background synthesis of `session`'s last reply."""
+        if session is None:
+            return
+        with self.lock:
+            jobs = self.sessions.pop(session, None)
+        if jobs:
+            self.synthesizer.cancel([job for _, job in jobs])
+
+    def _store_speculation(self, text, session, jobs):
+        try:
+            audio.save_audio(text, np.concatenate([job.result() for _, job in jobs]))
+        except CancelledError:
+            pass
+        except Exception as e:
+            print(f"TTS pre-synthesis failed: {e}")
+        finally:
+            with self.lock:
+                self.speculating -= 1
+                for key, job in jobs:
+                    if self.speculative.get(key) is job:
+                        del self.speculative[key]
+                if self.sessions.get(session) is jobs:
+                    del self.sessions[session]
+
+
+def _worker_pid(_):
+    return os.getpid()
+
+
+_service = None
+_service_lock = threading.Lock()
+def _local_service():
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = TTSService()
+    return _service
+
+
+class TTSManager(BaseManager):
+    pass
+
+TTSManager.register("get_service", callable=_local_service)
+
+
+def _parse_address(address):
+    host, port = address.rsplit(":", 1)
+    return host, int(port)
+
+
+_proxy = None
+_connect_failed_at = None
+def get_service():
+    """The TTS service: a proxy to the pool process, or an in-process instance."""
+    global _proxy, _connect_failed_at
+    if not TTS_POOL_ADDRESS:
+        return _local_service()
+    with _service_lock:
+        if _proxy is None:
+            if _connect_failed_at is not None and time.monotonic() - _connect_failed_at < TTS_RECONNECT_SECONDS:
+                raise ConnectionRefusedError(f"TTS pool at {TTS_POOL_ADDRESS} is unreachable")
+            manager = TTSManager(address=_parse_address(TTS_POOL_ADDRESS), authkey=TTS_POOL_AUTHKEY)
+            deadline = time.monotonic() + TTS_CONNECT_TIMEOUT
+            while True:
+                try:
+                    manager.connect()
+                    break
+                except (ConnectionRefusedError, FileNotFoundError):
+                    # The pool process may still be starting.
+                    if time.monotonic() > deadline:
+                        _connect_failed_at = time.monotonic()
+                        raise
+                    time.sleep(0.5)
+            _proxy = manager.get_service()
+            _connect_failed_at = None
+    return _proxy
+
+
+def _call(service, method, *args):
+    """service.method(*args); if the pool connection broke, the next get_service() reconnects."""
+    global _proxy
+    try:
+        return getattr(service, method)(*args)
+    except (EOFError, ConnectionError):
+        # The pool process restarted or died: this proxy's connection is gone for good.
+        with _service_lock:
+            if _proxy is service:
+                _proxy = None
+        raise
+
+
+def _warm_service():
+    service = get_service()
+    _call(service, "warm")
+    return service
+
+tts = subsystems.register("tts", _warm_service)
+
+
+# ---- CLIENT API ----
+_rpc = ThreadPoolExecutor(max_workers=TTS_STREAM_THREADS, thread_name_prefix="tts-rpc")
+# Pre-synthesis calls are fire-and-forget, so a slow or unreachable pool never
+# holds up a chat reply. One thread keeps a session's cancel ahead of its next
+# presynthesize.
+_background_rpc = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tts-presynth-rpc")
+_background_slots = threading.BoundedSemaphore(TTS_PRESYNTH_QUEUE_MAX)
+
+def request_audio(text):
+    """Path of the WAV for `text`. Raises TTSBusy when the pool is saturated."""
+    path = ttsCache.lookup(text)
+    if path is not None:
+        return path
+    with span("tts"):
+        return _call(get_service(), "synthesize", text)
+
+def pool_metrics():
+    """[metrics snapshot of the TTS pool process] once connected to one, else []."""
+    proxy = _proxy
+    if not TTS_POOL_ADDRESS or proxy is None:
+        return []
+    try:
+        return [_call(proxy, "metrics")]
+    except Exception as e:
+        print(f"TTS pool metrics failed: {e}")
+        return []
+
+def _synthesize_sentence(service, sentence):
+    with span("tts_sentence"):
+        return _call(service, "synthesize_sentence", sentence)
+
+def stream_audio(text):
+    """Chunked WAV for `text`; sentences are synthesized by the pool in parallel."""
+    service = get_service()
+    return audio.stream_audio(text, submit=lambda sentence: _rpc.submit(_synthesize_sentence, service, sentence))
+
+
+def _run_background(func, *args):
+    try:
+        func(*args)
+    finally:
+        _background_slots.release()
+
+def _submit_background(func, *args):
+    """Queue a pre-synthesis call, unless TTS_PRESYNTH_QUEUE_MAX are already waiting."""
+    if not _background_slots.acquire(blocking=False):
+        print("TTS pre-synthesis queue full, dropping a call")
+        return
+    _background_rpc.submit(_run_background, func, *args)
+
+def _presynthesize(text, session):
+    try:
+        _call(get_service(), "presynthesize", text, session)
+    except Exception as e:
+        # Pre-synthesis is best effort; the reply itself must not fail.
+        print(f"TTS pre-synthesis failed: {e}")
+
+def presynthesize(text, session=None):
+    """Start synthesizing a reply in the background so playing it is a cache hit. Returns at once."""
+    if not TTS_PRESYNTHESIZE or not text or not text.strip():
+        return
+    _submit_background(_presynthesize, text, session)
+
+def _cancel(session):
+    try:
+        _call(get_service(), "cancel", session)
+    except Exception as e:
+        print(f"TTS pre-synthesis cancel failed: {e}")
+
+def cancel_presynthesis(session):
+    """Called when `session` sends a new message: its last reply is no longer worth speaking. Returns at once."""
+    if not TTS_PRESYNTHESIZE:
+        return
+    _submit_background(_cancel, session)
+
+
+def serve(address=TTS_POOL_ADDRESS or "127.0.0.1:50055"):
+    manager = TTSManager(address=_parse_address(address), authkey=TTS_POOL_AUTHKEY)
+    server = manager.get_server()
+    _local_service()
+    print(f"TTS pool listening on {address} with {TTS_WORKERS} worker(s)")
+    server.serve_forever()
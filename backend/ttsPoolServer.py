@@ -0,0 +1,12 @@
+import sys
+import ttsPool
+
+# Entry point of the TTS pool process (started by gunicorn.conf.py). Serving
+# from the imported ttsPool module rather than running ttsPool.py as __main__
+# keeps exceptions such as TTSBusy pickled as ttsPool.TTSBusy, so the web
+# workers can unpickle them and `except TTSBusy` matches.
+#
+#   python ttsPoolServer.py 127.0.0.1:50055
+
+if __name__ == "__main__":
+    ttsPool.serve(sys.argv[1] if len(sys.argv) > 1 else ttsPool.TTS_POOL_ADDRESS or "127.0.0.1:50055")
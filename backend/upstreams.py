@@ -0,0 +1,68 @@
+import os
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+# ---- UPSTREAM LIMITS ----
+# In the ASGI app each upstream gets its own concurrency cap, so a burst of
+# chats cannot open unbounded connections to one provider (or get the server
+# rate limited) while requests to the others keep flowing. SDKs that only have
+# a blocking API (Chroma, Pinecone, DuckDuckGo, the TTS pool, SQLite caches)
+# run on a dedicated thread pool, also under their cap.
+UPSTREAM_LIMITS = {
+    "openai": int(os.getenv("UPSTREAM_OPENAI_CONCURRENCY", "64")),
+    "embedding": int(os.getenv("UPSTREAM_EMBEDDING_CONCURRENCY", "32")),
+    "vector": int(os.getenv("UPSTREAM_VECTOR_CONCURRENCY", "32")),
+    "tavily": int(os.getenv("UPSTREAM_TAVILY_CONCURRENCY", "8")),
+    "duckduckgo": int(os.getenv("UPSTREAM_DUCKDUCKGO_CONCURRENCY", "4")),
+    "tts": int(os.getenv("UPSTREAM_TTS_CONCURRENCY", "32")),
+    # Routing and cache lookups: local work that may still need an embedding or LLM call.
+    "router": int(os.getenv("UPSTREAM_ROUTER_CONCURRENCY", "64")),
+}
+BLOCKING_THREADS = int(os.getenv("ASYNC_BLOCKING_THREADS", "128"))
+
+_semaphores = {}
+_executor = ThreadPoolExecutor(max_workers=BLOCKING_THREADS, thread_name_prefix="blocking")
+
+
+def limit(name):
+    """Semaphore capping concurrent calls to upstream `name`.
+
+    Created on first use, inside the running event loop.
+    """
+    semaphore = _semaphores.get(name)
+    if semaphore is None:
+        semaphore = _semaphores[name] = asyncio.Semaphore(UPSTREAM_LIMITS[name])
+    return semaphore
+
+
+async def run_blocking(name, func, *args):
+    """Run blocking `func(*args)` on the blocking pool, within upstream `name`'s limit."""
+    async with limit(name):
+        # In the caller's context, so spans recorded by `func` land in the request's trace.
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(_executor, context.run, func, *args)
+
+
+def limited(name, stream):
+    """Hold a slot of upstream `name` while `stream` (an async chatStream.TokenStream) is consumed."""
+    chunks = stream.chunks
+
+    async def hold():
+        async with limit(name):
+            async for delta in chunks:
+                yield delta
+
+    stream.chunks = hold()
+    return stream
+
+
+async def iterate_blocking(name, iterator):
+    """Async iterator over a blocking iterator, one item per pool call."""
+    done = object()
+    iterator = iter(iterator)
+    while True:
+        item = await run_blocking(name, next, iterator, done)
+        if item is done:
+            return
+        yield item
@@ -0,0 +1,125 @@
+import os
+import json
+import numpy as np
+from carCatalog import catalog
+from embeddingCache import get_embeddings, embedding_model
+from catalogSync import car_text, catalog_fingerprint
+import subsystems
+
+# ---- VECTOR BACKEND CONFIG ----
+# "numpy" answers both the Chroma and Pinecone paths from an in-process matrix;
+# any other value keeps each path on its own store.
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "").lower()
+VECTOR_INDEX_DIR = os.getenv(
+    "VECTOR_INDEX_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "vectors"),
+)
+VECTOR_INDEX_MMAP = os.getenv("VECTOR_INDEX_MMAP", "1").lower() in ("1", "true", "yes")
+
+
+def use_numpy_backend():
+    return VECTOR_BACKEND == "numpy"
+
+
+class NumpyVectorIndex:
+    """Catalog embeddings as one contiguous, L2-normalized float32 matrix.
+
+    Cosine top-k is a single matmul followed by argpartition, so a query costs
+    microseconds for catalogs of this size and needs no external service.
+    """
+
+    def __init__(self, ids, matrix, normalized=False):
+        self.ids = list(ids)
+        self._rows = None
+        if not normalized:
+            matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            matrix = matrix / norms
+        self.matrix = matrix
+
+    def __len__(self):
+        return len(self.ids)
+
+    def id_mask(self, ids):
+        """Boolean row mask selecting `ids`, for restricting a query to candidates."""
+        if self._rows is None:
+            self._rows = {car_id: row for row, car_id in enumerate(self.ids)}
+        mask = np.zeros(len(self.ids), dtype=bool)
+        mask[[self._rows[car_id] for car_id in ids if car_id in self._rows]] = True
+        return mask
+
+    @classmethod
+    def from_cars(cls, cars):
+        embeddings = get_embeddings([car_text(car) for car in cars])
+        return cls([car["id"] for car in cars], np.asarray(embeddings, dtype=np.float32))
+
+    def save(self, path):
+        """Write the matrix to `path` (.npy) and the ids next to it, atomically."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, self.matrix)
+        with open(f"{tmp_path}.ids", "w", encoding="utf-8") as f:
+            json.dump(self.ids, f)
+        os.replace(f"{tmp_path}.ids", f"{path}.ids.json")
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        with open(f"{path}.ids.json", encoding="utf-8") as f:
+            ids = json.load(f)
+        matrix = np.load(path, mmap_mode="r" if mmap else None)
+        return cls(ids, matrix, normalized=True)
+
+    @staticmethod
+    def _normalize(vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def _top_k(self, scores, top_k):
+        k = min(top_k, scores.shape[-1])
+        if k <= 0:
+            return np.empty(scores.shape[:-1] + (0,), dtype=np.intp)
+        top = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+        order = np.argsort(-np.take_along_axis(scores, top, axis=-1), axis=-1)
+        return np.take_along_axis(top, order, axis=-1)
+
+    def query_batch(self, vectors, top_k=5, mask=None):
+        """Top-k (id, score) lists for each query vector.
+
+        `mask` is an optional boolean array over the index rows; rows where it
+        is False are never returned.
+        """
+        scores = self._normalize(vectors) @ self.matrix.T
+        if mask is not None:
+            scores = np.where(mask, scores, -np.inf)
+        results = []
+        for row_scores, row_top in zip(scores, self._top_k(scores, top_k)):
+            results.append([
+                (self.ids[i], float(row_scores[i])) for i in row_top if np.isfinite(row_scores[i])
+            ])
+        return results
+
+    def query(self, vector, top_k=5, mask=None):
+        return self.query_batch([vector], top_k, mask)[0]
+
+
+def open_vector_index():
+    fingerprint = catalog_fingerprint(catalog.cars, embedding_model())
+    path = os.path.join(VECTOR_INDEX_DIR, f"{fingerprint}.npy")
+    if os.path.exists(path) and os.path.exists(f"{path}.ids.json"):
+        return NumpyVectorIndex.load(path, mmap=VECTOR_INDEX_MMAP)
+    index = NumpyVectorIndex.from_cars(catalog.cars)
+    index.save(path)
+    return index
+
+
+vector_index = subsystems.register("vector_index", open_vector_index, enabled=use_numpy_backend())
+
+
+def get_vector_index():
+    """Shared index for this process, memory-mapped from disk when the catalog is unchanged."""
+    return vector_index.get()
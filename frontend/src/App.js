@@ -11,7 +11,6 @@ import {
   FiVolumeX,
 } from "react-icons/fi";
 import { RiChatNewLine } from "react-icons/ri";
-import axios from "axios";
 import Markdown from 'react-markdown'
 import remarkGfm from 'remark-gfm'
 import MIC from "./Mic";
@@ -302,6 +301,118 @@ const CustomReactMarkdown = ({ content, className }) => (
   </Markdown>
 );
 
+// POST to the SSE chat endpoint and call onEvent(event, data) for every event.
+const newSessionId = () =>
+  window.crypto?.randomUUID ? window.crypto.randomUUID() : `${Date.now()}-${Math.random()}`;
+
+const readChatStream = async (payload, onEvent) => {
+  const response = await fetch("/api/chat/stream", {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify(payload),
+  });
+  if (!response.ok || !response.body) {
+    throw new Error(`Chat stream failed with status ${response.status}`);
+  }
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let boundary = buffer.indexOf("\n\n");
+    while (boundary !== -1) {
+      const rawEvent = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      let event = "message";
+      let data = "";
+      rawEvent.split("\n").forEach((line) => {
+        if (line.startsWith("event:")) event = line.slice(6).trim();
+        else if (line.startsWith("data:")) data += line.slice(5).trim();
+      });
+      if (data) onEvent(event, JSON.parse(data));
+      boundary = buffer.indexOf("\n\n");
+    }
+  }
+};
+
+// Play the streamed WAV from /api/getaudio/stream while it is still being
+// synthesized: every PCM chunk is scheduled right after the previous one.
+const playAudioStream = (id, text, onFirstAudio) => {
+  const ctx = new AudioContext();
+  const controller = new AbortController();
+  const sources = [];
+  let stopped = false;
+
+  const stop = () => {
+    stopped = true;
+    controller.abort();
+    sources.forEach((source) => {
+      try {
+        source.stop();
+      } catch (_) {
+        //
+      }
+    });
+    ctx.close();
+  };
+
+  const done = (async () => {
+    const response = await fetch("/api/getaudio/stream", {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ id, text }),
+      signal: controller.signal,
+    });
+    if (!response.ok || !response.body) {
+      throw new Error(`Audio stream failed with status ${response.status}`);
+    }
+    const reader = response.body.getReader();
+    let pending = new Uint8Array(0);
+    let headerRead = false;
+    let sampleRate = 16000;
+    let startAt = 0;
+    while (!stopped) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      let bytes = new Uint8Array(pending.length + value.length);
+      bytes.set(pending);
+      bytes.set(value, pending.length);
+      if (!headerRead) {
+        if (bytes.length < 44) {
+          pending = bytes;
+          continue;
+        }
+        sampleRate = new DataView(bytes.buffer).getUint32(24, true);
+        bytes = bytes.subarray(44);
+        headerRead = true;
+      }
+      // 16-bit samples may be split across network chunks.
+      const usable = bytes.length - (bytes.length % 2);
+      pending = bytes.slice(usable);
+      if (!usable) continue;
+      const view = new DataView(bytes.buffer, bytes.byteOffset, usable);
+      const samples = new Float32Array(usable / 2);
+      for (let i = 0; i < samples.length; i++) {
+        samples[i] = view.getInt16(i * 2, true) / 32768;
+      }
+      const buffer = ctx.createBuffer(1, samples.length, sampleRate);
+      buffer.copyToChannel(samples, 0);
+      const source = ctx.createBufferSource();
+      source.buffer = buffer;
+      source.connect(ctx.destination);
+      startAt = Math.max(startAt, ctx.currentTime + 0.05);
+      source.start(startAt);
+      startAt += buffer.duration;
+      sources.push(source);
+      if (sources.length === 1 && onFirstAudio) onFirstAudio();
+    }
+  })();
+
+  return { stop, done };
+};
+
 const scrollChatView = () => {
   const messagesEndRef = document.getElementById("messagesEndRef");
   messagesEndRef?.scrollIntoView({ behavior: "smooth" });
@@ -324,6 +435,9 @@ function App() {
   const [isLoadingAudio, setIsLoadingAudio] = useState(false);
   const messagesEndRef = useRef(null);
   const [useMic, setMic] = useState(false)
+  // The backend keeps this conversation's history under this id, and cancels
+  // the background audio of a reply once a newer message is sent.
+  const sessionIdRef = useRef(newSessionId());
 
   const scrollToBottom = () => {
     messagesEndRef.current?.scrollIntoView({ behavior: "smooth" });
@@ -347,80 +461,12 @@ function App() {
     return () => document.removeEventListener("click", handleClick);
   }, []);
 
-  const setPayloadToSendMessage = (inputValue) => {
-    const payLoad = {};
-
-    if (inputValue.length !== 0) {
-      const lowerInputValue = inputValue.toLowerCase();
-      const indexFindImage =
-        lowerInputValue.includes("tìm ảnh") ||
-        lowerInputValue.includes("tìm hình ảnh") ||
-        lowerInputValue.includes("image") ||
-        lowerInputValue.includes("photo");
-      if (indexFindImage)
-        payLoad.isFunctionCall = true;
-
-      const indexDatabaseQuery =
-        lowerInputValue.includes("tư vấn") ||
-        lowerInputValue.includes("đề xuất")
-      if (indexDatabaseQuery)
-        payLoad.isDatabaseQuery = true;
-
-      const indexSimilarCarQuery =
-        lowerInputValue.includes("gợi ý") ||
-        lowerInputValue.includes("tương tự") ||
-        lowerInputValue.includes("recommend");
-      if (indexSimilarCarQuery)
-        payLoad.isSimilarCarQuery = true;
-
-      const indexLangchainSearch =
-        lowerInputValue.includes("tìm kiếm")
-      if (indexLangchainSearch)
-        payLoad.isLangchainSearch = true;
-
-      if (lowerInputValue.includes("so sánh"))
-        inputValue += " trả lời dưới dạng bảng ví dụ như sau | Header 1 | Header 2 | Header 3 | | :------- | :------: | -------: | | Row 1 Col 1 | Row 1 Col 2 | Row 1 Col 3 | | Row 2 Col 1 | Row 2 Col 2 | Row 2 Col 3 |"
-    }
-    const lastFewMessages = messages.map((item) => {
-      return {
-        role: item.isUser ? "user" : "assistant",
-        content: item.text,
-      };
-    });
-    let idx = 1;
-    while (idx < lastFewMessages.length) {
-      const x = lastFewMessages[idx];
-      const rejectContent = x.content.toLowerCase();
-      const indexRejectContent =
-        rejectContent.indexOf("xin lỗi") ??
-        rejectContent.indexOf("đặt lại câu hỏi") ??
-        rejectContent.indexOf("ngoài phạm vi");
-
-      if (x.content && indexRejectContent !== -1) {
-        lastFewMessages.splice(idx - 1, 2);
-      } else idx++;
-    }
-    lastFewMessages.push({ role: "user", content: inputValue });
-    const roleSystem = {
-      role: "system",
-      content: `Bạn là một chuyên gia sale trong lĩnh vực mua bán xe hơi tại thị trường Việt Nam.
-Nhiệm vụ của bạn là hỗ trợ, tư vấn và giải đáp các thắc mắc liên quan trực tiếp đến việc mua bán, lựa chọn, sử dụng, đánh giá, tài chính, bảo hiểm, thủ tục pháp lý, dịch vụ hậu mãi và các vấn đề kỹ thuật của xe hơi tại Việt Nam.
-Bạn cũng có thể hỗ trợ cung cấp thông tin liên hệ công khai (như số điện thoại, địa chỉ, website...) của các đại lý, showroom, trung tâm dịch vụ xe ô tô tại Việt Nam nếu người dùng yêu cầu, miễn đó là thông tin hợp lệ, công khai và không vi phạm quyền riêng tư.
-Bạn cũng có thể hỗ trợ người dùng tìm kiếm, giới thiệu và cung cấp hình ảnh minh họa (nếu có) về các mẫu xe hơi, các bộ phận, phụ kiện, hoặc các dịch vụ liên quan đến xe ô tô tại thị trường Việt Nam.
-Nếu người dùng đưa ra bất kỳ câu hỏi, yêu cầu hoặc thông tin nào không hoàn toàn nằm trong phạm vi lĩnh vực mua bán xe hơi và các vấn đề liên quan trực tiếp đến xe hơi, bạn phải trả lời: "Xin lỗi bạn đây là câu hỏi nằm ngoài lĩnh vực của tôi. Xin hãy đặt lại câu hỏi."
-Nếu người dùng đặt câu hỏi hoặc câu nói quá chung chung, không rõ ràng nhưng có thể liên quan đến ô tô hoặc lĩnh vực kinh doanh xe hơi (ví dụ: chỉ nói về "bánh xe", "hợp đồng", "giấy tờ", v.v...), bạn hãy trả lời bằng cách:
--Gợi ý cho người dùng về các chủ đề xoay quanh lĩnh vực ô tô và kinh doanh xe hơi liên quan đến từ khóa họ vừa đề cập.
--Đặt câu hỏi ngược lại để người dùng làm rõ hơn ý của họ hoặc mong muốn nhận được thông tin gì về chủ đề đó trong lĩnh vực mua bán xe ô tô.
-Ví dụ: Nếu người dùng chỉ nói "bánh xe", bạn có thể trả lời: "Bạn muốn hỏi về việc lựa chọn bánh xe phù hợp cho xe ô tô, cách bảo dưỡng bánh xe, hay chi phí thay bánh xe khi mua bán? Xin hãy nói rõ hơn để tôi hỗ trợ bạn tốt nhất."
-Nếu người dùng chỉ nói "hợp đồng", bạn có thể trả lời: "Bạn đang quan tâm đến hợp đồng mua bán xe ô tô, hợp đồng bảo hiểm, hay thủ tục pháp lý khi ký hợp đồng xe hơi? Bạn có thể nói rõ hơn để tôi tư vấn chi tiết hơn cho bạn."
-Luôn giữ vai trò là chuyên gia sale xe ô tô, chỉ tập trung vào các nội dung liên quan trực tiếp đến lĩnh vực này.
-Nếu câu hỏi có cả nội dung ngoài lĩnh vực ô tô, vẫn trả lời từ chối như trên. Câu trả lời thêm nhiều emoticon sinh động`,
-    };
-    // lastFewMessages.unshift(roleSystem);
-    payLoad.promptMessageList = lastFewMessages.slice(-10);
-    payLoad.promptMessageList.unshift(roleSystem);
-    return payLoad;
-  };
+  // The conversation is kept on the server under this session id, so only
+  // the new message is sent; the backend adds the system prompt and history.
+  const setPayloadToSendMessage = (inputValue) => ({
+    sessionId: sessionIdRef.current,
+    message: inputValue,
+  });
   const sendMessage = async (text) => {
     let newMess = (text || inputValue) + "";
     if (!newMess.trim() || isLoading) return;
@@ -435,21 +481,46 @@ Nếu câu hỏi có cả nội dung ngoài lĩnh vực ô tô, vẫn trả lờ
     setInputValue("");
     setIsLoading(true);
     const payload = setPayloadToSendMessage(newMess);
+    // Tokens are rendered as they arrive; the message keeps this id while it
+    // streams so the typewriter is not remounted when the reply completes.
+    const botMessageId = Date.now() + 1;
+    let streamedText = "";
+    let started = false;
     try {
-      const response = await axios.post("/api/chat", payload);
-
-      const botMessage = {
-        id: response.data.response?.id || Date.now() + 1,
-        text: response.data.response?.message || "",
-        images: response.data.images,
-        isUser: false,
-        timestamp: new Date(),
-        audioId: response.data.response?.id,
-      };
-      // response.data.response?.message &&
-      //   handlePlayAudio(botMessage.audioId, true);
-      setMessages((prev) => [...prev.slice(-10), botMessage]);
-      console.log("messages", messages);
+      await readChatStream(payload, (event, data) => {
+        if (event === "token") {
+          streamedText += data.delta;
+          const text = streamedText;
+          if (!started) {
+            started = true;
+            setIsLoading(false);
+            setMessages((prev) => [
+              ...prev.slice(-10),
+              { id: botMessageId, text, isUser: false, timestamp: new Date() },
+            ]);
+          } else {
+            setMessages((prev) =>
+              prev.map((item) => (item.id === botMessageId ? { ...item, text } : item))
+            );
+          }
+        } else if (event === "done") {
+          const botMessage = {
+            id: botMessageId,
+            text: streamedText,
+            images: data.imageList || data.images,
+            isUser: false,
+            timestamp: new Date(),
+            audioId: data.id,
+          };
+          setMessages((prev) =>
+            started
+              ? prev.map((item) => (item.id === botMessageId ? botMessage : item))
+              : [...prev.slice(-10), botMessage]
+          );
+        } else if (event === "error") {
+          throw new Error(data.error);
+        }
+      });
     } catch (error) {
       console.error("Error sending message:", error);
       const errorMessage = {
@@ -491,8 +562,17 @@ Nếu câu hỏi có cả nội dung ngoài lĩnh vực ô tô, vẫn trả lờ
     });
   };
 
+  // A new chat gets a new session id, so the server starts its history empty;
+  // the old conversation is dropped from the server's session store.
   const handleNewChat = async () => {
+    const oldSessionId = sessionIdRef.current;
+    sessionIdRef.current = newSessionId();
     setMessages([...startMessage]);
+    try {
+      await fetch(`/api/session?sessionId=${encodeURIComponent(oldSessionId)}`, { method: "DELETE" });
+    } catch (error) {
+      console.error("Error clearing session:", error);
+    }
   }
 
   const handlePlayAudio = async (id, text, force) => {
@@ -503,24 +583,11 @@ Nếu câu hỏi có cả nội dung ngoài lĩnh vực ô tô, vẫn trả lờ
     try {
       setPlay(true);
       setIsLoadingAudio(true);
-      const response = await axios.post(
-        "/api/getaudio",
-        { id, text },
-        { responseType: "arraybuffer" },
-      );
-      const buf = (await response?.data) || [];
-      const ctx = new AudioContext();
-      const audio = await ctx.decodeAudioData(buf);
-      const src = ctx.createBufferSource();
-      src.buffer = audio;
-      src.connect(ctx.destination);
-      src.start(0);
-      setSrc(src);
-      setTimeout(() => {
-        setIsLoadingAudio(false);
-      }, 750);
+      const player = playAudioStream(id, text, () => setIsLoadingAudio(false));
+      setSrc(player);
+      await player.done;
     } catch (_) {
-      //
+      setIsLoadingAudio(false);
     }
   };
 
@@ -562,17 +629,20 @@ Nếu câu hỏi có cả nội dung ngoài lĩnh vực ô tô, vẫn trả lờ
               {message.text}
             </Markdown> :
               <TypewriterEffect processedText={message.text} textStep={messages[messages.length - 1].isUser ? 200 : 0} onRenderingEnd={() => { }} />}
-            {message.images ? (
-              <img
-                src={message.images}
-                alt="car"
-                style={{
-                  maxWidth: "100%",
-                  marginTop: "10px",
-                  borderRadius: "8px",
-                }}
-              />
-            ) : null}
+            {message.images
+              ? [].concat(message.images).map((src) => (
+                  <img
+                    key={src}
+                    src={src}
+                    alt="car"
+                    style={{
+                      maxWidth: "100%",
+                      marginTop: "10px",
+                      borderRadius: "8px",
+                    }}
+                  />
+                ))
+              : null}
           </MessageContent>
           <div
             className="row-inline-between w-100"